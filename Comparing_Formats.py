@@ -2,13 +2,26 @@
 import streamlit as st
 import polars as pl
 import pandas as pd
-import altair as alt
 import re
 from collections import Counter
 import numpy as np
-import matplotlib.pyplot as plt
-import plotly.express as px
+import sys
+from pathlib import Path
+
+# Shared modules (mapping, caches, exports) live next to the Docker app
+sys.path.append(str(Path(__file__).parent / "Docker-Streamlit"))
 #from marc_bibliography_mapping import marc_field_mapping_bibliographic_flat
+from datasets import column_catalog, fingerprint_frame, load_dataset, pandas_view, scan, scan_partitioned
+from marc_fields import find_column
+from column_stats import columns_of_kind, non_empty_columns, profile_table
+from result_cache import cached_analysis
+from dates import DATE_COLUMNS, MODIFIED_MONTH, cross_validation_summary, date_precision_summary, modification_months
+from publishers import DEFAULT_THRESHOLD as DEFAULT_PUBLISHER_THRESHOLD, cluster_publishers
+from plotting import express
+from cube import DIMENSIONS, load_cube, query as query_cube
+from jobs import JOBS, JobRejected, job_progress, poll_pending
+from koha import KOHA_URL, load_koha
+from sampling import PREVIEW_MIN_ROWS, PREVIEW_ROWS, SAMPLE_COLUMNS, estimate_shares, preview_caption, stratified_sample
 
 if "df" not in st.session_state:
     st.session_state["df"] = None
@@ -28,7 +41,13 @@ def remove_digits(series: pl.Series) -> pl.Series:
     return series.str.replace_all(pattern, "")
 
 def drop_columns_that_are_all_null(_df: pl.DataFrame) -> pl.DataFrame:
-    return _df[[s.name for s in _df if not (s.null_count() == _df.height)]]
+    return _df.select(non_empty_columns(column_catalog(_df)))
+
+def prepare_upload(raw: pl.DataFrame) -> pl.DataFrame:
+    # Rename columns using your mapping logic
+    #df = raw.rename({tag: marc_field_mapping_bibliographic_flat.get(tag, tag) for tag in raw.columns})
+    # All-null columns are dropped by load_dataset from the column statistics catalog
+    return raw.rename({col: col.strip() for col in raw.columns}) # Remove white space in the column names
 
 def process_and_combine_files(file_names: list) -> pl.DataFrame:
 
@@ -79,11 +98,37 @@ def process_and_combine_files(file_names: list) -> pl.DataFrame:
 #     else:
 #         return "Other"
 
+date_pattern_types = {
+    "YYYYMMDDHHMMSS.MS": r"^\d{4}\d{2}\d{2}\d{2}\d{2}\d{2}\.\d+$",
+    "YYYY-": r"^\d{4}-$",
+    "YY": r"^\d{2}$",
+    "YYYY-YYYY": r"^\d{4}-\d{4}$",
+    "YYYY": r"^\d{4}$",
+    "YYYYMMDD": r"^\d{8}$",
+    "YYYY/MM/DD": r"^\d{4}/\d{2}/\d{2}$",
+    "YYYY-MM-DD": r"^\d{4}-\d{2}-\d{2}$",
+    "YYYY-MM":r"^\d{4}-\d{2}$",
+    "YYYY/MM": r"^\d{4}/\d{2}$",
+    "YYYYMM": r"^\d{6}$",
+    "letter. YYYY": r"^a\.\s\d{4}$",
+    "letter. YYYY-": r"^a\.\s\d{4}-$",
+    "letter. YYYY-YYYY": r"^a\.\s\d{4}-\d{4}$",
+    "letter. YYYYMMDD": r"^a\.\s\d{8}$",
+    "letter. YYYYMM": r"^a\.\s\d{6}$",
+    "letter. YYYY-MM-DD": r"^a\.\s\d{4}-\d{2}-\d{2}$",
+    "letter. YYYY/MM/DD": r"^a\.\s\d{4}/\d{2}/\d{2}$",
+    "MMDDYYYY": r"^\d{8}$",
+    "MM/DD/YYYY": r"^\d{2}/\d{2}/\d{4}$",
+}
+
+# Function to match patterns and replace with format type
 def identify_format(date_value):
+    if date_value == "":  # Check for blank values
+        return "Empty"
     for format_type, pattern in date_pattern_types.items():
         if re.match(pattern, date_value):
             return format_type
-    return "Unknown"
+    return "Other"  # If no match is found
 
 def count_special_characters(series: pl.Series) -> pl.DataFrame:
     char_counts = Counter()
@@ -104,10 +149,87 @@ def count_special_characters(series: pl.Series) -> pl.DataFrame:
 #     # IMPORTANT: Cache the conversion to prevent computation on every rerun
 #     return df.write_csv().encode("utf-8")
 
-@st.cache_data
-def convert_df(_df: pl.DataFrame) -> bytes:
-    # IMPORTANT: Cache the conversion to prevent computation on every rerun
-    return _df.write_csv().encode("utf-8")
+def format_pairs(_df: pl.DataFrame | pl.LazyFrame, selected_x: str, selected_y: str, transformation: str) -> pl.DataFrame:
+    transform = remove_non_special_chars if transformation == "Remove Non-special Characters" else remove_digits
+    mapping = {"": np.nan, None: np.nan}
+    # Only the two heatmap columns are read from a scanned dataset
+    pairs = _df.lazy().select(selected_x, selected_y).collect()
+    df_y = transform(pairs[selected_y]).alias(selected_y).replace(mapping)
+    df_x = transform(pairs[selected_x]).alias(selected_x).replace(mapping)
+    return pl.DataFrame([df_x, df_y])
+
+@cached_analysis("format_crosstab")
+def format_crosstab(fingerprint: str, _df: pl.DataFrame | pl.LazyFrame, selected_x: str, selected_y: str, transformation: str) -> pl.DataFrame:
+    df_x_y = format_pairs(_df, selected_x, selected_y, transformation)
+
+    return (
+        df_x_y
+        .group_by([selected_x, selected_y])
+        .agg(pl.len().alias("Count"))
+        .pivot(selected_x, index=selected_y, values='Count', aggregate_function="sum")).fill_null(0)
+
+def date_formats(_df: pl.DataFrame | pl.LazyFrame, selected_column: str) -> pl.Series:
+    column = _df.lazy().select(selected_column).collect().get_column(selected_column)
+    return column.map_elements(identify_format, return_dtype=pl.String).alias("format")
+
+@cached_analysis("date_formats")
+def date_format_counts(fingerprint: str, _df: pl.DataFrame | pl.LazyFrame, selected_column: str) -> pl.DataFrame:
+    df_date_format = date_formats(_df, selected_column).to_frame()
+
+    df_date_format = df_date_format.select(pl.col("format").value_counts())
+    df_date_formats = df_date_format.unnest("format").rename({"format": "Format", "count": "Count"})
+    total_date_patterns = df_date_formats.select(pl.sum("Count")).item()
+
+    df_date_formats = df_date_formats.with_columns(
+        pl.col("Format").fill_null("Empty").alias("Format")
+    )
+
+    date_pattern_df = df_date_formats.with_columns(
+        (pl.col("Count") / total_date_patterns * 100).round(2).alias("Percentage")
+    )
+
+    return date_pattern_df.sort("Percentage", descending=False)
+
+@cached_analysis("date_precisions")
+def date_precisions(fingerprint: str, _df: pl.DataFrame | pl.LazyFrame) -> pl.DataFrame:
+    return date_precision_summary(_df.lazy())
+
+@cached_analysis("date_cross_validation")
+def date_cross_validation(fingerprint: str, _df: pl.DataFrame | pl.LazyFrame) -> pl.DataFrame:
+    return cross_validation_summary(_df.lazy())
+
+@cached_analysis("last_modified_months")
+def last_modified_months(fingerprint: str, _df: pl.DataFrame | pl.LazyFrame) -> pl.DataFrame:
+    return modification_months(_df.lazy())
+
+@cached_analysis("preview_sample")
+def preview_sample(fingerprint: str, _df: pl.DataFrame, size: int) -> pl.DataFrame:
+    return stratified_sample(_df, size)
+
+@cached_analysis("format_crosstab_preview")
+def format_crosstab_preview(fingerprint: str, _sample: pl.DataFrame, selected_x: str, selected_y: str, transformation: str) -> dict:
+    # Same table as format_crosstab, with counts estimated from the stratified sample
+    pairs = format_pairs(_sample, selected_x, selected_y, transformation).hstack(_sample.select(SAMPLE_COLUMNS))
+    estimates = estimate_shares(pairs, [selected_x, selected_y])
+    crosstab = estimates.pivot(selected_x, index=selected_y, values="Count", aggregate_function="sum").fill_null(0)
+    return {'crosstab': crosstab, 'estimates': estimates}
+
+@cached_analysis("date_formats_preview")
+def date_format_preview(fingerprint: str, _sample: pl.DataFrame, selected_column: str) -> pl.DataFrame:
+    formats = _sample.select(SAMPLE_COLUMNS).with_columns(date_formats(_sample, selected_column).fill_null("Empty").alias("Format"))
+    return estimate_shares(formats, ["Format"]).sort("Percentage", descending=False)
+
+def submit_exact(key: str, name: str, func, *args):
+    # Background exact pass for a preview; None when admission control turns it away
+    try:
+        return JOBS.submit(key, name, func, *args)
+    except JobRejected as error:
+        st.info(f"Showing the preview only: {error}")
+        return None
+
+@cached_analysis("publisher_clusters")
+def publisher_clusters(fingerprint: str, _df: pl.DataFrame, threshold: int) -> pl.DataFrame:
+    return cluster_publishers(_df, threshold)
 
 
 ################################## End of Imports and Function Declarations ##################################
@@ -119,7 +241,7 @@ st.set_page_config(
     initial_sidebar_state="expanded"
     )
 
-tab1, tab2 = st.tabs(["Comparing Formats", "Comparing Dates"])
+tab1, tab2, tab3, tab4 = st.tabs(["Comparing Formats", "Comparing Dates", "Publisher Names", "Record Summary"])
 
 uploaded_file = st.file_uploader(
     "Upload your MARC records file",
@@ -129,24 +251,43 @@ uploaded_file = st.file_uploader(
 )
 
 if uploaded_file:
-    # Load data into Polars DataFrame
+    # Parsed and cleaned once per upload; every session opening the same file maps the same Arrow IPC pages
     try:
-        raw = pl.read_excel(uploaded_file)
+        fingerprint, df = load_dataset(uploaded_file, prepare_upload)
     except Exception as e:
         st.error(f"Error reading file: {e}")
         st.stop()
 
-    raw = pl.read_excel(uploaded_file)
-    
-    # Rename columns using your mapping logic
-    #df = raw.rename({tag: marc_field_mapping_bibliographic_flat.get(tag, tag) for tag in raw.columns})
-    raw_cleaned = drop_columns_that_are_all_null(raw)
-    df = raw_cleaned.rename({col: col.strip() for col in raw_cleaned.columns}) # Remove white space in the column names
+    st.session_state["fingerprint"] = fingerprint
     st.session_state["df"] = df # ensures that the uploaded file's DataFrame persists without needing to re-upload after each interaction
 
+elif KOHA_URL and st.sidebar.button("Load the catalog from Koha", key="koha_load"):
+    # Read straight from the Koha database; it is only read again once records or items changed
+    try:
+        with st.spinner("Reading the catalog from Koha..."):
+            fingerprint, df = load_koha(KOHA_URL, prepare_upload)
+    except Exception as e:
+        st.error(f"Error reading from Koha: {e}")
+        st.stop()
+
+    st.session_state["fingerprint"] = fingerprint
+    st.session_state["df"] = df
 
 if "df" in st.session_state and st.session_state["df"] is not None:
     df = st.session_state["df"]
+    fingerprint = st.session_state.get("fingerprint") or fingerprint_frame(df)
+    # Analyses build lazy plans over the dataset's Parquet copy and read only the columns they use
+    lf = scan(df)
+    # Selectors and the column profile come from the statistics catalog stored at ingest
+    catalog = column_catalog(df)
+    catalog_columns = catalog.get_column("column").to_list()
+    column_kinds = dict(zip(catalog_columns, catalog.get_column("kind")))
+
+    # Large uploads start in preview mode: figures come from a stratified sample right away while the
+    # exact pass runs as a background job, and are replaced once it is done
+    preview_mode = st.sidebar.toggle("Preview on a sample", value=df.height > PREVIEW_MIN_ROWS, key="preview_mode")
+    sample = preview_sample(fingerprint, df, PREVIEW_ROWS) if preview_mode else None
+    pending_jobs = []
 
     with tab1:
         st.title("Identify Formatting Patterns")
@@ -158,9 +299,12 @@ if "df" in st.session_state and st.session_state["df"] is not None:
         3. Generate a heatmap to explore relationships.
         """)
 
+        with st.expander("Column profile", expanded=False):
+            st.dataframe(profile_table(catalog).to_pandas(), use_container_width=True)
+
         with st.sidebar:
             # Define possible x-axis columns
-            possible_x = df.columns  # Ensure it's a list for easier indexing
+            possible_x = catalog_columns  # Ensure it's a list for easier indexing
             
             # Set the default x-axis value
             default_x_value = "LDR.1"  # Replace with your desired default column name
@@ -170,7 +314,8 @@ if "df" in st.session_state and st.session_state["df"] is not None:
             selected_x = st.selectbox(
                 "Select an x-axis:", 
                 possible_x, 
-                index=default_x_index
+                index=default_x_index,
+                format_func=lambda col: f"{col} ({column_kinds[col]})"
             )
             
             # Define possible y-axis columns, excluding the selected x-axis column
@@ -184,7 +329,8 @@ if "df" in st.session_state and st.session_state["df"] is not None:
             selected_y = st.selectbox(
                 "Select a y-axis:", 
                 possible_y, 
-                index=default_y_index
+                index=default_y_index,
+                format_func=lambda col: f"{col} ({column_kinds[col]})"
             )
 
 
@@ -193,19 +339,6 @@ if "df" in st.session_state and st.session_state["df"] is not None:
                 options=["Remove Non-special Characters", "Remove Digits"],
                 key="y_action"
             )
-            mapping = {"": np.nan, None: np.nan}
-            if y_option == "Remove Non-special Characters":
-                df_y = remove_non_special_chars(df[selected_y]).alias(selected_y)
-                df_y = df_y.replace(mapping)
-                df_x = remove_non_special_chars(df[selected_x]).alias(selected_x)
-                df_x = df_x.replace(mapping)
-                df_x_y = pl.DataFrame([df_x, df_y])
-            else:
-                df_y = remove_digits(df[selected_y]).alias(selected_y)
-                df_y = df_y.replace(mapping)
-                df_x = remove_digits(df[selected_x]).alias(selected_x)
-                df_x = df_x.replace(mapping)
-                df_x_y = pl.DataFrame([df_x, df_y])
 
         # df_transformed = (
         #     df_x_y
@@ -223,11 +356,22 @@ if "df" in st.session_state and st.session_state["df"] is not None:
 
         # df_plot = df_transformed.melt(id_vars=selected_x, var_name="Format", value_name="Count")
 
-        df_transformed = (
-        df_x_y
-        .group_by([selected_x, selected_y])
-        .agg(pl.len().alias("Count"))
-        .pivot(selected_x, index=selected_y, values='Count', aggregate_function="sum")).fill_null(0).to_pandas()
+        crosstab_job = None
+        if preview_mode:
+            crosstab_job = submit_exact(f"format_crosstab-{fingerprint}-{selected_x}-{selected_y}-{y_option}", "Exact heatmap", format_crosstab, fingerprint, lf, selected_x, selected_y, y_option)
+        if not preview_mode:
+            df_transformed = pandas_view(format_crosstab(fingerprint, lf, selected_x, selected_y, y_option))
+        elif crosstab_job is not None and crosstab_job.status == "done":
+            df_transformed = pandas_view(crosstab_job.result)
+        else:
+            preview = format_crosstab_preview(fingerprint, sample, selected_x, selected_y, y_option)
+            df_transformed = pandas_view(preview['crosstab'])
+            st.caption(preview_caption(sample, df.height))
+            with st.expander("Estimated counts with confidence intervals", expanded=False):
+                st.dataframe(preview['estimates'].to_pandas(), use_container_width=True)
+            if crosstab_job is not None:
+                job_progress(crosstab_job, key="format_crosstab")
+                pending_jobs.append(crosstab_job)
 
         df_plot = df_transformed.set_index(selected_y)
 
@@ -245,6 +389,7 @@ if "df" in st.session_state and st.session_state["df"] is not None:
         # # Displaying the Altair heatmap in Streamlit
         # st.altair_chart(heatmap, use_container_width=True)
 
+        px = express()
         heatmap = px.imshow(df_plot, 
                 labels={'x': selected_x,
                         'y': selected_y,
@@ -293,71 +438,34 @@ if "df" in st.session_state and st.session_state["df"] is not None:
         if uploaded_file:
             st.title("Analyze Date Patterns")
 
-            date_columns_names = [
-                "005.1.", "100.1.d", "110.1.d", "245.1.f", "245.1.g", "260.1.c", 
-                "264.1.c", "600.1.d", "610.1.9", "700.1.d", "362.1.a", "610.1.d", 
-                "046.1.a", "046.1.b", "046.1.j", "240.1.d", "240.1.f", "362.1.b"
-            ]
-            existing_columns = [col for col in date_columns_names if col in df.columns]
-
-            df_date = df.select(existing_columns)
+            # The known date fields first, then any other column whose values mostly parse as dates
+            date_like = columns_of_kind(catalog, "date-like")
+            date_columns_names = DATE_COLUMNS + [col for col in date_like if col not in DATE_COLUMNS]
+            existing_columns = [col for col in date_columns_names if col in catalog_columns]
 
             # Allow user to select a column for analysis
-            selected = st.selectbox("Select a column for analysis:", df_date.columns)
+            selected = st.selectbox("Select a column for analysis:", existing_columns)
             if selected:
                 st.write(f"Analyzing column: **{selected}**") 
                 selected_column = selected
-                date_pattern_types = {
-                    "YYYYMMDDHHMMSS.MS": r"^\d{4}\d{2}\d{2}\d{2}\d{2}\d{2}\.\d+$",
-                    "YYYY-": r"^\d{4}-$",
-                    "YY": r"^\d{2}$",
-                    "YYYY-YYYY": r"^\d{4}-\d{4}$",
-                    "YYYY": r"^\d{4}$",
-                    "YYYYMMDD": r"^\d{8}$",
-                    "YYYY/MM/DD": r"^\d{4}/\d{2}/\d{2}$",
-                    "YYYY-MM-DD": r"^\d{4}-\d{2}-\d{2}$",
-                    "YYYY-MM":r"^\d{4}-\d{2}$",
-                    "YYYY/MM": r"^\d{4}/\d{2}$",
-                    "YYYYMM": r"^\d{6}$",
-                    "letter. YYYY": r"^a\.\s\d{4}$",
-                    "letter. YYYY-": r"^a\.\s\d{4}-$",
-                    "letter. YYYY-YYYY": r"^a\.\s\d{4}-\d{4}$",
-                    "letter. YYYYMMDD": r"^a\.\s\d{8}$",
-                    "letter. YYYYMM": r"^a\.\s\d{6}$",
-                    "letter. YYYY-MM-DD": r"^a\.\s\d{4}-\d{2}-\d{2}$",
-                    "letter. YYYY/MM/DD": r"^a\.\s\d{4}/\d{2}/\d{2}$",
-                    "MMDDYYYY": r"^\d{8}$",
-                    "MM/DD/YYYY": r"^\d{2}/\d{2}/\d{4}$",
-                }
-
-                # Function to match patterns and replace with format type
-                def identify_format(date_value):
-                    if date_value == "":  # Check for blank values
-                        return "Empty"
-                    for format_type, pattern in date_pattern_types.items():
-                        if re.match(pattern, date_value):
-                            return format_type
-                    return "Other"  # If no match is found
-
-               
-                df_date_format = df_date.select(
-                    pl.col(selected_column).map_elements(identify_format).alias("format"))
-
-               
-                df_date_format = df_date_format.select(pl.col("format").value_counts())
-                df_date_formats = df_date_format.unnest("format").rename({"format": "Format", "count": "Count"})
-                total_date_patterns = df_date_formats.select(pl.sum("Count")).item()
-
-                df_date_formats = df_date_formats.with_columns(
-                    pl.col("Format").fill_null("Empty").alias("Format")
-                )
-
-                date_pattern_df = df_date_formats.with_columns(
-                    (pl.col("Count") / total_date_patterns * 100).round(2).alias("Percentage")
-                )
-
-                date_pattern_df = date_pattern_df.sort("Percentage", descending=False)
-
+                date_job = None
+                if preview_mode:
+                    date_job = submit_exact(f"date_formats-{fingerprint}-{selected_column}", "Exact date patterns", date_format_counts, fingerprint, lf, selected_column)
+                if not preview_mode:
+                    date_pattern_df = date_format_counts(fingerprint, lf, selected_column)
+                elif date_job is not None and date_job.status == "done":
+                    date_pattern_df = date_job.result
+                else:
+                    date_pattern_df = date_format_preview(fingerprint, sample, selected_column)
+                    st.caption(preview_caption(sample, df.height))
+                    with st.expander("Estimated shares with confidence intervals", expanded=False):
+                        st.dataframe(date_pattern_df.to_pandas(), use_container_width=True)
+                    if date_job is not None:
+                        job_progress(date_job, key="date_formats")
+                        pending_jobs.append(date_job)
+                total_date_patterns = date_pattern_df.select(pl.sum("Count")).item()
+
+                px = express()
                 date_bar = px.bar(date_pattern_df, x="Percentage", y="Format", title=f"Distribution of {total_date_patterns:,d} Date Patterns for {selected}", orientation="h")
 
                 date_bar.update_layout(
@@ -383,6 +491,23 @@ if "df" in st.session_state and st.session_state["df"] is not None:
 
                 st.plotly_chart(date_bar, use_container_width=True)
 
+                # Start/end years parsed from every date column in one pass over the catalog
+                st.subheader("Normalized Dates")
+                precision_summary = date_precisions(fingerprint, lf)
+                st.dataframe(precision_summary.filter(pl.col("column") == selected_column).to_pandas(), use_container_width=True)
+                with st.expander("All date columns", expanded=False):
+                    st.dataframe(precision_summary.to_pandas(), use_container_width=True)
+
+                st.subheader("Publication Dates vs. 008 Date 1 / Date 2")
+                st.dataframe(date_cross_validation(fingerprint, lf).to_pandas(), use_container_width=True)
+
+                if find_column(catalog_columns, '005') is not None:
+                    # 005 is parsed to a timestamp at ingest, into the copy partitioned by month; unparseable values are flagged there
+                    st.subheader("Last Modified (005)")
+                    months = last_modified_months(fingerprint, scan_partitioned(df, [MODIFIED_MONTH]))
+                    st.write(f"{months['invalid 005'].sum():,d} records have a 005 that is not a valid YYYYMMDDHHMMSS.F timestamp")
+                    st.bar_chart(months.to_pandas(), x=MODIFIED_MONTH, y="records")
+
 
                 # # Special Character Analysis
                 # st.header("Step 3: Special Character Analysis")
@@ -429,6 +554,47 @@ if "df" in st.session_state and st.session_state["df"] is not None:
             else:
                 st.error(f"The selected column '{selected}' does not match the expected format. Please select a column with patterns like 'YYYY' or 'YYYY-YYYY'.")
 
+    with tab3:
+        st.title("Cluster Publisher Names")
+
+        st.markdown("""### Instructions
+        This page groups spelling variants of the same publisher found in 260$b / 264$b.
+        1. Choose how similar two names must be to be grouped.
+        2. Review each cluster's proposed canonical form and the variants it covers.
+        """)
+
+        publisher_threshold = st.slider("Similarity threshold:", 70, 100, DEFAULT_PUBLISHER_THRESHOLD, key="publisher_threshold")
+        if st.checkbox("Cluster publisher names", key="publisher_clusters"):
+            clusters = publisher_clusters(fingerprint, df, publisher_threshold)
+            variant_clusters = clusters.filter(pl.col("variants") > 1).with_columns(pl.col("forms").list.join(" | "))
+            st.write(f"{variant_clusters.height:,d} publishers are written more than one way ({clusters.height:,d} publishers in total)")
+            st.dataframe(variant_clusters.to_pandas(), use_container_width=True)
+
+    with tab4:
+        st.title("Record Summary")
+
+        st.markdown("""### Instructions
+        Counts of records by Leader/06, Leader/07, 008 publication status and language, publication date format and cataloging agency.
+        1. Pick the dimensions to break the counts down by; remove one to roll up, add one to drill down.
+        2. Narrow the records with the filters.
+        """)
+
+        # Built once per upload; every slice below is answered from the cube, not the records
+        cube = load_cube(fingerprint, lf)
+        by = st.multiselect("Break down by:", list(DIMENSIONS), default=["Leader/06"], key="cube_by")
+        filters = {}
+        filter_columns = st.columns(len(DIMENSIONS))
+        for column, name in zip(filter_columns, DIMENSIONS):
+            values = sorted(cube.get_column(name).cast(pl.String).unique().to_list())
+            filters[name] = column.multiselect(name, values, key=f"cube_filter_{name}")
+
+        summary = query_cube(cube, by, filters)
+        st.write(f"{summary['records'].sum():,d} records in {summary.height:,d} groups")
+        st.dataframe(summary.to_pandas(), use_container_width=True)
+
+    # Every tab is drawn; now wait for any exact pass still running behind a preview
+    poll_pending(pending_jobs)
+
 
 
 
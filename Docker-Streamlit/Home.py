@@ -37,6 +37,11 @@ Each record type may contain different sets of metadata, requiring specialized a
 This tool supports identifying and categorizing records by type, ensuring that metadata fields are standardized accordingly.
 """)
 
+st.subheader("4. Snapshot Comparison")
+st.write("""
+Catalog exports are taken again after each clean-up round. Compare two of them to see which records were added, removed or modified, and which fields changed.
+""")
+
 # Final Note and Next Steps
 st.write("""
 ---
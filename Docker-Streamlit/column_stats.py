@@ -0,0 +1,106 @@
+import polars as pl
+
+from dates import parse_date
+
+# Per-column statistics computed once at ingest and stored next to the dataset, so column selectors,
+# the column profile and empty-column pruning are answered without scanning the records
+
+TOP_VALUES = 5
+# Most non-null values parse as a date (see dates.parse_date)
+DATE_SHARE = 0.8
+# Short values, or few distinct ones repeated across records: Leader positions, language codes, indicators
+CODE_MAX_LENGTH = 12
+CODE_MAX_DISTINCT = 200
+CODE_MAX_DISTINCT_SHARE = 0.5
+KINDS = ["empty", "date-like", "code", "free text"]
+
+CATALOG_SCHEMA = {
+    "column": pl.String,
+    "dtype": pl.String,
+    "rows": pl.UInt32,
+    "null_count": pl.UInt32,
+    "distinct": pl.UInt32,
+    "min_length": pl.UInt32,
+    "max_length": pl.UInt32,
+    "kind": pl.String,
+    "top_values": pl.List(pl.Struct({"value": pl.String, "count": pl.UInt32})),
+}
+
+def _column_summary(name: str) -> pl.Expr:
+    # Everything is summarised as text, which every dtype casts to, including Datetime and all-null Null columns
+    value = pl.col(name).cast(pl.String)
+    length = value.str.len_chars()
+    precision = parse_date(value).struct.field("precision")
+    # A year somewhere inside free text is not a date column
+    parsed = precision.is_not_null() & (precision != "embedded")
+    return pl.struct(
+        pl.col(name).null_count().alias("null_count"),
+        # HyperLogLog estimate; an exact count would need every distinct value in memory
+        value.approx_n_unique().alias("distinct"),
+        length.min().alias("min_length"),
+        length.max().alias("max_length"),
+        (parsed.sum() / value.is_not_null().sum().clip(lower_bound=1)).alias("date_share"),
+        value.drop_nulls().value_counts(sort=True).head(TOP_VALUES)
+        .struct.rename_fields(["value", "count"]).implode().alias("top_values"),
+    ).alias(name)
+
+def _kind(rows: int, summary: dict) -> str:
+    present = rows - summary["null_count"]
+    if present == 0:
+        return "empty"
+    if summary["date_share"] >= DATE_SHARE:
+        return "date-like"
+    few_distinct = summary["distinct"] <= CODE_MAX_DISTINCT and summary["distinct"] <= present * CODE_MAX_DISTINCT_SHARE
+    if (summary["max_length"] or 0) <= CODE_MAX_LENGTH or few_distinct:
+        return "code"
+    return "free text"
+
+def column_stats(_df: pl.DataFrame | pl.LazyFrame) -> pl.DataFrame:
+    # One row per column, in column order; a single pass computes every column's summary
+    lf = _df.lazy()
+    schema = lf.collect_schema()
+    if not schema:
+        return pl.DataFrame(schema=CATALOG_SCHEMA)
+
+    summaries = lf.select(pl.len().alias("_rows"), *[_column_summary(name) for name in schema.names()]).collect().row(0, named=True)
+    rows = summaries.pop("_rows")
+    return pl.DataFrame(
+        [
+            {
+                "column": name,
+                "dtype": str(dtype),
+                "rows": rows,
+                "null_count": summaries[name]["null_count"],
+                "distinct": summaries[name]["distinct"],
+                "min_length": summaries[name]["min_length"],
+                "max_length": summaries[name]["max_length"],
+                "kind": _kind(rows, summaries[name]),
+                "top_values": summaries[name]["top_values"],
+            }
+            for name, dtype in schema.items()
+        ],
+        schema=CATALOG_SCHEMA,
+    )
+
+def non_empty_columns(catalog: pl.DataFrame) -> list:
+    return catalog.filter(pl.col("kind") != "empty").get_column("column").to_list()
+
+def columns_of_kind(catalog: pl.DataFrame, kind: str) -> list:
+    return catalog.filter(pl.col("kind") == kind).get_column("column").to_list()
+
+def row_count(catalog: pl.DataFrame) -> int:
+    return catalog.get_column("rows").max() or 0
+
+def profile_table(catalog: pl.DataFrame) -> pl.DataFrame:
+    # The catalog as shown on the pages: fill rate and the top values as one readable string
+    return catalog.select(
+        "column",
+        "kind",
+        (100 - pl.col("null_count") / pl.col("rows").clip(lower_bound=1) * 100).round(1).alias("filled %"),
+        "distinct",
+        "min_length",
+        "max_length",
+        pl.col("top_values").list.eval(
+            pl.format("{} ({})", pl.element().struct.field("value"), pl.element().struct.field("count"))
+        ).list.join("; ").alias("top values"),
+    )
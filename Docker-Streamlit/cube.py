@@ -0,0 +1,143 @@
+import os
+import tempfile
+
+import polars as pl
+
+from datasets import dataset_dir
+from dates import parse_date
+from marc_fields import find_column
+
+# name -> (tag, subfield code, character positions or None)
+DIMENSIONS = {
+    "Leader/06": ("LDR", "", (6, 1)),
+    "Leader/07": ("LDR", "", (7, 1)),
+    "Publication status": ("008", "", (6, 1)),
+    "Language": ("008", "", (35, 3)),
+    "Date format": None,  # precision class of the 264$c / 260$c publication date
+    "Cataloging agency": ("040", "a", None),
+}
+DATE_FORMAT_SOURCES = [('264', 'c'), ('260', 'c')]
+MISSING = "(none)"
+CUBE_FILE = "summary_cube-1.parquet"  # renamed when the cube's cells or measures change, so old cubes are rebuilt
+
+# Every measure is a sum, min or max, so cubes of separate shards merge into the cube of their union
+# and any roll-up is one more group_by over the cells
+MEASURES = {
+    "records": "sum",
+    "with_041": "sum",
+    "with_773": "sum",
+    "date_known": "sum",
+    "date_sum": "sum",
+    "date_min": "min",
+    "date_max": "max",
+}
+
+def _dimension(columns: list, name: str) -> pl.Expr:
+    if DIMENSIONS[name] is None:
+        sources = [col for col in (find_column(columns, tag, code) for tag, code in DATE_FORMAT_SOURCES) if col]
+        if not sources:
+            return pl.lit(MISSING).alias(name)
+        date = pl.coalesce([pl.col(col).cast(pl.String) for col in sources])
+        return parse_date(date).struct.field("precision").fill_null(
+            pl.when(date.is_null()).then(pl.lit(MISSING)).otherwise(pl.lit("unparsed"))
+        ).alias(name)
+
+    tag, code, positions = DIMENSIONS[name]
+    column = find_column(columns, tag, code) or (find_column(columns, "000") if tag == "LDR" else None)
+    if column is None:
+        return pl.lit(MISSING).alias(name)
+    value = pl.col(column).cast(pl.String)
+    if positions:
+        value = value.str.slice(*positions)
+    value = value.str.strip_chars()
+    return pl.when(value != "").then(value).otherwise(pl.lit(MISSING)).alias(name)
+
+def build_cube(_df: pl.DataFrame | pl.LazyFrame) -> pl.DataFrame:
+    # One row per combination of dimension values that occurs, with the measures of its records
+    lf = _df.lazy()
+    columns = lf.collect_schema().names()
+
+    def present(tag, code):
+        column = find_column(columns, tag, code)
+        return pl.col(column).is_not_null() if column else pl.lit(False)
+
+    date_sources = [col for col in (find_column(columns, tag, code) for tag, code in DATE_FORMAT_SOURCES) if col]
+    start_year = (
+        parse_date(pl.coalesce([pl.col(col).cast(pl.String) for col in date_sources])).struct.field("start_year")
+        if date_sources else pl.lit(None, dtype=pl.Int32)
+    )
+    return (
+        lf
+        .select(
+            *[_dimension(columns, name) for name in DIMENSIONS],
+            present('041', 'a').alias("with_041"),
+            present('773', 'w').alias("with_773"),
+            start_year.alias("start_year"),
+        )
+        .group_by(list(DIMENSIONS))
+        .agg(
+            pl.len().cast(pl.UInt32).alias("records"),
+            pl.col("with_041").sum().cast(pl.UInt32),
+            pl.col("with_773").sum().cast(pl.UInt32),
+            pl.col("start_year").count().cast(pl.UInt32).alias("date_known"),
+            pl.col("start_year").cast(pl.Int64).sum().alias("date_sum"),
+            pl.col("start_year").min().alias("date_min"),
+            pl.col("start_year").max().alias("date_max"),
+        )
+        # Few distinct values per dimension: categoricals keep the stored cube small
+        .with_columns([pl.col(name).cast(pl.Categorical) for name in DIMENSIONS])
+        .sort(list(DIMENSIONS))
+        .collect()
+    )
+
+def _merge(cells: pl.LazyFrame, by: list) -> pl.LazyFrame:
+    return cells.group_by(by).agg([getattr(pl.col(measure), how)() for measure, how in MEASURES.items()])
+
+def merge_cubes(cubes: list) -> pl.DataFrame:
+    # Combine the cubes of several shards (or uploads) into one
+    cells = pl.concat([cube.with_columns([pl.col(name).cast(pl.String) for name in DIMENSIONS]) for cube in cubes])
+    return (
+        _merge(cells.lazy(), list(DIMENSIONS))
+        .with_columns([pl.col(name).cast(pl.Categorical) for name in DIMENSIONS])
+        .sort(list(DIMENSIONS))
+        .collect()
+    )
+
+def query(cube: pl.DataFrame, by: list, filters: dict = None) -> pl.DataFrame:
+    # Roll up to the `by` dimensions (fewer dimensions = coarser) after slicing on `filters`
+    # ({dimension: [values]}); answered from the cube's cells, never from the records
+    cells = cube.lazy()
+    for name, values in (filters or {}).items():
+        if values:
+            cells = cells.filter(pl.col(name).cast(pl.String).is_in(values))
+    if by:
+        rolled = _merge(cells, by)
+    else:
+        rolled = cells.select([getattr(pl.col(measure), how)() for measure, how in MEASURES.items()])
+    return (
+        rolled
+        .with_columns(
+            (pl.col("date_sum") / pl.col("date_known")).round(0).alias("date_mean"),
+            (pl.col("records") / pl.col("records").sum() * 100).round(2).alias("percent"),
+        )
+        .drop("date_sum")
+        .sort("records", descending=True)
+        .collect()
+    )
+
+def load_cube(fingerprint: str, _df: pl.DataFrame | pl.LazyFrame) -> pl.DataFrame:
+    # Built once per dataset and stored next to its other files
+    path = dataset_dir(fingerprint) / CUBE_FILE
+    if path.exists():
+        return pl.read_parquet(path)
+    cube = build_cube(_df)
+    # Written to a temporary file first, so a crash or a concurrent session never leaves a partial cube
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix=".part")
+    os.close(fd)
+    try:
+        cube.write_parquet(tmp_name)
+        os.replace(tmp_name, path)
+    finally:
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
+    return cube
@@ -0,0 +1,319 @@
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import tempfile
+import weakref
+from datetime import datetime
+from pathlib import Path
+
+import polars as pl
+
+from column_stats import column_stats, non_empty_columns
+from dates import MODIFIED, MODIFIED_MONTH, with_transaction_time
+from marc_fields import find_column
+
+# Everything derived from an upload (exports, caches, indexes) lives under one directory
+# keyed by the dataset fingerprint, so the docker-compose volume keeps it between restarts.
+CACHE_DIR = Path(os.environ.get("FHL_CACHE_DIR", Path(__file__).parent / ".cache"))
+
+def dataset_dir(fingerprint: str) -> Path:
+    path = CACHE_DIR / "datasets" / fingerprint
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+# Streamlit keeps the same file_id across reruns, so each upload is only hashed once per process
+_upload_fingerprints = {}
+
+def fingerprint_upload(uploaded_file) -> str:
+    upload_key = getattr(uploaded_file, "file_id", None) or (uploaded_file.name, uploaded_file.size)
+    if upload_key in _upload_fingerprints:
+        return _upload_fingerprints[upload_key]
+
+    # Hash the raw upload in 1 MB chunks
+    digest = hashlib.blake2b(digest_size=16)
+    uploaded_file.seek(0)
+    for chunk in iter(lambda: uploaded_file.read(1 << 20), b""):
+        digest.update(chunk)
+    uploaded_file.seek(0)
+    _upload_fingerprints[upload_key] = digest.hexdigest()
+    return _upload_fingerprints[upload_key]
+
+def fingerprint_frame(_df: pl.DataFrame) -> str:
+    # Fallback for frames that did not come from an upload (combined shards, Mito edits)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr(_df.schema).encode("utf-8"))
+    digest.update(str(_df.height).encode("utf-8"))
+    if _df.height:
+        row_hash = _df.hash_rows(seed=0).sum() & 0xFFFFFFFFFFFFFFFF
+        digest.update(row_hash.to_bytes(8, "little"))
+    return digest.hexdigest()
+
+def params_key(**params) -> str:
+    # Stable short key for a set of analysis parameters
+    encoded = repr(sorted(params.items())).encode("utf-8")
+    return hashlib.blake2b(encoded, digest_size=8).hexdigest()
+
+PARQUET_ROW_GROUP_ROWS = 50_000
+# Part of every dataset's file name; bump it when ingest changes what is written, so datasets cached
+# by an older version are built again
+INGEST_VERSION = 2
+# Partition keys derived at ingest from fixed positions: name -> (tag, (start, length))
+RECORD_TYPE = "record_type"
+LANGUAGE = "language"
+PARTITION_KEYS = {RECORD_TYPE: ("LDR", (6, 1)), LANGUAGE: ("008", (35, 3))}
+# Key value for records without a usable code; also keeps odd characters out of directory names
+UNKNOWN_KEY = "unknown"
+# Hive-partitioned Parquet copies written for every dataset whose records yield their keys; a scan
+# filtered on a key reads only the matching directories. The keys and the parsed 005 columns exist only
+# in these copies, so the dataset users see, edit and export keeps its own columns.
+PARTITIONINGS = [[MODIFIED_MONTH], [RECORD_TYPE, LANGUAGE]]
+
+# Frames opened from a persisted dataset: id -> (weak reference, handle). Lets the job runner hand a
+# worker process the file to map instead of pickling the frame.
+_mapped = {}
+
+class DatasetHandle:
+    # Picklable reference to a persisted dataset; a worker process reopens it memory-mapped
+    def __init__(self, fingerprint: str, name: str):
+        self.fingerprint = fingerprint
+        self.name = name
+
+    @property
+    def path(self) -> Path:
+        return dataset_dir(self.fingerprint) / f"{self.name}.arrow"
+
+    @property
+    def parquet_path(self) -> Path:
+        return dataset_dir(self.fingerprint) / f"{self.name}.parquet"
+
+    @property
+    def stats_path(self) -> Path:
+        return dataset_dir(self.fingerprint) / f"{self.name}.stats.parquet"
+
+    def partitions_path(self, by: list) -> Path:
+        return dataset_dir(self.fingerprint) / f"{self.name}.by-{'-'.join(by)}"
+
+    def scan(self) -> pl.LazyFrame:
+        # Lazy plans read only the columns and row groups they reference from the Parquet copy
+        return pl.scan_parquet(self.parquet_path)
+
+    def scan_partitions(self, by: list) -> pl.LazyFrame:
+        # <key>=<value>/ directories, nested in the order of `by`; a filter on any key skips every
+        # directory it rules out unread
+        return pl.scan_parquet(
+            self.partitions_path(by), hive_partitioning=True, hive_schema={key: pl.String for key in by}
+        )
+
+    def write_partitions(self, _df: pl.DataFrame, by: list) -> None:
+        # Within a partition rows are ordered by last modification, so the row-group statistics of
+        # modified_at also let "changed since" filters skip row groups. Written to a temporary directory
+        # first and renamed into place, like the other files.
+        path = self.partitions_path(by)
+        tmp = Path(tempfile.mkdtemp(dir=path.parent, suffix=".part"))
+        order = by + ([MODIFIED] if MODIFIED in _df.columns and MODIFIED not in by else [])
+        try:
+            _df.sort(order, maintain_order=True).write_parquet(
+                tmp, partition_by=by, compression="zstd", statistics=True, row_group_size=PARQUET_ROW_GROUP_ROWS,
+            )
+            os.replace(tmp, path)
+        except OSError:
+            # Another process finished the same copy first
+            if not path.exists():
+                raise
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def write(self, _df: pl.DataFrame) -> "DatasetHandle":
+        # Stored uncompressed and as one record batch so open() can map it without copying; written to a
+        # temporary file first, so readers never see a partial dataset
+        _write_atomically(self.path, lambda tmp: _df.rechunk().write_ipc(tmp, compression="uncompressed"))
+        return self
+
+    def open(self) -> pl.DataFrame:
+        # Uncompressed IPC is mapped, not read: every session and worker process opening the same
+        # dataset shares its pages through the OS page cache instead of holding a private copy
+        _df = pl.read_ipc(self.path, memory_map=True)
+        _mapped[id(_df)] = (weakref.ref(_df), self)
+        return _df
+
+def handle_for(_df: pl.DataFrame):
+    # The DatasetHandle a frame was opened from, or None for frames built in memory
+    entry = _mapped.get(id(_df))
+    if entry is not None and entry[0]() is _df:
+        return entry[1]
+    return None
+
+def scan(_df: pl.DataFrame) -> pl.LazyFrame:
+    # Lazy plan over a frame: a Parquet scan for persisted datasets, so projection and predicate
+    # pushdown apply to the file; an in-memory plan for everything else
+    handle = handle_for(_df)
+    if handle is not None and handle.parquet_path.exists():
+        return handle.scan()
+    return _df.lazy()
+
+def scan_partitioned(_df: pl.DataFrame, by: list) -> pl.LazyFrame:
+    # scan() plus the derived columns, over the copy partitioned on `by` when the dataset has one
+    handle = handle_for(_df)
+    if handle is not None and handle.partitions_path(by).exists():
+        return handle.scan_partitions(by)
+    return with_derived_columns(scan(_df))
+
+def with_derived_columns(lf: pl.LazyFrame) -> pl.LazyFrame:
+    # The parsed 005 columns and the partition keys the partitioned copies are written with
+    return with_partition_keys(with_transaction_time(lf))
+
+def with_partition_keys(lf: pl.LazyFrame) -> pl.LazyFrame:
+    # The PARTITION_KEYS columns from the Leader and 008, in either export layout
+    columns = lf.collect_schema().names()
+    keys = []
+    for name, (tag, positions) in PARTITION_KEYS.items():
+        column = find_column(columns, tag) or (find_column(columns, "000") if tag == "LDR" else None)
+        value = pl.col(column).cast(pl.String).str.slice(*positions).str.strip_chars().str.to_lowercase() if column else pl.lit(None, dtype=pl.String)
+        keys.append(pl.when(value.str.contains(r"^[a-z0-9]+$")).then(value).otherwise(pl.lit(UNKNOWN_KEY)).alias(name))
+    return lf.with_columns(keys)
+
+def partition_values(_df: pl.DataFrame, key: str) -> list:
+    # Values a partition key takes, from the directory names of the partitioned copy when there is one
+    handle = handle_for(_df)
+    by = next((by for by in PARTITIONINGS if key in by), [key])
+    if handle is not None and handle.partitions_path(by).exists():
+        return sorted({path.name.split("=", 1)[1] for path in handle.partitions_path(by).glob(f"**/{key}=*")})
+    lf = with_derived_columns(_df.lazy())
+    if key not in lf.collect_schema().names():
+        return []
+    return sorted(lf.select(pl.col(key).drop_nulls().unique()).collect().get_column(key).to_list())
+
+def scoped(fingerprint: str, _df: pl.DataFrame, **allowed) -> tuple:
+    # (fingerprint, frame, lazy plan) for the records whose partition keys take one of the allowed
+    # values, e.g. scoped(fingerprint, df, record_type=["a"], language=["eng", "ger"]). The subset is
+    # read from the matching partitions only, stored next to the dataset and opened mapped like it; its
+    # fingerprint names the scope, so cached analyses of different scopes are kept apart.
+    allowed = {key: sorted(values) for key, values in allowed.items() if values}
+    if not allowed:
+        return fingerprint, _df, scan(_df)
+    by = next((by for by in PARTITIONINGS if set(allowed) <= set(by)), list(allowed))
+    scope = params_key(**allowed)
+    source = handle_for(_df)
+    handle = DatasetHandle(fingerprint, f"{source.name if source else 'frame'}-scope-{scope}")
+    if not handle.path.exists():
+        lf = scan_partitioned(_df, by)
+        for key, values in allowed.items():
+            lf = lf.filter(pl.col(key).is_in(values))
+        # Only the dataset's own columns, in its order; the keys stay in the partitioned copies
+        handle.write(lf.select(_df.columns).collect())
+    subset = handle.open()
+    if not handle.parquet_path.exists():
+        # Plans over the subset, like those over the dataset, pickle to worker processes as a file scan
+        _write_atomically(handle.parquet_path, lambda tmp: subset.write_parquet(
+            tmp, compression="zstd", statistics=True, row_group_size=PARQUET_ROW_GROUP_ROWS
+        ))
+    return f"{fingerprint}-{scope}", subset, scan(subset)
+
+def scope_widget(fingerprint: str, _df: pl.DataFrame, key: str) -> tuple:
+    # Sidebar filters on material type and language; returns scoped()'s (fingerprint, frame, lazy plan)
+    import streamlit as st
+
+    with st.sidebar:
+        st.subheader("Limit to")
+        record_types = st.multiselect("Type of record (Leader/06):", partition_values(_df, RECORD_TYPE), key=f"{key}_record_type")
+        languages = st.multiselect("Language (008/35-37):", partition_values(_df, LANGUAGE), key=f"{key}_language")
+    return scoped(fingerprint, _df, **{RECORD_TYPE: record_types, LANGUAGE: languages})
+
+def _write_atomically(path: Path, write) -> None:
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix=".part")
+    os.close(fd)
+    try:
+        write(tmp_name)
+        os.replace(tmp_name, path)
+    finally:
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
+
+def load_dataset(uploaded_file, prepare, reader=pl.read_excel):
+    # (fingerprint, frame) for an upload: parsed and prepared once, persisted as Arrow IPC next to the
+    # dataset's other files, then always opened memory-mapped. A Parquet copy backs scan(). The file name includes a hash of
+    # `prepare`'s source, so pages that clean columns differently keep separate files.
+    fingerprint = fingerprint_upload(uploaded_file)
+    return fingerprint, persist_dataset(fingerprint, prepare, lambda: reader(uploaded_file))
+
+def persist_dataset(fingerprint: str, prepare, read) -> pl.DataFrame:
+    # `read` is only called when the dataset is not on disk yet; sources other than uploads (a Koha
+    # database) supply their own fingerprint
+    source = f"{INGEST_VERSION}:{inspect.getsource(prepare)}"
+    version = hashlib.blake2b(source.encode("utf-8"), digest_size=4).hexdigest()
+    handle = DatasetHandle(fingerprint, f"{prepare.__name__}-{version}")
+    if not handle.path.exists():
+        prepared = prepare(read())
+        # The statistics catalog is computed here, once, and decides which all-null columns are dropped
+        catalog = column_stats(prepared)
+        prepared = prepared.select(non_empty_columns(catalog))
+        catalog = catalog.filter(pl.col("column").is_in(prepared.columns))
+        _write_atomically(handle.stats_path, lambda tmp: catalog.write_parquet(tmp))
+        handle.write(prepared)
+    _df = handle.open()
+    if not handle.parquet_path.exists():
+        # Row groups with statistics let scans skip data a filter rules out
+        _write_atomically(handle.parquet_path, lambda tmp: _df.write_parquet(
+            tmp, compression="zstd", statistics=True, row_group_size=PARQUET_ROW_GROUP_ROWS
+        ))
+    derived = with_derived_columns(_df.lazy())
+    available = derived.collect_schema().names()
+    missing = [by for by in PARTITIONINGS if set(by) <= set(available) and not handle.partitions_path(by).exists()]
+    if missing:
+        # 005 is parsed and the partition keys derived once, here, for the partitioned copies
+        derived = derived.collect()
+        for by in missing:
+            handle.write_partitions(derived, by)
+    return _df
+
+# When each recurring report last ran completely on a dataset, as the newest 005 timestamp of the data
+# it ran on, so the next run can be limited to records changed since. Kept in the dataset's directory.
+RUNS_FILE = "report_runs.json"
+
+def _runs(fingerprint: str) -> dict:
+    try:
+        return json.loads((dataset_dir(fingerprint) / RUNS_FILE).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+def last_run(report: str, fingerprint: str):
+    when = _runs(fingerprint).get(report)
+    return datetime.fromisoformat(when) if when else None
+
+def record_run(report: str, fingerprint: str, when: datetime) -> None:
+    previous = last_run(report, fingerprint)
+    if when is None or (previous is not None and previous >= when):
+        return
+    runs = {**_runs(fingerprint), report: when.isoformat()}
+    _write_atomically(dataset_dir(fingerprint) / RUNS_FILE, lambda tmp: Path(tmp).write_text(json.dumps(runs, indent=2), encoding="utf-8"))
+
+# Catalogs read from disk, by sidecar path; they are a few KB each
+_catalogs = {}
+
+def column_catalog(_df: pl.DataFrame) -> pl.DataFrame:
+    # Per-column statistics of a frame (see column_stats): the ingest sidecar for persisted datasets,
+    # computed on the spot for frames built in memory
+    handle = handle_for(_df)
+    if handle is None:
+        return column_stats(_df)
+    path = handle.stats_path
+    if path not in _catalogs:
+        if not path.exists():
+            _write_atomically(path, lambda tmp: column_stats(_df).write_parquet(tmp))
+        _catalogs[path] = pl.read_parquet(path)
+    return _catalogs[path]
+
+def pandas_view(_df: pl.DataFrame):
+    # pandas frame over the same memory where the dtype allows it: numeric and boolean columns without
+    # nulls become numpy views, everything else Arrow-backed pandas columns instead of object arrays
+    import pandas as pd
+
+    columns = {}
+    for series in _df.iter_columns():
+        if (series.dtype.is_numeric() or series.dtype == pl.Boolean) and series.null_count() == 0:
+            columns[series.name] = series.to_numpy()  # zero-copy for a single-chunk numeric column
+        else:
+            columns[series.name] = series.to_pandas(use_pyarrow_extension_array=True)
+    return pd.DataFrame(columns, copy=False)
@@ -0,0 +1,213 @@
+from datetime import date, datetime
+
+import polars as pl
+
+from marc_fields import find_column
+
+# Date-bearing columns of the wide export
+DATE_COLUMNS = [
+    "005.1.", "100.1.d", "110.1.d", "245.1.f", "245.1.g", "260.1.c",
+    "264.1.c", "600.1.d", "610.1.9", "700.1.d", "362.1.a", "610.1.d",
+    "046.1.a", "046.1.b", "046.1.j", "240.1.d", "240.1.f", "362.1.b"
+]
+# Publication/coverage dates that 008 Date 1/Date 2 should agree with
+CHECKED_AGAINST_008 = ["245.1.f", "260.1.c", "264.1.c"]
+
+# Columns added at ingest from the 005 transaction timestamp (YYYYMMDDHHMMSS.F)
+MODIFIED = "modified_at"
+MODIFIED_INVALID = "modified_invalid"
+# 'YYYY-MM', or 'unknown' without a valid 005; datasets keep a copy partitioned on it
+MODIFIED_MONTH = "modified_month"
+UNKNOWN_MONTH = "unknown"
+
+PRECISIONS = ["second", "day", "month", "year", "range", "open range", "decade", "century", "embedded"]
+
+# Prefixes in front of the year: circa, born, died, flourished, copyright/phonogram
+PREFIX = r"^(?i)(ca\.?|circa|approximately|approx\.|fl\.?|active|b\.|d\.|a\.|c\.|c|p|©|℗)\s*"
+CIRCA = r"(?i)\?|^\[?\s*(ca\.?|circa|approximately|approx\.|c\.)\s*\d"
+
+def _year(body: pl.Expr, pattern: str, group: int = 1) -> pl.Expr:
+    return body.str.extract(pattern, group).cast(pl.Int32, strict=False)
+
+def parse_date(value: pl.Expr) -> pl.Expr:
+    # One struct per value: start_year, end_year, precision and an uncertain flag.
+    # Every form is a regex test on the whole column, so no Python runs per value.
+    raw = value.cast(pl.String).str.strip_chars()
+    prefix = raw.str.replace_all(r"[\[\]]", "").str.strip_chars().str.to_lowercase().str.extract(PREFIX, 1).str.strip_chars(".")
+    body = (
+        raw.str.replace_all(r"[\[\]?]", "")
+        .str.strip_chars()
+        .str.replace(PREFIX, "")
+        .str.strip_chars(" .,;:")
+    )
+    first_year = _year(body, r"^(\d{4})")
+    last_year = _year(body, r"(\d{4})$")
+
+    # (precision, pattern, start, end), tried in order
+    rules = [
+        ("second", r"^\d{14}\.\d+$", first_year, first_year),
+        ("day", r"^(1\d|20)\d{2}(0[1-9]|1[0-2])(0[1-9]|[12]\d|3[01])$", first_year, first_year),
+        ("day", r"^(0[1-9]|1[0-2])(0[1-9]|[12]\d|3[01])\d{4}$", last_year, last_year),
+        ("day", r"^\d{4}[-/]\d{2}[-/]\d{2}$", first_year, first_year),
+        ("day", r"^\d{1,2}/\d{1,2}/\d{4}$", last_year, last_year),
+        ("month", r"^\d{4}[-/]?(0[1-9]|1[0-2])$", first_year, first_year),
+        ("range", r"^\d{4}\s*-\s*\d{4}$", first_year, last_year),
+        # 1850-62: the end year borrows the start year's century
+        ("range", r"^\d{4}-\d{2}$", first_year, first_year // 100 * 100 + _year(body, r"-(\d{2})$")),
+        ("open range", r"^\d{4}\s*-$", first_year, pl.lit(None, dtype=pl.Int32)),
+        ("year", r"^\d{4}$", first_year, first_year),
+        ("decade", r"^\d{3}[-u]$", _year(body, r"^(\d{3})") * 10, _year(body, r"^(\d{3})") * 10 + 9),
+        ("century", r"^\d{2}(--|uu)$", _year(body, r"^(\d{2})") * 100, _year(body, r"^(\d{2})") * 100 + 99),
+        ("embedded", r"\d{4}", _year(body, r"(\d{4})"), _year(body, r"(\d{4})")),
+    ]
+
+    def chain(pick):
+        expr = pl.when(body.str.contains(rules[0][1])).then(pick(rules[0]))
+        for rule in rules[1:]:
+            expr = expr.when(body.str.contains(rule[1])).then(pick(rule))
+        return expr
+
+    start = chain(lambda rule: rule[2]).cast(pl.Int32)
+    end = chain(lambda rule: rule[3]).cast(pl.Int32)
+    precision = chain(lambda rule: pl.lit(rule[0]))
+
+    # "b. 1850" has no known end, "d. 1900" no known start
+    return pl.struct(
+        pl.when(prefix == "d").then(None).otherwise(start).alias("start_year"),
+        pl.when(prefix == "b").then(None).when(prefix == "d").then(start).otherwise(end).alias("end_year"),
+        precision.alias("precision"),
+        raw.str.contains(CIRCA).fill_null(False).alias("uncertain"),
+    )
+
+def parse_transaction_time(value: pl.Expr) -> pl.Expr:
+    # Null where the value is not a valid 005; the tenths of a second are optional
+    raw = value.cast(pl.String).str.strip_chars()
+    return pl.coalesce(
+        raw.str.strptime(pl.Datetime("ms"), "%Y%m%d%H%M%S%.f", strict=False),
+        raw.str.strptime(pl.Datetime("ms"), "%Y%m%d%H%M%S", strict=False),
+    )
+
+def with_transaction_time(lf: pl.LazyFrame) -> pl.LazyFrame:
+    # MODIFIED, MODIFIED_INVALID and MODIFIED_MONTH from the 005 column, when there is one
+    source = find_column(lf.collect_schema().names(), '005')
+    if source is None:
+        return lf
+    raw = pl.col(source).cast(pl.String).str.strip_chars()
+    modified = parse_transaction_time(pl.col(source))
+    return lf.with_columns(
+        modified.alias(MODIFIED),
+        (raw.str.len_chars().fill_null(0) > 0).and_(modified.is_null()).alias(MODIFIED_INVALID),
+        modified.dt.strftime("%Y-%m").fill_null(UNKNOWN_MONTH).alias(MODIFIED_MONTH),
+    )
+
+def changed_since(lf: pl.LazyFrame, since: date) -> pl.LazyFrame:
+    # Records whose 005 is on or after `since`. The month test comes first so a scan partitioned on
+    # MODIFIED_MONTH only reads the months that can match ('unknown' sorts after every month and is
+    # then ruled out by the timestamp test).
+    if not isinstance(since, datetime):
+        since = datetime.combine(since, datetime.min.time())
+    return lf.filter(pl.col(MODIFIED_MONTH) >= since.strftime("%Y-%m")).filter(pl.col(MODIFIED) >= since)
+
+def modification_months(lf: pl.LazyFrame) -> pl.DataFrame:
+    # Records and invalid 005 values per last-modified month
+    return (
+        lf.group_by(MODIFIED_MONTH)
+        .agg(pl.len().alias("records"), pl.col(MODIFIED_INVALID).sum().alias("invalid 005"))
+        .sort(MODIFIED_MONTH)
+        .collect()
+    )
+
+def normalize_dates(lf: pl.LazyFrame, columns: list) -> pl.LazyFrame:
+    # Wide result: <column>_start_year, <column>_end_year, <column>_precision next to each source column
+    return lf.with_columns(
+        [parse_date(pl.col(col)).struct.rename_fields(
+            [f"{col}_start_year", f"{col}_end_year", f"{col}_precision", f"{col}_uncertain"]
+        ).alias(f"{col}_parsed") for col in columns]
+    ).unnest([f"{col}_parsed" for col in columns])
+
+def date_facts(lf: pl.LazyFrame, columns: list) -> pl.LazyFrame:
+    # Long result over every date column at once: row, 001, column, value, start_year, end_year, precision, uncertain.
+    # `row` is the record's position in the dataset, since 001 can be empty or repeated.
+    schema = lf.collect_schema().names()
+    id_column = find_column(schema, '001')
+    record_id = pl.col(id_column).cast(pl.String) if id_column else pl.int_range(pl.len()).cast(pl.String)
+    return (
+        lf.with_row_index("row")
+        .select("row", record_id.alias("001"), *[pl.col(col).cast(pl.String) for col in columns])
+        .unpivot(index=["row", "001"], on=columns, variable_name="column", value_name="value")
+        .drop_nulls("value")
+        .with_columns(parse_date(pl.col("value")).alias("parsed"))
+        .unnest("parsed")
+    )
+
+def fixed_field_dates(fixed: pl.Expr) -> list:
+    # 008/06 type of date and the Date 1 / Date 2 ranges; 'u' digits widen the range (18uu -> 1800-1899)
+    def bounds(offset, name):
+        date = fixed.str.slice(offset, 4)
+        valid = date.str.contains(r"^[\du]{4}$") & ~date.str.contains(r"^u{4}$")
+        return [
+            pl.when(valid).then(date.str.replace_all("u", "0").cast(pl.Int32, strict=False)).alias(f"{name}_from"),
+            pl.when(valid).then(date.str.replace_all("u", "9").cast(pl.Int32, strict=False)).alias(f"{name}_to"),
+        ]
+    return [fixed.str.slice(6, 1).alias("type_of_date")] + bounds(7, "date1") + bounds(11, "date2")
+
+def cross_validate(lf: pl.LazyFrame, columns: list = CHECKED_AGAINST_008) -> pl.LazyFrame:
+    # One lazy query: parse the publication dates of every record and compare them with 008 Date 1/Date 2
+    schema = lf.collect_schema().names()
+    fixed = find_column(schema, '008')
+    columns = [col for col in columns if col in schema]
+    # Matched on the row position rather than 001, which exports often leave empty or repeat
+    fixed_dates = lf.with_row_index("row").select(
+        "row",
+        *fixed_field_dates(pl.col(fixed).cast(pl.String)),
+    )
+    # Multiple-date, inclusive, bulk and questionable types span Date 1 to Date 2
+    spans = pl.col("type_of_date").is_in(["m", "i", "k", "q", "c", "d", "u"])
+    lower = pl.col("date1_from")
+    upper = pl.when(spans).then(pl.coalesce("date2_to", "date1_to")).otherwise(pl.col("date1_to"))
+    in_date1 = pl.col("start_year").is_between(lower, upper)
+    # Type 'e' keeps month/day in Date 2, not a year
+    in_date2 = (pl.col("type_of_date") != "e") & pl.col("start_year").is_between(pl.col("date2_from"), pl.col("date2_to"))
+
+    return (
+        date_facts(lf, columns)
+        .join(fixed_dates, on="row", how="left")
+        .with_columns(
+            pl.when(pl.col("start_year").is_null()).then(pl.lit("unparsed"))
+            .when(pl.col("date1_from").is_null()).then(pl.lit("no 008 date"))
+            .when(in_date1 | in_date2.fill_null(False)).then(pl.lit("consistent"))
+            .otherwise(pl.lit("inconsistent"))
+            .alias("status")
+        )
+    )
+
+def date_precision_summary(lf: pl.LazyFrame, columns: list = DATE_COLUMNS) -> pl.DataFrame:
+    # How every date column parses, in one pass over all of them
+    columns = [col for col in columns if col in lf.collect_schema().names()]
+    if not columns:
+        return pl.DataFrame(schema={"column": pl.String, "precision": pl.String, "Count": pl.UInt32})
+    return (
+        date_facts(lf, columns)
+        .group_by("column", "precision")
+        .agg(
+            pl.len().alias("Count"),
+            pl.col("uncertain").sum().alias("Uncertain"),
+            pl.col("start_year").min().alias("Earliest"),
+            pl.col("end_year").max().alias("Latest"),
+        )
+        .with_columns(pl.col("precision").fill_null("unparsed"))
+        .sort(["column", "Count"], descending=[False, True])
+        .collect()
+    )
+
+def cross_validation_summary(lf: pl.LazyFrame, columns: list = CHECKED_AGAINST_008) -> pl.DataFrame:
+    schema = lf.collect_schema().names()
+    if find_column(schema, '008') is None or not any(col in schema for col in columns):
+        return pl.DataFrame(schema={"column": pl.String, "status": pl.String, "Count": pl.UInt32})
+    return (
+        cross_validate(lf, columns)
+        .group_by("column", "status")
+        .agg(pl.len().alias("Count"))
+        .sort(["column", "Count"], descending=[False, True])
+        .collect()
+    )
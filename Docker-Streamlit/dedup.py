@@ -0,0 +1,165 @@
+import random
+
+import polars as pl
+
+from marc_fields import find_column
+from title_index import normalize_text
+
+# 64 MinHash permutations cut into 16 bands of 4 rows: pairs with title Jaccard around 0.5 or
+# more share at least one band with high probability, dissimilar pairs almost never do.
+NUM_PERM = 64
+BANDS = 16
+ROWS_PER_BAND = NUM_PERM // BANDS
+SHINGLE_SIZE = 3
+# Universal hashing (a*h + b) mod p on 32-bit shingle hashes; a, b < 2**31 keeps a*h + b inside UInt64
+PRIME = 4294967311
+_rng = random.Random(20240601)
+PERMUTATIONS = [(_rng.randrange(1, 1 << 31), _rng.randrange(0, 1 << 31)) for _ in range(NUM_PERM)]
+# Buckets bigger than this come from junk keys (empty or stock titles) and would explode into n^2 pairs
+MAX_BUCKET_SIZE = 200
+
+SCORE_WEIGHTS = {'title': 0.55, 'date': 0.25, 'publisher': 0.1, 'extent': 0.1}
+DEFAULT_THRESHOLD = 0.8
+
+def _first_present(columns: list, fields: list) -> list:
+    return [col for col in (find_column(columns, tag, code) for tag, code in fields) if col is not None]
+
+def match_keys(_df: pl.DataFrame) -> pl.LazyFrame:
+    # Normalized title, year, publisher and extent for every record, with a dense integer record id
+    columns = _df.columns
+
+    def text(fields):
+        sources = _first_present(columns, fields)
+        if not sources:
+            return pl.lit(None, dtype=pl.String)
+        return pl.concat_str([pl.col(col).cast(pl.String) for col in sources], separator=" ", ignore_nulls=True)
+
+    fixed = find_column(columns, '008')
+    date_1 = pl.col(fixed).cast(pl.String).str.slice(7, 4).str.extract(r"^(\d{4})$") if fixed else pl.lit(None, dtype=pl.String)
+    imprint_year = text([('260', 'c'), ('264', 'c')]).str.extract(r"(\d{4})")
+
+    return _df.lazy().select(
+        pl.int_range(pl.len(), dtype=pl.UInt32).alias("rid"),
+        pl.col(find_column(columns, '001')).cast(pl.String).alias("001"),
+        normalize_text(text([('245', 'a'), ('245', 'b')])).alias("title"),
+        pl.coalesce(date_1, imprint_year).alias("year"),
+        normalize_text(text([('260', 'b'), ('264', 'b')])).alias("publisher"),
+        text([('300', 'a')]).str.extract_all(r"\d+").list.join(" ").alias("extent"),
+    ).with_columns(
+        [pl.when(pl.col(col) != "").then(pl.col(col)).alias(col) for col in ("title", "publisher", "extent")]
+    )
+
+def minhash_signatures(keys: pl.LazyFrame) -> pl.LazyFrame:
+    # Character shingles of the normalized title -> NUM_PERM minimum hashes per record
+    shingles = (
+        keys.select("rid", "title")
+        .filter(pl.col("title").str.len_chars() >= SHINGLE_SIZE)
+        .with_columns(pl.int_ranges(0, pl.col("title").str.len_chars() - SHINGLE_SIZE + 1).alias("offset"))
+        .explode("offset")
+        .select("rid", (pl.col("title").str.slice(pl.col("offset"), SHINGLE_SIZE).hash(seed=0) % (1 << 32)).alias("h"))
+    )
+    return shingles.group_by("rid").agg(
+        [
+            ((pl.col("h") * pl.lit(a, dtype=pl.UInt64) + pl.lit(b, dtype=pl.UInt64)) % pl.lit(PRIME, dtype=pl.UInt64)).min().alias(f"m{i}")
+            for i, (a, b) in enumerate(PERMUTATIONS)
+        ]
+    )
+
+def candidate_pairs(signatures: pl.LazyFrame) -> pl.LazyFrame:
+    # Records sharing all ROWS_PER_BAND hashes of any band land in the same bucket
+    bands = pl.concat([
+        signatures.select(
+            "rid",
+            pl.lit(band, dtype=pl.UInt8).alias("band"),
+            pl.struct([f"m{i}" for i in range(band * ROWS_PER_BAND, (band + 1) * ROWS_PER_BAND)]).hash(seed=band).alias("bucket")
+        )
+        for band in range(BANDS)
+    ])
+    buckets = bands.filter(pl.len().over(["band", "bucket"]).is_between(2, MAX_BUCKET_SIZE))
+    return (
+        buckets.join(buckets, on=["band", "bucket"], suffix="_right")
+        .filter(pl.col("rid") < pl.col("rid_right"))
+        .select(pl.col("rid").alias("rid_left"), "rid_right")
+        .unique()
+    )
+
+def _agreement(column: str) -> pl.Expr:
+    # 1 when both sides agree, 0 when both are present and differ, 0.5 when either is missing
+    left, right = pl.col(f"{column}_left"), pl.col(f"{column}_right")
+    return (
+        pl.when(left.is_null() | right.is_null()).then(0.5)
+        .when(left == right).then(1.0)
+        .otherwise(0.0)
+    )
+
+def score_pairs(pairs: pl.LazyFrame, signatures: pl.LazyFrame, keys: pl.LazyFrame) -> pl.LazyFrame:
+    sides = keys.join(signatures, on="rid")
+    names = sides.collect_schema().names()
+    left = sides.rename({col: f"{col}_left" for col in names})
+    right = sides.rename({col: f"{col}_right" for col in names})
+    # Share of equal MinHash values estimates the Jaccard similarity of the title shingles
+    title_similarity = pl.sum_horizontal(
+        [(pl.col(f"m{i}_left") == pl.col(f"m{i}_right")).cast(pl.UInt8) for i in range(NUM_PERM)]
+    ) / NUM_PERM
+    return (
+        pairs.join(left, on="rid_left").join(right, on="rid_right")
+        .with_columns(title_similarity.alias("title_similarity"))
+        .with_columns(
+            (
+                SCORE_WEIGHTS['title'] * pl.col("title_similarity")
+                + SCORE_WEIGHTS['date'] * _agreement("year")
+                + SCORE_WEIGHTS['publisher'] * _agreement("publisher")
+                + SCORE_WEIGHTS['extent'] * _agreement("extent")
+            ).alias("score")
+        )
+        .select("rid_left", "rid_right", "001_left", "001_right", "title_left", "title_right",
+                "year_left", "year_right", "title_similarity", "score")
+    )
+
+def connected_components(edges: pl.DataFrame) -> pl.DataFrame:
+    # Label propagation: every record repeatedly takes the smallest label among its neighbours
+    links = pl.concat([
+        edges.select(pl.col("rid_left").alias("src"), pl.col("rid_right").alias("dst")),
+        edges.select(pl.col("rid_right").alias("src"), pl.col("rid_left").alias("dst")),
+    ])
+    labels = links.select(pl.col("src").alias("rid")).unique().with_columns(pl.col("rid").alias("cluster"))
+    while True:
+        proposed = (
+            links.join(labels, left_on="dst", right_on="rid")
+            .group_by("src")
+            .agg(pl.col("cluster").min().alias("proposed"))
+        )
+        updated = labels.join(proposed, left_on="rid", right_on="src", how="left").with_columns(
+            pl.min_horizontal("cluster", "proposed").alias("proposed")
+        )
+        changed = updated.filter(pl.col("proposed") < pl.col("cluster")).height
+        labels = updated.select("rid", pl.col("proposed").alias("cluster"))
+        if changed == 0:
+            return labels
+
+def find_duplicates(_df: pl.DataFrame, threshold: float = DEFAULT_THRESHOLD) -> dict:
+    # Shingling, MinHash, banding, joins and scoring are all Polars plans, so they run on its thread pool
+    keys = match_keys(_df).collect()
+    signatures = minhash_signatures(keys.lazy()).collect()
+    pairs = (
+        score_pairs(candidate_pairs(signatures.lazy()), signatures.lazy(), keys.lazy())
+        .filter(pl.col("score") >= threshold)
+        .collect()
+    )
+
+    if pairs.is_empty():
+        clusters = pl.DataFrame(schema={"cluster": pl.UInt32, "size": pl.UInt32, "title": pl.String, "001": pl.List(pl.String)})
+        return {'pairs': pairs, 'clusters': clusters}
+
+    members = connected_components(pairs.select("rid_left", "rid_right"))
+    clusters = (
+        members.join(keys.select("rid", "001", "title"), on="rid")
+        .group_by("cluster")
+        .agg(
+            pl.len().alias("size"),
+            pl.col("title").sort_by("rid").first(),
+            pl.col("001").sort_by("rid"),
+        )
+        .sort(["size", "cluster"], descending=[True, False])
+    )
+    return {'pairs': pairs.sort("score", descending=True), 'clusters': clusters}
@@ -0,0 +1,172 @@
+import hashlib
+import os
+import tempfile
+import zipfile
+from pathlib import Path
+
+import polars as pl
+
+from datasets import CACHE_DIR, params_key
+
+# Rows converted and written per step; this bounds the extra memory an export needs
+BATCH_ROWS = 50_000
+# Excel stops at 1,048,576 rows, so long sheets continue on "Name (2)", "Name (3)", ...
+XLSX_MAX_DATA_ROWS = 1_048_575
+
+EXPORT_FORMATS = {
+    "Excel (.xlsx)": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "Zipped CSV (.zip)": ("csv.zip", "application/zip"),
+    "Zipped Parquet (.zip)": ("parquet.zip", "application/zip"),
+}
+
+# Part of every export's file name, so files written by an older version of this module are not reused
+EXPORT_VERSION = hashlib.blake2b(Path(__file__).read_bytes(), digest_size=8).hexdigest()
+# Cells of list columns (e.g. the 001s of a duplicate cluster) are written to Excel joined with this
+LIST_SEPARATOR = "; "
+
+# Whole records, for loading back into the ILS; written from the first sheet, which must hold MARC columns
+RECORD_FORMATS = {
+    **EXPORT_FORMATS,
+    "MARC 21 (.mrc)": ("mrc", "application/marc"),
+    "MARCXML (.xml)": ("xml", "application/marcxml+xml"),
+}
+
+def _height(frame) -> int:
+    return frame.height if isinstance(frame, pl.DataFrame) else len(frame)
+
+def _columns(frame) -> list:
+    return [str(col) for col in frame.columns]
+
+def iter_batches(frame, batch_rows: int = BATCH_ROWS):
+    # Polars slices are zero-copy; pandas frames are converted one slice at a time
+    for offset in range(0, _height(frame), batch_rows):
+        if isinstance(frame, pl.DataFrame):
+            yield frame.slice(offset, batch_rows)
+        else:
+            batch = frame.iloc[offset:offset + batch_rows]
+            batch.columns = _columns(batch)
+            yield pl.from_pandas(batch, include_index=False)
+
+def _flattened(batch: pl.DataFrame) -> pl.DataFrame:
+    # xlsxwriter only writes scalars, so list cells become one string
+    lists = [name for name, dtype in batch.schema.items() if isinstance(dtype, (pl.List, pl.Array))]
+    return batch.with_columns(
+        [pl.col(name).cast(pl.List(pl.String)).list.join(LIST_SEPARATOR) for name in lists]
+    )
+
+def write_xlsx(sheets: dict, path: Path) -> None:
+    import xlsxwriter
+
+    # constant_memory flushes each row to disk as soon as the next one starts
+    workbook = xlsxwriter.Workbook(str(path), {"constant_memory": True, "strings_to_urls": False, "nan_inf_to_errors": True})
+    for name, frame in sheets.items():
+        part = 1
+        worksheet = None
+        row = XLSX_MAX_DATA_ROWS
+        for batch in iter_batches(frame):
+            for values in _flattened(batch).iter_rows():
+                if row >= XLSX_MAX_DATA_ROWS:
+                    sheet_name = name if part == 1 else f"{name} ({part})"
+                    worksheet = workbook.add_worksheet(sheet_name[:31])
+                    worksheet.write_row(0, 0, _columns(frame))
+                    part += 1
+                    row = 0
+                row += 1
+                worksheet.write_row(row, 0, values)
+        if worksheet is None:
+            workbook.add_worksheet(name[:31]).write_row(0, 0, _columns(frame))
+    workbook.close()
+
+def write_csv_zip(sheets: dict, path: Path) -> None:
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, frame in sheets.items():
+            with archive.open(f"{name}.csv", "w", force_zip64=True) as handle:
+                wrote_header = False
+                for batch in iter_batches(frame):
+                    batch.write_csv(handle, include_header=not wrote_header)
+                    wrote_header = True
+                if not wrote_header:
+                    handle.write((",".join(_columns(frame)) + "\n").encode("utf-8"))
+
+def write_parquet(frame, path: Path) -> None:
+    import pyarrow.parquet as pq
+
+    # Each batch becomes one row group, so only one batch is ever materialized as Arrow
+    writer = None
+    for batch in iter_batches(frame):
+        table = batch.to_arrow()
+        if writer is None:
+            writer = pq.ParquetWriter(str(path), table.schema, compression="zstd")
+        writer.write_table(table)
+    if writer is None:
+        pl.DataFrame(schema={col: pl.String for col in _columns(frame)}).write_parquet(path)
+    else:
+        writer.close()
+
+def write_parquet_zip(sheets: dict, path: Path) -> None:
+    # One parquet file per sheet; parquet is already compressed so the entries are stored
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_STORED) as archive:
+        for name, frame in sheets.items():
+            with tempfile.TemporaryDirectory(dir=path.parent) as tmp:
+                part_path = Path(tmp) / f"{name}.parquet"
+                write_parquet(frame, part_path)
+                archive.write(part_path, arcname=part_path.name)
+
+def write_records(sheets: dict, path: Path, fmt: str) -> None:
+    from marc_records import write_marc
+
+    frame = next(iter(sheets.values()))
+    if not isinstance(frame, pl.DataFrame):
+        frame = pl.from_pandas(frame)
+    write_marc(frame, path, fmt)
+
+WRITERS = {
+    "xlsx": write_xlsx,
+    "csv.zip": write_csv_zip,
+    "parquet.zip": write_parquet_zip,
+    "mrc": lambda sheets, path: write_records(sheets, path, "marc"),
+    "xml": lambda sheets, path: write_records(sheets, path, "xml"),
+}
+
+def export_path(fingerprint: str, name: str, extension: str, **params) -> Path:
+    directory = CACHE_DIR / "exports" / fingerprint
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory / f"{name}-{params_key(export_version=EXPORT_VERSION, **params)}.{extension}"
+
+def prepare_export(sheets_factory, extension: str, fingerprint: str, name: str, **params) -> Path:
+    # sheets_factory is only called on a cache miss, so cached downloads never touch the frames
+    path = export_path(fingerprint, name, extension, **params)
+    if path.exists():
+        return path
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix=".part")
+    os.close(fd)
+    try:
+        WRITERS[extension](sheets_factory(), Path(tmp_name))
+        os.replace(tmp_name, path)
+    finally:
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
+    return path
+
+def export_widget(sheets_factory, fingerprint: str, name: str, key: str, formats: dict = EXPORT_FORMATS, **params) -> None:
+    import streamlit as st
+
+    label = st.selectbox("Download format:", list(formats), key=f"{key}_format")
+    extension, mime = formats[label]
+    path = export_path(fingerprint, name, extension, **params)
+
+    # The file is only written when asked for and is reused for the same data and parameters
+    if not path.exists():
+        if not st.button("Prepare download", key=f"{key}_prepare"):
+            return
+        with st.spinner("Writing export..."):
+            prepare_export(sheets_factory, extension, fingerprint, name, **params)
+
+    with path.open("rb") as handle:
+        st.download_button(
+            label=f"Download {label}",
+            data=handle,
+            file_name=f"{name}.{extension}",
+            mime=mime,
+            key=f"{key}_download"
+        )
@@ -0,0 +1,76 @@
+# Cold-start import time of every page, checked against a budget.
+#
+# Each page's top-level imports are timed in a fresh interpreter, so nothing is already cached in
+# sys.modules. Run it inside the container after a build:
+#
+#     python import_benchmark.py            # all pages
+#     python import_benchmark.py --budget 2
+#
+# Exits non-zero when a page goes over budget.
+
+import argparse
+import ast
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+APP_DIR = Path(__file__).parent
+PAGES = [APP_DIR / "Home.py", *sorted((APP_DIR / "pages").glob("*.py")), APP_DIR.parent / "Comparing_Formats.py"]
+# Seconds from interpreter start until a page's imports are done
+COLD_START_BUDGET = float(os.environ.get("FHL_COLD_START_BUDGET", "3.0"))
+# Median of several runs; the first one also warms the OS file cache
+RUNS = 3
+
+def top_level_imports(page: Path) -> list:
+    # The import statements a page runs before its first line of Streamlit code
+    tree = ast.parse(page.read_text(encoding="utf-8"))
+    return [ast.unparse(node) for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom))]
+
+def time_imports(statements: list) -> tuple:
+    # Returns (seconds, heaviest modules) for one cold interpreter
+    code = "import time; start = time.perf_counter()\n" + "\n".join(statements) + "\nprint(time.perf_counter() - start)"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=APP_DIR, capture_output=True, text=True,
+        env={**os.environ, "PYTHONPATH": os.pathsep.join([str(APP_DIR), os.environ.get("PYTHONPATH", "")])},
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    # -X importtime lines: "import time: self [us] | cumulative | imported package"
+    modules = []
+    for line in result.stderr.splitlines():
+        parts = line.removeprefix("import time:").split("|")
+        # Nested imports are indented below their parent; only top-level packages are reported
+        if len(parts) == 3 and parts[1].strip().isdigit() and not parts[2][1:].startswith(" "):
+            modules.append((int(parts[1]) / 1e6, parts[2].strip()))
+    return float(result.stdout.strip().splitlines()[-1]), sorted(modules, reverse=True)[:5]
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Cold-start import time of every page, checked against a budget")
+    parser.add_argument("--budget", type=float, default=COLD_START_BUDGET)
+    args = parser.parse_args()
+
+    over_budget = []
+    for page in PAGES:
+        if not page.exists():
+            continue
+        statements = top_level_imports(page)
+        try:
+            timings = [time_imports(statements) for _ in range(RUNS)]
+        except RuntimeError as error:
+            print(f"{page.name:<32} import failed: {error}")
+            over_budget.append(page.name)
+            continue
+        seconds, heaviest = sorted(timings)[RUNS // 2]
+        status = "ok" if seconds <= args.budget else "OVER BUDGET"
+        print(f"{page.name:<32} {seconds:6.2f}s  {status}")
+        print("    " + ", ".join(f"{name} {took:.2f}s" for took, name in heaviest))
+        if seconds > args.budget:
+            over_budget.append(page.name)
+
+    print(f"Budget {args.budget:.2f}s: {len(over_budget)} page(s) over")
+    return 1 if over_budget else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,285 @@
+import inspect
+import json
+import multiprocessing
+import os
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+import streamlit as st
+
+from datasets import CACHE_DIR, DatasetHandle, handle_for
+from result_cache import RESULT_CACHE, ResultCache
+
+# "thread" runs jobs inside the Streamlit server; "process" hands them to a pool of worker processes so
+# concurrent curators do not share one interpreter (set by docker-compose for multi-user deployments)
+BACKEND = os.environ.get("FHL_JOB_BACKEND", "thread")
+MAX_WORKERS = int(os.environ.get("FHL_JOB_WORKERS", "2"))
+# Admission control: unfinished jobs across the server, and per browser session
+MAX_PENDING_JOBS = int(os.environ.get("FHL_MAX_PENDING_JOBS", "8"))
+MAX_JOBS_PER_SESSION = int(os.environ.get("FHL_MAX_JOBS_PER_SESSION", "2"))
+POLL_SECONDS = 1.0
+# Finished jobs kept for reruns and other sessions before the oldest are forgotten. A finished job only
+# holds the result cache key of its result, so the results themselves stay within the cache's limits.
+MAX_FINISHED_JOBS = 100
+# Progress and cancel flags of process jobs; results go through the result cache on the same volume
+STATE_DIR = CACHE_DIR / "jobs"
+
+class JobCancelled(Exception):
+    pass
+
+class JobRejected(Exception):
+    # Raised by submit() when admission control turns a job away
+    pass
+
+def current_session() -> str:
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx is not None else "local"
+
+class _ProcessReporter:
+    # Stand-in for Job inside a worker process: progress is written to a small JSON file that the
+    # server reads when it polls, and a cancel request is a flag file next to it
+
+    def __init__(self, state_path: str, cancel_path: str):
+        self.state_path = Path(state_path)
+        self.cancel_path = Path(cancel_path)
+
+    def report(self, fraction: float, message: str = "") -> None:
+        if self.cancel_path.exists():
+            raise JobCancelled(self.state_path.stem)
+        tmp = self.state_path.with_suffix(".part")
+        tmp.write_text(json.dumps({"progress": fraction, "message": message}), encoding="utf-8")
+        os.replace(tmp, self.state_path)
+
+def _accepts_job(func) -> bool:
+    # Functions without a _job parameter run without progress reporting
+    return "_job" in inspect.signature(func).parameters
+
+def _run_in_process(state_path: str, cancel_path: str, func, args, kwargs):
+    # Executed in a worker process; `func` must be importable (defined in a module, not a page).
+    # Persisted datasets arrive as handles and are mapped here rather than unpickled.
+    args = [arg.open() if isinstance(arg, DatasetHandle) else arg for arg in args]
+    kwargs = {name: value.open() if isinstance(value, DatasetHandle) else value for name, value in kwargs.items()}
+    if _accepts_job(func):
+        kwargs = {**kwargs, "_job": _ProcessReporter(state_path, cancel_path)}
+    return func(*args, **kwargs)
+
+class Job:
+    # One submitted analysis. The worker reports progress through report(), which is also the point
+    # where a cancellation takes effect.
+
+    def __init__(self, key: str, name: str, session: str):
+        self.key = key
+        self.name = name
+        self.session = session
+        self.status = "queued"  # queued, running, done, failed, cancelled
+        self.progress = 0.0
+        self.message = "Waiting for a worker"
+        # Where the result is stored once the job is done; set by the runner
+        self.result_key = None
+        self.error = None
+        self.submitted = time.time()
+        self.finished = None
+        self.future = None
+        self._cancel = threading.Event()
+        # Set for jobs running in a worker process
+        self.state_path = None
+        self.cancel_path = None
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("done", "failed", "cancelled")
+
+    @property
+    def result(self):
+        # Read from the result cache; None until the job is done, and again once the cache evicted it
+        if self.status != "done" or self.result_key is None:
+            return None
+        return RESULT_CACHE.get(self.result_key)
+
+    @property
+    def evicted(self) -> bool:
+        return self.status == "done" and self.result_key not in RESULT_CACHE
+
+    def report(self, fraction: float, message: str = "") -> None:
+        if self._cancel.is_set():
+            raise JobCancelled(self.key)
+        self.progress = min(max(fraction, 0.0), 1.0)
+        if message:
+            self.message = message
+
+    def refresh(self) -> None:
+        # Picks up the progress a worker process has written
+        if self.state_path is None or self.done:
+            return
+        try:
+            state = json.loads(self.state_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return
+        self.status = "running"
+        self.progress = state["progress"]
+        self.message = state["message"] or self.message
+
+    def cancel(self) -> None:
+        self._cancel.set()
+        if self.cancel_path is not None:
+            self.cancel_path.touch()
+        # A job still in the queue never starts; a running one stops at its next report()
+        if self.future is not None and self.future.cancel():
+            self._finish("cancelled", message="Cancelled before it started")
+
+    def _finish(self, status: str, result=None, error=None, message: str = "", stored: bool = False) -> None:
+        # `stored` results were already put in the result cache by the cached analysis that made them
+        if status == "done" and not stored:
+            RESULT_CACHE.put(self.result_key, result)
+        self.error = error
+        self.message = message or self.message
+        self.finished = time.time()
+        self.status = status
+
+class JobRunner:
+    # Jobs are keyed like cached analyses (dataset fingerprint + analysis name + parameters), so a rerun
+    # or a second session asking for the same analysis gets the job that is already running.
+
+    def __init__(self, max_workers: int = MAX_WORKERS, backend: str = BACKEND):
+        self.backend = backend
+        self._threads = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fhl-job")
+        self._processes = None
+        if backend == "process":
+            # spawn, not fork: forking a process that already runs Polars' thread pool can deadlock
+            self._processes = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+            STATE_DIR.mkdir(parents=True, exist_ok=True)
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key: str, name: str, func, *args, session: str = None, **kwargs) -> Job:
+        # `func` is called with _job=<Job> when it takes one, to report progress; cached_analysis leaves it out of the key.
+        # Joining a job that is already queued or running is always allowed; starting a new one counts
+        # against the server-wide and the per-session limits.
+        session = session or current_session()
+        with self._lock:
+            job = self._jobs.get(key)
+            # A finished job whose result the cache has since evicted is run again
+            if job is not None and not job.evicted:
+                return job
+            pending = [job for job in self._jobs.values() if not job.done]
+            if len(pending) >= MAX_PENDING_JOBS:
+                raise JobRejected(f"The server is busy with {len(pending)} analyses; try again shortly.")
+            if sum(job.session == session for job in pending) >= MAX_JOBS_PER_SESSION:
+                raise JobRejected(f"You already have {MAX_JOBS_PER_SESSION} analyses running; wait for one to finish or cancel it.")
+
+            job = Job(key, name, session)
+            # Cached analyses store their own result; anything else is stored under the job's key
+            cache_key = getattr(func, "cache_key", None)
+            job.result_key = cache_key(*args, **kwargs) if cache_key else ResultCache.make_key(key, "job", {}, "")
+            stored = cache_key is not None
+            self._jobs[key] = job
+            if self._processes is not None and func.__module__ != "__main__":
+                stem = f"{key}-{uuid.uuid4().hex[:8]}"
+                job.state_path, job.cancel_path = STATE_DIR / f"{stem}.json", STATE_DIR / f"{stem}.cancel"
+                # Memory-mapped datasets travel as their file handle instead of a pickled copy
+                args = [handle_for(arg) or arg for arg in args]
+                kwargs = {name: handle_for(value) or value for name, value in kwargs.items()}
+                future = self._processes.submit(_run_in_process, str(job.state_path), str(job.cancel_path), func, args, kwargs)
+                job.future = future
+                future.add_done_callback(lambda future, job=job: self._collect(job, future, stored))
+            else:
+                job.future = self._threads.submit(self._run, job, func, args, kwargs, stored)
+            self._prune()
+        return job
+
+    def get(self, key: str):
+        return self._jobs.get(key)
+
+    def forget(self, key: str) -> None:
+        # Drops a finished job so the next submit() starts it again
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None and job.done:
+                del self._jobs[key]
+
+    def _run(self, job: Job, func, args, kwargs, stored: bool) -> None:
+        if job._cancel.is_set():
+            job._finish("cancelled", message="Cancelled before it started")
+            return
+        job.status = "running"
+        job.message = "Started"
+        try:
+            result = func(*args, **({**kwargs, "_job": job} if _accepts_job(func) else kwargs))
+        except JobCancelled:
+            job._finish("cancelled", message="Cancelled")
+        except Exception as error:
+            job._finish("failed", error=f"{error}\n{traceback.format_exc()}", message=str(error))
+        else:
+            job.progress = 1.0
+            job._finish("done", result=result, message="Finished", stored=stored)
+
+    def _collect(self, job: Job, future, stored: bool) -> None:
+        if future.cancelled():
+            job._finish("cancelled", message="Cancelled before it started")
+        elif isinstance(future.exception(), JobCancelled):
+            job._finish("cancelled", message="Cancelled")
+        elif future.exception() is not None:
+            error = future.exception()
+            job._finish("failed", error="".join(traceback.format_exception(error)), message=str(error))
+        else:
+            job.progress = 1.0
+            # A cached analysis in the worker wrote its result to the shared disk tier already
+            job._finish("done", result=None if stored else future.result(), message="Finished", stored=stored)
+        for path in (job.state_path, job.cancel_path):
+            path.unlink(missing_ok=True)
+
+    def _prune(self) -> None:
+        finished = sorted((job.finished, key) for key, job in self._jobs.items() if job.done)
+        for _, key in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[key]
+
+JOBS = JobRunner()
+
+def job_widget(job: Job, key: str, poll_seconds: float = POLL_SECONDS):
+    # Returns the job's result once it is done. Until then shows progress with a cancel button and
+    # reruns the page every `poll_seconds` to poll the job's state.
+    job.refresh()
+    if job.status == "done":
+        result = job.result
+        if result is None:
+            # Evicted from the result cache since; submitting again recomputes it
+            JOBS.forget(job.key)
+            st.rerun()
+        return result
+
+    if job.status in ("failed", "cancelled"):
+        if job.status == "failed":
+            st.error(f"{job.name} failed: {job.message}")
+            with st.expander("Details", expanded=False):
+                st.code(job.error)
+        else:
+            st.warning(f"{job.name} was cancelled.")
+        if st.button("Run again", key=f"{key}_restart"):
+            JOBS.forget(job.key)
+            st.rerun()
+        return None
+
+    job_progress(job, key)
+    poll_pending([job], poll_seconds)
+
+def job_progress(job: Job, key: str) -> None:
+    # Progress bar and cancel button for a job that is still queued or running
+    job.refresh()
+    if job.done:
+        return
+    st.progress(job.progress, text=f"{job.name}: {job.message}")
+    if st.button("Cancel", key=f"{key}_cancel"):
+        job.cancel()
+        st.rerun()
+
+def poll_pending(jobs: list, poll_seconds: float = POLL_SECONDS) -> None:
+    # Call at the end of a page: reruns it after `poll_seconds` while any of `jobs` is unfinished,
+    # so everything above is drawn before the page waits
+    if any(job is not None and not job.done for job in jobs):
+        time.sleep(poll_seconds)
+        st.rerun()
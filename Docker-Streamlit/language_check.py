@@ -0,0 +1,145 @@
+import threading
+from pathlib import Path
+
+import polars as pl
+
+from marc_fields import fold_expr, find_column, occurrence_groups
+from title_index import normalize_text
+
+# Language name -> MARC language code, used to read 546$a notes ("Text in English and French")
+LANGUAGE_NAMES_PATH = Path(__file__).parent / "languages.csv"
+# ISO 639-2/T and ISO 639-1 codes that turn up in 041 instead of the MARC (639-2/B) form
+CODE_ALIASES = {
+    "deu": "ger", "fra": "fre", "nld": "dut", "zho": "chi", "ces": "cze", "slk": "slo", "ron": "rum",
+    "isl": "ice", "cym": "wel", "eus": "baq", "hye": "arm", "kat": "geo", "ell": "gre", "fas": "per",
+    "mkd": "mac", "sqi": "alb", "msa": "may", "mri": "mao",
+}
+# 008/35-37 values that do not name one language
+NO_SINGLE_LANGUAGE = ["", "mul", "und", "zxx", "|||", "   "]
+
+_lock = threading.Lock()
+_names = None
+# 546$a note -> list of codes, shared by every dataset and session so each note is only parsed once
+_notes = pl.DataFrame(schema={"note": pl.String, "546": pl.List(pl.String)})
+
+def language_names() -> pl.DataFrame:
+    global _names
+    if _names is None:
+        _names = (
+            pl.read_csv(LANGUAGE_NAMES_PATH, schema={"name": pl.String, "code": pl.String})
+            .select(normalize_text(pl.col("name")).alias("word"), "code")
+            .unique("word", keep="first", maintain_order=True)
+        )
+    return _names
+
+def normalize_codes(expr: pl.Expr) -> pl.Expr:
+    # '041$a' cells like 'eng;fre', 'engfre' or 'Eng' -> list of MARC codes in the order given
+    return (
+        expr.cast(pl.String).str.to_lowercase()
+        .str.extract_all(r"[a-z]{3}")
+        .list.eval(pl.element().replace(CODE_ALIASES))
+    )
+
+def parse_notes(notes: pl.Series) -> pl.DataFrame:
+    # Only notes not seen before are parsed: every word is looked up in the language name table
+    global _notes
+    with _lock:
+        new = pl.DataFrame({"note": notes}).drop_nulls().unique().join(_notes, on="note", how="anti")
+        if new.height:
+            parsed = (
+                new.lazy()
+                .with_columns(normalize_text(pl.col("note")).str.split(" ").alias("word"))
+                .with_columns(pl.int_ranges(pl.col("word").list.len()).alias("position"))
+                .explode(["word", "position"])
+                .join(language_names().lazy(), on="word")
+                .group_by("note")
+                .agg(pl.col("code").sort_by("position").unique(maintain_order=True).alias("546"))
+                .collect()
+            )
+            found = new.join(parsed, on="note", how="left").with_columns(
+                pl.col("546").fill_null(pl.lit([], dtype=pl.List(pl.String)))
+            )
+            _notes = pl.concat([_notes, found])
+        return _notes
+
+def language_sources(_df: pl.DataFrame | pl.LazyFrame) -> pl.DataFrame:
+    # One row per record: 001, the 008/35-37 code, the 041$a code list, the 040$b code and the 546$a note.
+    # Built as one lazy select, so a Parquet scan reads just these fields.
+    lf = _df.lazy()
+    columns = lf.collect_schema().names()
+    groups = occurrence_groups(columns)
+
+    def codes(tag, code):
+        sources = groups.get((tag, code))
+        if not sources:
+            return pl.lit([], dtype=pl.List(pl.String))
+        return normalize_codes(fold_expr(sources, f"{tag}${code}").list.join(" "))
+
+    def text(tag, code=""):
+        column = find_column(columns, tag, code)
+        return pl.col(column).cast(pl.String) if column else pl.lit(None, dtype=pl.String)
+
+    id_column = find_column(columns, '001')
+    return lf.select(
+        (pl.col(id_column).cast(pl.String) if id_column else pl.int_range(pl.len()).cast(pl.String)).alias("001"),
+        text('008').str.slice(35, 3).str.to_lowercase().replace(CODE_ALIASES).alias("008"),
+        codes('041', 'a').list.unique(maintain_order=True).alias("041"),
+        normalize_codes(text('040', 'b')).list.first().alias("040"),
+        text('546', 'a').alias("note"),
+    ).collect()
+
+def language_check(_df: pl.DataFrame | pl.LazyFrame) -> dict:
+    # Classify how 008/35-37, 041$a, 546$a and 040$b agree for every record, then count the patterns
+    records = language_sources(_df)
+    notes = parse_notes(records.get_column("note"))
+    records = records.join(notes, on="note", how="left").with_columns(
+        pl.col("546").fill_null(pl.lit([], dtype=pl.List(pl.String)))
+    )
+
+    fixed, codes_041, codes_546, cataloging = pl.col("008"), pl.col("041"), pl.col("546"), pl.col("040")
+    single = fixed.is_not_null() & ~fixed.is_in(NO_SINGLE_LANGUAGE)
+    # 008/35-37 should repeat the first 041$a code; 'mul' is only right when 041 lists several
+    vs_041 = (
+        pl.when(codes_041.list.len() == 0).then(pl.lit("no 041"))
+        .when(fixed == "mul").then(
+            pl.when(codes_041.list.len() > 1).then(pl.lit("mul, 041 lists several")).otherwise(pl.lit("mul, 041 lists one"))
+        )
+        .when(~single).then(pl.lit("no 008 language"))
+        .when(codes_041.list.first() == fixed).then(pl.lit("008 = first 041"))
+        .when(codes_041.list.contains(fixed)).then(pl.lit("008 in 041, not first"))
+        .otherwise(pl.lit("008 not in 041"))
+    )
+    coded = pl.when(single).then(pl.concat_list(codes_041, fixed)).otherwise(codes_041)
+    vs_546 = (
+        pl.when(pl.col("note").is_null()).then(pl.lit("no 546"))
+        .when(codes_546.list.len() == 0).then(pl.lit("546 not parsed"))
+        .when(codes_546.list.set_difference(coded).list.len() == 0).then(pl.lit("546 agrees"))
+        .otherwise(pl.lit("546 names other languages"))
+    )
+    vs_040 = (
+        pl.when(cataloging.is_null()).then(pl.lit("no 040$b"))
+        .when(~single).then(pl.lit("no 008 language"))
+        .when(cataloging == fixed).then(pl.lit("catalogued in text language"))
+        .otherwise(pl.lit("catalogued in other language"))
+    )
+
+    checked = records.with_columns(
+        vs_041.alias("008 vs 041"),
+        vs_546.alias("546 vs codes"),
+        vs_040.alias("040 vs 008"),
+    )
+    patterns = ["008 vs 041", "546 vs codes", "040 vs 008"]
+    return {
+        'records': checked.with_columns([pl.col(col).list.join("; ") for col in ("041", "546")]),
+        'summary': (
+            checked.group_by(patterns)
+            .agg(pl.len().alias("Count"), pl.col("001").head(5).alias("Examples"))
+            .with_columns(pl.col("Examples").list.join("; "))
+            .sort("Count", descending=True)
+        ),
+        'unparsed': (
+            checked.filter(pl.col("546 vs codes") == "546 not parsed")
+            .group_by("note").agg(pl.len().alias("Count"))
+            .sort("Count", descending=True)
+        ),
+    }
@@ -0,0 +1,96 @@
+import re
+
+import polars as pl
+
+# The exports come in two layouts:
+#   wide   - one column per field occurrence and subfield: '700.1.d', '700.2.d', '001.1.', 'LDR.1'
+#   mapped - one column per tag/subfield, repeats ';'-joined: '245$a', '245$a-Title', '001-Control Number'
+WIDE_COLUMN = re.compile(r"^(?P<tag>\d{3}|LDR)\.(?P<occurrence>\d+)\.?(?P<code>[a-z0-9]?)$")
+MAPPED_COLUMN = re.compile(r"^(?P<tag>\d{3})(?:\$(?P<code>[a-z0-9]))?(?:-.*)?$")
+
+REPEAT_DELIMITER = ";"
+
+def parse_column(name: str):
+    # Returns (tag, occurrence, subfield code) or None; occurrence is None for the mapped layout
+    match = WIDE_COLUMN.match(name)
+    if match:
+        return match["tag"], int(match["occurrence"]), match["code"] or ""
+    match = MAPPED_COLUMN.match(name)
+    if match:
+        return match["tag"], None, match["code"] or ""
+    return None
+
+def find_column(columns: list, tag: str, code: str = "", occurrence: int = 1):
+    # First column holding tag/code in either layout, e.g. find_column(df.columns, '245', 'a')
+    for name in columns:
+        parsed = parse_column(name)
+        if parsed and parsed[0] == tag and parsed[2] == code and parsed[1] in (None, occurrence):
+            return name
+    return None
+
+def occurrence_groups(columns: list) -> dict:
+    # {(tag, code): [source columns in occurrence order]} for subfield columns only
+    groups = {}
+    for name in columns:
+        parsed = parse_column(name)
+        if parsed is None or parsed[2] == "":
+            continue
+        tag, occurrence, code = parsed
+        groups.setdefault((tag, code), []).append((occurrence or 0, name))
+    return {key: [name for _, name in sorted(sources)] for key, sources in groups.items()}
+
+def folded_name(tag: str, code: str, sources: list) -> str:
+    # Mapped columns keep their name so pages can keep addressing '245$a-Title'
+    if len(sources) == 1 and WIDE_COLUMN.match(sources[0]) is None:
+        return sources[0]
+    return f"{tag}${code}"
+
+def split_values(column: str, delimiter: str = REPEAT_DELIMITER) -> pl.Expr:
+    # One cell -> list of its trimmed, non-empty ';' parts (null cells become empty lists)
+    return (
+        pl.col(column).cast(pl.String).fill_null("")
+        .str.split(delimiter)
+        .list.eval(pl.element().str.strip_chars())
+        .list.eval(pl.element().filter(pl.element() != ""))
+    )
+
+def fold_expr(sources: list, alias: str, delimiter: str = REPEAT_DELIMITER) -> pl.Expr:
+    # Every value of one tag/subfield across occurrence columns, in occurrence order
+    return pl.concat_list([split_values(col, delimiter) for col in sources]).alias(alias)
+
+def fold_occurrences(_df: pl.DataFrame, delimiter: str = REPEAT_DELIMITER, only: list = None) -> pl.DataFrame:
+    # Replace each tag/subfield's occurrence columns with one pl.List(pl.String) column.
+    # Control fields and non-MARC columns pass through; `only` limits folding to e.g. ['337$a', '338$b'].
+    groups = occurrence_groups(_df.columns)
+    if only is not None:
+        groups = {(tag, code): sources for (tag, code), sources in groups.items() if f"{tag}${code}" in only}
+    folded_sources = {col for sources in groups.values() for col in sources}
+    passthrough = [col for col in _df.columns if col not in folded_sources]
+    return _df.select(
+        [pl.col(col) for col in passthrough]
+        + [fold_expr(sources, folded_name(tag, code, sources), delimiter) for (tag, code), sources in groups.items()]
+    )
+
+def value_count(column) -> pl.Expr:
+    # Number of values in a folded list column (or expression). A missing subfield counts as one
+    # value, as the old "';' count + 1" did, so the page shows the same counts as before.
+    expr = pl.col(column) if isinstance(column, str) else column
+    return expr.list.len().clip(lower_bound=1)
+
+def occurrence_counts(columns: list, suffix: str = "_count") -> list:
+    # Number of values per record in each folded list column
+    return [value_count(col).alias(f"{col}{suffix}") for col in columns]
+
+def counts_aligned(columns: list) -> pl.Expr:
+    # True when every folded column holds the same number of values; replaces nunique(axis=1) > 1
+    lengths = [value_count(col) for col in columns]
+    return (pl.max_horizontal(lengths) == pl.min_horizontal(lengths)).alias("counts_aligned")
+
+def explode_occurrences(_df: pl.DataFrame, column: str, id_column: str) -> pl.DataFrame:
+    # Long form (id, value, position) for classifying each occurrence with plain column expressions
+    return (
+        _df.select(pl.col(id_column), pl.col(column).alias("value"))
+        .with_columns(pl.int_ranges(pl.col("value").list.len()).alias("position"))
+        .explode(["value", "position"])
+        .drop_nulls("value")
+    )
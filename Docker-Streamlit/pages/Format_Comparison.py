@@ -1,6 +1,35 @@
+import io
+
 import streamlit as st
-import pandas as pd
+import polars as pl
 from mitosheet.streamlit.v1 import spreadsheet
+from datasets import load_dataset
+from exports import export_widget
+from jobs import JOBS, JobRejected, job_widget
+from spreadsheet_replay import DF_NAME, code_key, replay_edits, spreadsheet_rows
+
+# Mito sends every cell to the browser, so larger uploads are edited a window at a time and the
+# recorded steps are then replayed over all rows in the background
+SPREADSHEET_ROWS = 5000
+SAMPLE_SEED = 20240601
+
+def read_upload(uploaded_file) -> pl.DataFrame:
+    if uploaded_file.name.lower().endswith(".xlsx"):
+        return pl.read_excel(uploaded_file)
+    if not uploaded_file.name.lower().endswith(".csv"):
+        raise ValueError("Unsupported file format!")
+    # Ensures the csv file is read through different encodings; ISO-8859-1 decodes any byte string
+    data = uploaded_file.getvalue()
+    for encoding in ("utf-8", "ISO-8859-1"):
+        try:
+            text = data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+        return pl.read_csv(io.BytesIO(text.encode("utf-8")), infer_schema_length=10000)
+
+def prepare_upload(raw: pl.DataFrame) -> pl.DataFrame:
+    # Remove rows containing all NAs; all-NA columns are dropped by load_dataset from the column catalog
+    return raw.filter(~pl.all_horizontal(pl.all().is_null()))
 
 st.set_page_config(
     page_title="Family History Library - Metadata Cleanup",
@@ -21,42 +50,40 @@ uploaded_file = st.file_uploader(
 )
 
 if uploaded_file:
-    file_name = uploaded_file.name.lower()
-
     try:
-        if file_name.endswith(".csv"):
-            df = pd.read_csv(uploaded_file, encoding="utf-8")  
-        elif file_name.endswith(".xlsx"):
-            df = pd.read_excel(uploaded_file)
-        else:
-            st.error("Unsupported file format!")
-            st.stop()
-    # Ensures pandas can read the csv file through different encodings        
-    except UnicodeDecodeError:
-        try:
-            df = pd.read_csv(uploaded_file, encoding="ISO-8859-1")  
-        except UnicodeDecodeError:
-            df = pd.read_csv(uploaded_file, encoding="windows-1252")  
-
+        fingerprint, df = load_dataset(uploaded_file, prepare_upload, reader=read_upload)
+    except ValueError as error:
+        st.error(str(error))
+        st.stop()
 
-    # Ensure the DataFrame is in the correct format
-    df = df.copy()  # Ensure it's not a view
-    df.dropna(axis=1, how='all', inplace=True) # Remove columns containing all NAs
-    df.dropna(axis=0, how='all', inplace=True) # Remove rows containing all NAs
-    df.columns = df.columns.astype(str)
+    # Store the dataset in session state so it persists
+    st.session_state["format_dataset"] = (fingerprint, df)
 
-    # Store DataFrame in session state so it persists
-    st.session_state["df"] = df  
+# Ensure the dataset is in session state
+if st.session_state.get("format_dataset") is not None:
+    fingerprint, df = st.session_state["format_dataset"]
 
-# Ensure df is in session state
-if "df" in st.session_state and st.session_state["df"] is not None:
-    df = st.session_state["df"]
-
-    # Pass DataFrame to Mito
-    new_df, code = spreadsheet(df)  
+    windowed = df.height > SPREADSHEET_ROWS
+    if windowed:
+        st.info(
+            f"This file has {df.height:,d} rows; the spreadsheet shows {SPREADSHEET_ROWS:,d} of them at a time. "
+            "Edit them, then apply the recorded steps to every row."
+        )
+        rows = st.radio("Rows to edit:", ["Window", "Random sample"], horizontal=True, key="spreadsheet_rows")
+        if rows == "Window":
+            first_row = st.number_input(
+                "First row:", min_value=0, max_value=df.height - 1, value=0, step=SPREADSHEET_ROWS, key="spreadsheet_first_row"
+            )
+            view = spreadsheet_rows(df, SPREADSHEET_ROWS, first_row=first_row)
+            view_key = f"window-{first_row}"
+        else:
+            view = spreadsheet_rows(df, SPREADSHEET_ROWS, seed=SAMPLE_SEED)
+            view_key = "sample"
+    else:
+        view, view_key = spreadsheet_rows(df, df.height), "all"
 
-    # Store new_df back in session state so changes persist
-    st.session_state["df"] = new_df
+    # Pass the rows to Mito, indexed by their row in the full file; the generated code refers to them as DF_NAME
+    new_df, code = spreadsheet(view, df_names=[DF_NAME], key=f"spreadsheet-{fingerprint}-{view_key}")
 
     # Display modified DataFrame and generated code
     st.write(new_df)
@@ -70,3 +97,38 @@ if "df" in st.session_state and st.session_state["df"] is not None:
             file_name="mito_spreadsheet_code.py",
             mime="text/plain"
         )
+
+    if windowed and code:
+        st.header("Apply to all rows")
+        if st.button("Apply these steps to the full file", key="spreadsheet_apply"):
+            st.session_state["spreadsheet_replay_code"] = code
+        replay_code = st.session_state.get("spreadsheet_replay_code")
+        if replay_code:
+            if replay_code != code:
+                st.caption("Showing the last applied steps; apply again to include newer edits.")
+            try:
+                job = JOBS.submit(f"spreadsheet_replay-{fingerprint}-{code_key(replay_code)}", "Applying spreadsheet steps", replay_edits, fingerprint, df, replay_code)
+            except JobRejected as error:
+                st.warning(str(error))
+                st.stop()
+            replayed = job_widget(job, key="spreadsheet_replay")
+            if replayed is None:
+                st.stop()
+
+            summary = replayed['summary']
+            col1, col2, col3 = st.columns(3)
+            col1.metric("Rows", f"{summary['rows_after']:,d}", delta=summary['rows_after'] - summary['rows_before'])
+            col2.metric("Rows changed", "n/a" if summary['rows_changed'] is None else f"{summary['rows_changed']:,d}")
+            col3.metric("Columns changed", "n/a" if summary['rows_changed'] is None else len(replayed['changes']))
+            if summary['columns_added']:
+                st.write("Columns added: " + ", ".join(summary['columns_added']))
+            if summary['columns_removed']:
+                st.write("Columns removed: " + ", ".join(summary['columns_removed']))
+            if summary['rows_changed'] is None:
+                st.caption("The steps rebuild the row index, so rows could not be matched with the original; only the shape is compared.")
+            else:
+                st.dataframe(replayed['changes'], use_container_width=True)
+
+            edited = replayed['handle'].open()
+            st.dataframe(edited.head(100))
+            export_widget(lambda: {'Edited': edited}, fingerprint, f"spreadsheet-{code_key(replay_code)}", key="spreadsheet_replay")
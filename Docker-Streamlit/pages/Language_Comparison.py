@@ -1,13 +1,19 @@
 # %%
 import streamlit as st
 import polars as pl
-from lets_plot import *
-LetsPlot.setup_html()
 from marc_bibliography_mapping import marc_field_mapping_bibliographic_flat
+from datasets import load_dataset, scope_widget
+from exports import export_widget
+from result_cache import cached_analysis
+from jobs import JOBS, JobRejected, job_progress, job_widget, poll_pending
+from sampling import PREVIEW_MIN_ROWS, SAMPLE_COLUMNS, estimate_shares, preview_caption, stratified_sample
+from marc_fields import find_column
+from title_index import load_index, search
+from language_check import language_check
+from title_languages import language_cases
+from parallel_titles import title_parts
+from plotting import pyplot
 import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
 
 ## Functions
 def remove_non_special_chars(df: pl.DataFrame, column_names: list) -> pl.DataFrame:
@@ -36,8 +42,10 @@ def remove_numbers(df: pl.DataFrame, column_names:list) -> pl.DataFrame:
     
     return df
 
-def drop_columns_that_are_all_null(_df: pl.DataFrame) -> pl.DataFrame:
-    return _df[[s.name for s in _df if not (s.null_count() == _df.height)]]
+def prepare_upload(raw: pl.DataFrame) -> pl.DataFrame:
+    # Renames all columns according to the MARC bibliographic standards; all-null columns are dropped by
+    # load_dataset from the column statistics catalog
+    return raw.rename({tag: marc_field_mapping_bibliographic_flat.get(tag, tag) for tag in raw.columns})
 
 def process_and_combine_files(file_names: list) -> pl.DataFrame:
     from marc_bibliography_mapping import marc_field_mapping_bibliographic_flat
@@ -63,81 +71,18 @@ def process_and_combine_files(file_names: list) -> pl.DataFrame:
 
     return combined_new
 
-@st.cache_data
-def convert_df(_df):
-    # IMPORTANT: Cache the conversion to prevent computation on every rerun
-    return df.write_csv().encode("utf-8")
 #%% Streamlit start
 
-def split_language(df, col_name, delimiter):
+# langid is slow enough that the preview sample is much smaller than on the format page
+PREVIEW_LANGUAGE_ROWS = 5000
 
-    df[col_name] = df[col_name].str.strip()
-    split_df = df[col_name].str.split(delimiter, expand=True)
-    split_df.columns = [f"{col_name}_part{i+1}" for i in range(split_df.shape[1])]
-    df = pd.concat([df, split_df], axis=1)
-    
-    return df 
-
-# Language code to language name mapping
-language_mapping = {
-    'en': 'eng',  # English
-    'de': 'ger',  # German
-    'es': 'spa',  # Spanish
-    'fr': 'fre',  # French
-    'sv': 'swe',  # Swedish
-    'da': 'dan',  # Danish
-    'nl': 'dut',  # Dutch
-    'no': 'nor',  # Norwegian
-    'pt': 'por',  # Portuguese
-    'it': 'ita',  # Italian
-    'fi': 'fin',  # Finnish
-    'cs': 'cze',  # Czech
-    'gl': 'glg',  # Galician
-    'hu': 'hun',  # Hungarian
-    'la': 'lat',  # Latin
-    'id': 'ind',  # Indonesian
-    'pl': 'pol',  # Polish
-    'ms': 'may',  # Malay
-    'nn': 'nno',  # Norwegian (Nynorsk)
-    'sk': 'slo',  # Slovak
-    'is': 'ice',  # Icelandic
-    'af': 'afr',  # Afrikaans
-    'cy': 'wel',  # Welsh
-    'vo': 'vol',  # Volapük
-    'ca': 'cat',  # Catalan
-    'ro': 'rum',  # Romanian
-    'lt': 'lit',  # Lithuanian
-    'nb': 'nob',  # Norwegian (Bokmål)
-    'eu': 'baq',  # Basque
-    'sw': 'swa',  # Swahili
-    'hr': 'hrv',  # Croatian
-    'fo': 'fao',  # Faroese
-    'et': 'est',  # Estonian
-    'sl': 'slv',  # Slovenian
-    'mg': 'mlg',  # Malagasy
-    'lv': 'lav',  # Latvian
-    'ga': 'gle',  # Irish
-    'tr': 'tur',  # Turkish
-    'qu': 'que',  # Quechua
-    'tl': 'tgl',  # Tagalog
-    'jv': 'jav',  # Javanese
-    'ja': 'jpn',  # Japanese
-    'lb': 'ltz',  # Luxembourgish
-    'eo': 'epo',  # Esperanto
-    'xh': 'xho',  # Xhosa
-    'rw': 'kin',  # Kinyarwanda
-    'mt': 'mlt',  # Maltese
-    'an': 'arg',  # Aragonese
-    'ru': 'rus',  # Russian
-    'hy': 'arm',  # Armenian
-    'oc': 'oci',  # Occitan (post-1500)
-    'bg': 'bul',  # Bulgarian
-    'se': 'sme',  # Northern Sami
-    'ht': 'hat',  # Haitian French Creole
-    'wa': 'wln',  # Walloon
-    'zh': 'chi',   # Chinese
-    'sr': 'srp'   # Serbian
-}
+@cached_analysis("language_preview_sample")
+def preview_sample(fingerprint: str, _df: pl.DataFrame, size: int) -> pl.DataFrame:
+    return stratified_sample(_df, size)
+
+@cached_analysis("language_consistency")
+def language_consistency(fingerprint: str, _df: pl.DataFrame | pl.LazyFrame) -> dict:
+    return language_check(_df)
 
 ############################################################################################################################################################
 
@@ -175,112 +120,76 @@ Upload data to get started!
 
 if uploaded_file is not None:
     # Creates dataframe for uploaded file
-    raw = pl.read_excel(uploaded_file)
-
-    # Renames all columns according to the MARC bibliographic standards
-    df = raw.rename({tag: marc_field_mapping_bibliographic_flat.get(tag, tag) for tag in raw.columns})
-    df = drop_columns_that_are_all_null(df)
+    # Parsed and cleaned once per upload, then memory-mapped from the cache on every rerun
+    fingerprint, df = load_dataset(uploaded_file, prepare_upload)
+    # Analyses build lazy plans over the dataset's Parquet copy and read only the columns they use.
+    # Limiting the page to some record types or languages reads only their partitions.
+    fingerprint, df, lf = scope_widget(fingerprint, df, key="language_scope")
 
     # Prints the head of the renamed df
     st.write(df.head())
 
+    # langid over every title part takes minutes on a full catalog, so it runs as a background job
+    # that survives reruns; the page polls it until the result is in. In preview mode the page is drawn
+    # from a stratified sample meanwhile.
+    preview_mode = st.toggle("Preview on a sample", value=df.height > PREVIEW_MIN_ROWS, key="language_preview")
+    try:
+        job = JOBS.submit(f"language_cases-{fingerprint}", "Title language detection", language_cases, fingerprint, lf)
+    except JobRejected as error:
+        st.warning(str(error))
+        if not preview_mode:
+            st.stop()
+        job = None
+
+    sample = None
+    if job is not None and job.status == "done":
+        results = job.result
+    elif preview_mode:
+        sample = preview_sample(fingerprint, df, PREVIEW_LANGUAGE_ROWS)
+        results = language_cases(f"{fingerprint}-sample{PREVIEW_LANGUAGE_ROWS}", sample)
+        st.info(preview_caption(sample, df.height))
+        if job is not None:
+            job_progress(job, key="language_cases")
+    else:
+        results = job_widget(job, key="language_cases")
+        if results is None:
+            st.stop()
+
     st.header('Language columns Clean')
     st.write("The '008 - Fixed-Length Data Elements - General Information' field provides language information in positions 35 to 37. When multiple languages are indicated in the '008' field, only the '041\$a - Language Code of Text' field is used to represent these languages. The combined '008' and '041' fields are used when multiple languages are present in '008,' as these languages are relevant for family search purposes.")
 
-    # %%
-    df1 = df[['008-Fixed-Length Data Elements-General Information','040$b-Language of cataloging', '041$a-Language code of text','546$a-Language note', '245$a-Title', '245$b-Remainder of title']]
-    df1 = df1.to_pandas()
-    # st.dataframe(df1.head())
-    # %%
-    df1['008-language'] = df1['008-Fixed-Length Data Elements-General Information'].str.slice(35, 38)
-    df1['008+041'] = np.where(pd.isna(df1['041$a-Language code of text']), 
-                                df1['008-language'],  
-                                df1['041$a-Language code of text'])
-
-    df1 = split_language(df1, '008+041', r';')
-    # %%
-    result1 = df1.groupby('008+041').size().reset_index(name='count').sort_values(by='count', ascending=False)
-
     st.write("Resulting DataFrame:")
     st.write ("The table shows that the top five languages used are English, French, German, Spanish, and Dutch.")
-    st.dataframe(result1.head())
+    st.dataframe(results['languages'].head())
+
+    # %% 008/35-37, 041$a, 546$a and 040$b normalized to MARC codes and compared record by record
+    st.header('Language Consistency across 008, 041, 546 and 040')
+    consistency = language_consistency(fingerprint, lf)
+    st.write("Each record is classified by how its 008 language agrees with 041$a, whether the languages named in the 546$a note are coded, and whether 040$b matches the text language.")
+    st.dataframe(consistency['summary'])
+    with st.expander("546$a notes naming no known language", expanded=False):
+        st.dataframe(consistency['unparsed'].head(100))
+    export_widget(lambda: {'Patterns': consistency['summary'], 'Records': consistency['records']}, fingerprint, "language_consistency", key="language_consistency")
 
     # %%
     st.header('Title columns Clean')
     st.write("The 245\$a - Title and 245\$b - Remainder of Title fields display the title and subtitle. These fields were combined and then split by the delimiter '=' to create separate columns for each value, organizing the information effectively. The langid library was used to determine the language used in the title. This library use different way to detect the lanague with MARC21.")
 
-    # %% combined 245a and 245b (title and subtitle)
-    df1['245$ab'] = df1['245$a-Title'] + ' ' + df1['245$b-Remainder of title'].fillna('')
-    # %% 
-    def split_title(df, col_name, delimiter):
-        df[col_name] = df[col_name].str.strip()
-        
-        def should_split(value):
-            if '= :' in value:
-                return False  
-            return delimiter in value
-        
-        split_df = df[col_name].apply(lambda x: x.split(delimiter) if should_split(x) else [x])
-        split_df = pd.DataFrame(split_df.tolist(), index=df.index)
-        split_df.columns = [f"{col_name}_part{i+1}" for i in range(split_df.shape[1])]
-        df = pd.concat([df, split_df], axis=1)
-        
-        return df
-
-    df1 = split_title(df1, '245$ab', r'=')
     st.subheader("DataFrame with title split parts:")
-    st.dataframe(df1.head())
-    # %%
-    import langid
-    # %%
-    # Function to detect the language
-    def detect_language(text):
-        try:
-            lang, _ = langid.classify(text)
-            return lang
-        except:
-            return np.nan
-    # %%
-    
-    #%% function to apply the lanague detection
-    def apply_language(df, columns):
-        for i, col in enumerate(columns, start=1):
-            new_col = f"{col}_lan{i}"
-            df[new_col] = df[col].apply(detect_language)
-            df[new_col] = df[new_col].replace(language_mapping)
-        
-        return df
-
-    columns_to_detect = [col for col in df1.columns if '245$ab_part' in col]
-    df1 = apply_language(df1, columns_to_detect)
-
-    # %%
-
-    def get_language_counts(df, columns):
-        value_counts_list = [df[col].value_counts() for col in columns] 
-        title_lan = pd.concat(value_counts_list, axis=1) 
-        title_lan.columns = columns
-        title_lan = title_lan.fillna(0)  
-        title_lan['Total'] = title_lan.sum(axis=1)  
-        
-        return title_lan
-
-    # Define the columns to calculate value counts for
-    columns_to_count = [f"{col}_lan{i}" for i, col in enumerate(columns_to_detect, start=1)]
-    title_lan = get_language_counts(df1, columns_to_count)
+    st.dataframe(results['title_parts'])
+
+    with st.expander("Parallel titles from 245, 880 and 246 with their positions", expanded=False):
+        id_column = find_column(df.columns, '001')
+        parallel = (
+            lf.select(pl.col(id_column).cast(pl.String).alias('001'), title_parts(df.columns))
+            .filter(pl.col('title_parts').list.len() > 1)
+            .collect()
+        )
+        st.write(f"{parallel.height:,d} records carry more than one title")
+        st.dataframe(parallel.head(100).explode('title_parts').unnest('title_parts'))
 
     st.subheader("Language count table for title:")
-    st.dataframe(title_lan.head())
-    # %% ????
-    # page_size = 20
-    # num_pages = len(title_lan) // page_size + 1
-
-    # page = st.slider("Select Page", 1, num_pages, 1)
-
-    # start_row = (page - 1) * page_size
-    # end_row = start_row + page_size
-
-    # st.dataframe(title_lan.iloc[start_row:end_row])
+    st.dataframe(results['title_lan'].head())
 
     # %%
     st.header('Analysis of Language and title')
@@ -292,82 +201,14 @@ if uploaded_file is not None:
         <li>4. Cases where languages differ between the language and title columns.</li>
         </ul>""", unsafe_allow_html=True)
 
-    # %%
-    # List of the columns you're interested in
-    title_cols = [col for col in df1.columns if '245$ab_part' in col and '_lan' in col]
-    lan_cols = [col for col in df1.columns if '008+041_part' in col]
-
     with st.expander("Title Language columns:", expanded=False):
-        st.write(title_cols)
+        st.write(results['title_cols'])
 
     with st.expander("Language columns:", expanded=False):
-        st.write(lan_cols)
-    # %%
-    df1 = df1.fillna('None')
-    def compare_columns(row):
-        matching_values = []
-        lan_not_matching = []
-        title_not_matching = []
-        
-        # Iterate over corresponding column pairs
-        for lan_col, title_col in zip(lan_cols, title_cols):
-            lan_value = row.get(lan_col, '')
-            title_value = row.get(title_col, '')
-            
-            # If both lan_value and part_value match and are non-empty ('none' excluded)
-            if lan_value == title_value and lan_value != np.nan and title_value != 'None':  # Non-empty, matching values
-                matching_values.append(lan_value)
-            else:
-                # If lan_value is not 'none' and doesn't match part_value, add it to lan_not_matching
-                if lan_value != 'None' and lan_value != title_value:
-                    lan_not_matching.append(lan_value)
-                
-                # If part_value is not 'none' and doesn't match lan_value, add it to part_not_matching
-                if title_value != 'None' and title_value != lan_value:
-                    title_not_matching.append(title_value)
-        
-        # Prepare the results
-        matching_value_result = ', '.join(matching_values) if matching_values else 'None'
-        lan_not_matching_result = ', '.join(lan_not_matching) if lan_not_matching else 'None'
-        title_not_matching_result = ', '.join(title_not_matching) if title_not_matching else 'None'
-        
-        return matching_value_result, lan_not_matching_result, title_not_matching_result
-
-    # Apply the function across the DataFrame and expand results into new columns
-    df1[['matching_value', 'mul-Language', 'mul-title']] = df1.apply(compare_columns, axis=1, result_type='expand')
-
-    # %%
-    def update_language_columns(row):
-        # Split the 'matching_value' into individual language values
-        matching_values = [value.strip() for value in row['matching_value'].split(',') if value.strip() != 'None']
-        
-        if row['mul-title'] in matching_values:
-            row['mul-title'] = 'None'
-        
-        if row['mul-Language'] in matching_values:
-            row['mul-Language'] = 'None'
-        
-        return row
-
-    df1 = df1.apply(update_language_columns, axis=1)
-
-    #%%
-
-    # Clean the 'matching_value' column and remove 'None' entries
-    df1['matching_value'] = df1['matching_value'].apply(lambda x: ', '.join(value.strip() for value in x.split(',') if value.strip() != 'None'))
-    # %%
-    def clean_none(value):
-        return ', '.join([lang for lang in value.split(', ') if lang.strip() != 'None']) if value else 'None'
-
-    df1['mul-Language'] = df1['mul-Language'].apply(clean_none).fillna('None').replace('', 'None')
-    df1['mul-title'] = df1['mul-title'].apply(clean_none).fillna('None').replace('', 'None')
-
-    # %%
-    # Create a column to check if both 'language_245' and 'language_008+041' are matching
-    df1['both_matching'] = (df1['mul-Language'] == 'None') & (df1['mul-title'] == 'None')
+        st.write(results['lan_cols'])
 
     # %% Find the cases
-    filtered = df1[['245$a-Title', 'both_matching','matching_value', 'mul-Language', 'mul-title']]
+    filtered = results['filtered']
 
     case1 = filtered[filtered['both_matching'] == True]
     case2 = filtered[(filtered['mul-title']== "None") & (filtered['both_matching'] == False)] 
@@ -382,6 +223,14 @@ if uploaded_file is not None:
     tab3.dataframe(case3)
     tab4.dataframe(case4)
 
+    # %% search titles and statements of responsibility through the persisted token index
+    query = st.text_input("Search titles (245$a, 245$b, 245$c, 880$a, 246$a):", key="title_search")
+    if query:
+        matches = search(load_index(fingerprint, lf), query)
+        st.write(f"{len(matches):,d} matching control numbers")
+        id_column = find_column(df.columns, '001')
+        st.dataframe(lf.filter(pl.col(id_column).cast(pl.String).is_in(matches)).head(100).collect())
+
     # %% final result
     col1, col2 = st.columns(2)
     # %%
@@ -396,44 +245,49 @@ if uploaded_file is not None:
     # Convert to DataFrame for plotting
     counts_df = pd.DataFrame(list(counts.items()), columns=['Case', 'Count'])
 
+    if sample is not None:
+        # Estimated for the whole upload from the sample's cases, with confidence intervals
+        case_labels = pl.from_pandas(filtered[['both_matching', 'mul-title', 'mul-Language']]).select(
+            pl.when(pl.col('both_matching')).then(pl.lit("Case 1"))
+            .when(pl.col('mul-title') == "None").then(pl.lit("Case 2"))
+            .when(pl.col('mul-Language') == "None").then(pl.lit("Case 3"))
+            .otherwise(pl.lit("Case 4"))
+            .alias('Case')
+        )
+        counts_df = estimate_shares(case_labels.hstack(sample.select(SAMPLE_COLUMNS)), ['Case']).sort('Case').to_pandas()
+
     col1.subheader("Result Case Counts:")
     col1.dataframe(counts_df.head())
 
     # Plot
-    plt.figure(figsize=(6, 4))
-    bars = plt.bar(counts_df['Case'], counts_df['Count'], color='skyblue')
+    plt = pyplot()
+    fig, ax = plt.subplots(figsize=(6, 4))
+    bars = ax.bar(counts_df['Case'], counts_df['Count'], color='skyblue')
 
     # Add counts on top of each bar
     for bar in bars:
         yval = bar.get_height()
-        plt.text(bar.get_x() + bar.get_width()/2, yval, int(yval), ha='center', va='bottom')
-
-    plt.xlabel("Case")
-    plt.ylabel("Count")
-    plt.title("Number of Rows per Case")
-    plt.show()
-    plt.savefig("plot.png", bbox_inches="tight")
-    col2.image("plot.png", width=600)
-
-    # Create a dictionary of DataFrames to write
-    df_dict = {
-        'All': filtered,
-        'Case1': case1,
-        'Case2': case2,
-        'Case3': case3,
-        'Case4': case4
-    }
-
-    # Generate Excel file in memory
-    excel_file = save_to_excel(df_dict)
-
-    csv = convert_df(df)
+        ax.text(bar.get_x() + bar.get_width()/2, yval, int(yval), ha='center', va='bottom')
+
+    ax.set_xlabel("Case")
+    ax.set_ylabel("Count")
+    ax.set_title("Number of Rows per Case")
+    col2.pyplot(fig)
+    plt.close(fig)
+
+    # Sheets to write; the export is streamed to disk in batches and cached per uploaded file
+    def case_sheets():
+        return {
+            'All': filtered,
+            'Case1': case1,
+            'Case2': case2,
+            'Case3': case3,
+            'Case4': case4
+        }
 
     st.subheader("Results can be download!")
-    # Provide download button in Streamlit
-    st.download_button(
-        label="Download CSV",
-        data=csv,
-        file_name="output_cases.csv",
-        mime="text/csv"
-    )
\ No newline at end of file
+    export_widget(case_sheets, fingerprint, "output_cases", key="language_cases", preview=sample is not None)
+
+    # Keep polling while the exact pass behind the preview is still running
+    if sample is not None:
+        poll_pending([job])
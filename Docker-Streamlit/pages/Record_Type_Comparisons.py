@@ -1,18 +1,62 @@
 # %%
 import streamlit as st
 import polars as pl
-from lets_plot import *
-LetsPlot.setup_html()
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
 import sys
 
 from marc_bibliography_mapping import marc_field_mapping_bibliographic_flat
-
-def drop_columns_that_are_all_null(_df: pl.DataFrame) -> pl.DataFrame:
-    return _df[[s.name for s in _df if not (s.null_count() == _df.height)]]
+from datasets import last_run, load_dataset, pandas_view, record_run, scan_partitioned, scope_widget
+from dates import MODIFIED, MODIFIED_MONTH, changed_since
+from result_cache import cached_analysis
+from marc_fields import counts_aligned, find_column, fold_occurrences, occurrence_counts
+from dedup import DEFAULT_THRESHOLD, find_duplicates
+from exports import RECORD_FORMATS, export_widget
+from places import place_check
+from validation import load_rules, rules_version, rules_violated, validate
+
+def prepare_upload(raw: pl.DataFrame) -> pl.DataFrame:
+    # All-null columns are dropped by load_dataset from the column statistics catalog
+    return raw.rename({tag: marc_field_mapping_bibliographic_flat.get(tag, tag) for tag in raw.columns})
+
+@cached_analysis("parent_child_linkage")
+def parent_child_linkage(fingerprint: str, _df: pl.DataFrame | pl.LazyFrame) -> dict:
+    # Child records (773$w) split by whether their parent 001 is part of the same upload
+    linkage_columns = ['000-Leader', '001-Control Number', '773$w', 'Parent Control Number', '245$a-Title']
+    lf = _df.lazy()
+    control_numbers = pl.col('001-Control Number').cast(pl.String).drop_nulls().unique().implode()
+    children = lf.with_columns(
+        pl.when(pl.col('773$w').cast(pl.String).is_in(control_numbers))
+        .then(pl.col('773$w'))
+        .otherwise(None)
+        .alias('Parent Control Number')
+    ).filter(pl.col('773$w').is_not_null())
+    available = [col for col in linkage_columns if col in children.collect_schema().names()]
+
+    # Both halves come from one plan, so the shared scan runs once
+    matched, unmatched = pl.collect_all([
+        children.filter(pl.col('Parent Control Number').is_not_null()).select(available),
+        children.filter(pl.col('Parent Control Number').is_null()).select(available),
+    ])
+    return {'matched': matched, 'unmatched': unmatched}
+
+@cached_analysis("duplicate_clusters")
+def duplicate_clusters(fingerprint: str, _df: pl.DataFrame, threshold: float) -> dict:
+    return find_duplicates(_df, threshold)
+
+@cached_analysis("validation_rules")
+def validation_report(fingerprint: str, _df: pl.DataFrame | pl.LazyFrame, version: str, since=None, _rows=None) -> dict:
+    # `version` tracks rules.toml so edited rules are re-evaluated; `since` limits the report to
+    # records whose 005 is on or after that date, read from `_rows` (a scan that can skip older
+    # months). Cross-record rules still look their targets up in all of `_df`.
+    if since is None:
+        return validate(_df.lazy(), load_rules())
+    rows = _rows if _rows is not None else _df.lazy()
+    return validate(_df.lazy(), load_rules(), rows=changed_since(rows, since))
+
+@cached_analysis("place_check")
+def place_check_cached(fingerprint: str, _df: pl.DataFrame) -> dict:
+    return place_check(_df)
 
 # Sets initial page configuration settings
 st.set_page_config(
@@ -26,10 +70,11 @@ st.set_page_config(
 uploaded_file = st.file_uploader("Upload your MARC records file", type=["csv", "xlsx"], accept_multiple_files=False, key="heatmap")
 
 if uploaded_file is not None:
-    raw = pl.read_excel(uploaded_file)
-
-    df = raw.rename({tag: marc_field_mapping_bibliographic_flat.get(tag, tag) for tag in raw.columns})
-    df = drop_columns_that_are_all_null(df)
+    # Parsed and cleaned once per upload, then memory-mapped from the cache on every rerun
+    fingerprint, df = load_dataset(uploaded_file, prepare_upload)
+    # Analyses build lazy plans over the dataset's Parquet copy and read only the columns they use.
+    # Limiting the page to some record types or languages reads only their partitions.
+    fingerprint, df, lf = scope_widget(fingerprint, df, key="record_scope")
 
     # Step 3: Filter columns with specific prefixes
     prefixes = [
@@ -37,7 +82,8 @@ if uploaded_file is not None:
         '260$a', '260$b', '260$c',
         '264$a', '264$b', '264$c', '773$w'
     ]
-    df_filtered = df_cleaned[[col for col in df_cleaned.columns if any(col.startswith(prefix) for prefix in prefixes)]]
+    # Only the selected columns are converted to pandas; the rest of the dataset stays memory-mapped
+    df_filtered = pandas_view(df.select([col for col in df.columns if any(col.startswith(prefix) for prefix in prefixes)]))
 
     # Step 4: Split '008-Fixed-Length Data Elements-General Information' into separate columns
     if '008-Fixed-Length Data Elements-General Information' in df_filtered.columns:
@@ -82,37 +128,45 @@ if uploaded_file is not None:
     st.write("Count of each distinct value in the 'Language' column:")
     st.table(value_counts_language.reset_index().head(10).rename(columns={'index': 'Language', 'Language': 'Count'}))
 
-    # Step 12.5: Create a new column 'Parent Control Number' in df_combined to store the matched '001-Control Number' values
-    if '773$w' in df_combined.columns and '001-Control Number' in df_combined.columns:
-        values_in_773w = df_combined['773$w'].dropna()
-        matching_rows = df_combined[df_combined['001-Control Number'].isin(values_in_773w)]
-        df_combined['Parent Control Number'] = np.where(df_combined['773$w'].isin(matching_rows['001-Control Number']), df_combined['773$w'], np.nan)
-
-    # Step 12.6: Child Records with Existing Parent Records
-    st.header("Step 12.6: Child Records with Existing Parent Records")
-    if 'Parent Control Number' in df_combined.columns:
-        matched_df = df_combined[df_combined['Parent Control Number'].notna()][['000-Leader', '001-Control Number', '773$w', 'Parent Control Number', '245$a-Title']]
+    # Step 11.4: Compare the free-text place of publication with the 008/15-17 country code
+    st.header("Step 11.4: Place of Publication vs. 008 Country Code")
+    places = place_check_cached(fingerprint, df)
+    if places:
+        st.write("Each 260$a/264$a place is matched to a MARC country code through the local gazetteer and compared with 008/15-17:")
+        st.table(places['summary'])
+        st.write("Records whose place disagrees with the 008 code:")
+        st.dataframe(places['mismatches'].head(100))
+        with st.expander("Places missing from the gazetteer", expanded=False):
+            st.dataframe(places['unresolved'].head(100))
+
+    # Step 12.5: Match each '773$w' against the '001-Control Number' values in the upload
+    if '773$w' in df.columns and '001-Control Number' in df.columns:
+        linkage = parent_child_linkage(fingerprint, lf)
+
+        # Step 12.6: Child Records with Existing Parent Records
+        st.header("Step 12.6: Child Records with Existing Parent Records")
         st.write("This table shows child records that have existing parent records:")
-        st.table(matched_df.head(10))
+        st.table(linkage['matched'].head(10))
 
-    # Step 12.8: Child Records without Existing Parent Records
-    st.header("Step 12.8: Child Records without Existing Parent Records")
-    if 'Parent Control Number' in df_combined.columns:
-        unmatched_df = df_combined[df_combined['773$w'].isin(values_in_773w) & ~df_combined['773$w'].isin(df_combined['001-Control Number'])]
-        unmatched_df_filtered = unmatched_df[['000-Leader', '001-Control Number', '773$w', 'Parent Control Number', '245$a-Title']]
+        # Step 12.8: Child Records without Existing Parent Records
+        st.header("Step 12.8: Child Records without Existing Parent Records")
         st.write("This table shows child records that do not have existing parent records in the data:")
-        st.table(unmatched_df_filtered.head(10))
+        st.table(linkage['unmatched'].head(10))
 
     # Step 13.2: Filter rows where '336$2' is not null
     st.header("Step 13.2: Filter Rows where '336$2' is Not Null")
-    filtered_df_336 = df_cleaned[df_cleaned['336$2'].notna()]
+    has_336 = pl.col('336$2').is_not_null()
     st.write("This table shows rows where '336$2' is not null:")
-    st.dataframe(filtered_df_336.head(10))
+    st.dataframe(df.lazy().filter(has_336).head(10).collect())
+
+    # Steps 13.3 and 14 read only these columns of the rows with a 336$2
+    columns_to_check = ['336$2', '336$a', '336$b', '337$2', '337$a', '337$b', '338$2', '338$a', '338$b', '362$a-Start date of publication']
+    columns_336 = [col for col in ['000-Leader', '001-Control Number'] + columns_to_check if col in df.columns]
+    filtered_df_336 = pandas_view(df.select(columns_336).filter(has_336))
 
     # Step 13.3: Display Distinct Values in Specified Columns
     st.header("Step 13.3: Distinct Values in Specified Columns")
     distinct_values = {}
-    columns_to_check = ['336$2', '336$a', '336$b', '337$2', '337$a', '337$b', '338$2', '338$a', '338$b', '362$a-Start date of publication']
 
     for col in columns_to_check:
         if col in filtered_df_336.columns:
@@ -138,41 +192,74 @@ if uploaded_file is not None:
     st.write("This table shows the final DataFrame with the specified columns:")
     st.table(final_df.head(10))
 
-    # Step 13.5: Create new columns to count the occurrences of ';' in each of the specified columns
+    # Step 13.5: Fold the ';'-separated values into list columns and flag records whose 337/338 counts disagree
     st.header("Step 13.5: Count Occurrences of ';' in Specified Columns")
-    columns_to_analyze = ['001-Control Number', '337$a', '337$b', '338$2', '338$a', '338$b']
-
-    # Initialize count columns in filtered_df_336 for each analyzed column
-    for col in columns_to_analyze:
-        if col in filtered_df_336.columns:
-            count_col_name = f"{col}_count"
-            filtered_df_336[count_col_name] = filtered_df_336[col].apply(lambda x: str(x).count(';') if pd.notna(x) else 0)
-
-    # Add 1 to each cell in the specified count columns
-    count_columns = ['337$a_count', '337$b_count', '338$2_count', '338$a_count', '338$b_count']
+    columns_to_analyze = [col for col in ['337$a', '337$b', '338$2', '338$a', '338$b'] if col in df.columns]
+    id_columns = [col for col in ['001-Control Number'] if col in df.columns]
 
-    # Increment the values in each of the specified columns by 1
-    for col in count_columns:
-        if col in filtered_df_336.columns:
-            filtered_df_336[col] += 1  # Add 1 to each cell in the count columns
-
-    # Ensure that '001-Control Number' is included in filtered_df if it exists in df_cleaned
-    if '001-Control Number' in df_cleaned.columns:
-        filtered_df_336['001-Control Number'] = df_cleaned['001-Control Number']
-
-    # Define columns to display, including '001-Control Number' and incremented count columns
-    columns_to_display = ['001-Control Number'] + count_columns
-
-    # Create a condition to filter rows where values are not equal across the count columns (excluding '001-Control Number')
-    unequal_condition = filtered_df_336[count_columns].nunique(axis=1) > 1
-
-    # Filter rows based on the condition and include '001-Control Number' in the result
-    unequal_rows_df = filtered_df_336[unequal_condition]
-
-    # Select only the columns that are available in the DataFrame
-    available_columns = [col for col in columns_to_display if col in unequal_rows_df.columns]
-    unequal_rows_df_filtered = unequal_rows_df[available_columns]
+    if columns_to_analyze:
+        folded_336 = fold_occurrences(
+            df.filter(pl.col('336$2').is_not_null()).select(id_columns + columns_to_analyze),
+            only=columns_to_analyze
+        )
+        unequal_rows_df_filtered = (
+            folded_336
+            .filter(~counts_aligned(columns_to_analyze))
+            .select([pl.col(col) for col in id_columns] + occurrence_counts(columns_to_analyze))
+        )
 
-    # Display the resulting DataFrame with unequal count values, including '001-Control Number'
-    st.write("This table shows rows with unequal count values across the specified columns:")
-    st.table(unequal_rows_df_filtered.head(10))
\ No newline at end of file
+        # Display the resulting DataFrame with unequal count values, including '001-Control Number'
+        st.write("This table shows rows with unequal count values across the specified columns:")
+        st.caption("A missing subfield counts as one value. Empty values between ';' separators are not counted.")
+        st.table(unequal_rows_df_filtered.head(10))
+
+    # Step 15: Near-duplicate records (title, date, publisher and extent match keys with MinHash/LSH)
+    st.header("Step 15: Near-duplicate Records")
+    threshold = st.slider("Minimum match score:", 0.5, 1.0, DEFAULT_THRESHOLD, 0.05)
+    if st.checkbox("Find near-duplicate records"):
+        duplicates = duplicate_clusters(fingerprint, df, threshold)
+        clusters = duplicates['clusters'].with_columns(pl.col('001').list.join('; '))
+        st.write(f"{clusters.height:,d} duplicate clusters covering {clusters['size'].sum():,d} records")
+        st.dataframe(clusters.head(100))
+
+        with st.expander("Scored candidate pairs", expanded=False):
+            st.dataframe(duplicates['pairs'].head(100))
+
+        export_widget(lambda: {'Clusters': clusters, 'Pairs': duplicates['pairs']}, fingerprint, "duplicate_clusters", key="duplicates", threshold=threshold)
+
+    # Step 16: Declarative validation rules from rules.toml, checked in one pass over the upload
+    st.header("Step 16: Validation Rules")
+    if st.checkbox("Run validation rules"):
+        since = None
+        has_005 = find_column(df.columns, '005') is not None
+        if has_005:
+            # A recurring check only needs the records changed since it last ran; the copy partitioned
+            # by last-modified month lets the scan skip every older month
+            previous = last_run("validation_rules", fingerprint)
+            if st.checkbox("Only records changed since the last run", value=previous is not None, key="validation_changed"):
+                since = st.date_input("Changed since:", value=previous.date() if previous else None, key="validation_since")
+        rows = scan_partitioned(df, [MODIFIED_MONTH]) if since else None
+        report = validation_report(fingerprint, lf, rules_version(), since=since, _rows=rows)
+        if since is None and has_005 and st.session_state.get("validation_recorded") != fingerprint:
+            # Only a complete run moves the baseline, once per dataset and session
+            newest = scan_partitioned(df, [MODIFIED_MONTH]).select(pl.col(MODIFIED).max()).collect().item()
+            record_run("validation_rules", fingerprint, newest)
+            st.session_state["validation_recorded"] = fingerprint
+        summary = report['summary']
+        st.write(f"{report['violations'].height:,d} records break at least one of {summary.height} rules")
+        st.dataframe(summary)
+        if report['skipped']:
+            st.caption("Skipped, fields not in this upload: " + ", ".join(report['skipped']))
+
+        rule = st.selectbox("Show records breaking:", summary.filter(pl.col('violations') > 0)['rule'].to_list())
+        if rule:
+            bit = summary.filter(pl.col('rule') == rule)['bit'].item()
+            st.dataframe(rules_violated(report['violations'], bit).head(100))
+
+        export_widget(lambda: {'Rules': summary, 'Violations': report['violations']}, fingerprint, "validation_rules", key="validation", version=rules_version(), since=str(since) if since else None,
+                      record_types=st.session_state.get("record_scope_record_type"), languages=st.session_state.get("record_scope_language"))
+
+    # Step 17: The records themselves as MARC 21 or MARCXML, to load back into the ILS
+    st.header("Step 17: Download Records")
+    st.write("The uploaded records rebuilt as MARC 21 (ISO 2709) or MARCXML, with the Leader and directory recomputed.")
+    export_widget(lambda: {'Records': df}, fingerprint, "records", key="records", formats=RECORD_FORMATS)
@@ -0,0 +1,73 @@
+import streamlit as st
+import polars as pl
+from datasets import load_dataset, scan
+from exports import export_widget
+from jobs import JOBS, JobRejected, job_widget
+from snapshot_diff import compare_snapshots
+
+def read_upload(uploaded_file) -> pl.DataFrame:
+    # Everything is compared as text, so CSV columns are not type-inferred
+    if uploaded_file.name.lower().endswith(".csv"):
+        return pl.read_csv(uploaded_file, infer_schema=False)
+    return pl.read_excel(uploaded_file)
+
+def prepare_snapshot(raw: pl.DataFrame) -> pl.DataFrame:
+    return raw.rename({col: col.strip() for col in raw.columns}) # Remove white space in the column names
+
+st.set_page_config(
+    page_title="Family History Library - Metadata Cleanup",
+    page_icon="assets/Family Search Logo.png",
+    layout="wide",
+    initial_sidebar_state="expanded"
+)
+
+st.title("Snapshot Comparison")
+st.markdown("""
+Compare two exports of the catalog, for example before and after a clean-up round. Records are matched on
+their 001 control number and reported as added, removed or modified, with the fields that changed.
+""")
+
+col1, col2 = st.columns(2)
+before_file = col1.file_uploader("Earlier export", type=["csv", "xlsx"], accept_multiple_files=False, key="snapshot_before")
+after_file = col2.file_uploader("Later export", type=["csv", "xlsx"], accept_multiple_files=False, key="snapshot_after")
+
+if before_file is not None and after_file is not None:
+    before_fingerprint, before = load_dataset(before_file, prepare_snapshot, reader=read_upload)
+    after_fingerprint, after = load_dataset(after_file, prepare_snapshot, reader=read_upload)
+    pair = f"{before_fingerprint}-{after_fingerprint}"
+
+    # Both exports are scanned from their Parquet copies, so the diff streams instead of holding them
+    try:
+        job = JOBS.submit(f"snapshot_diff-{pair}", "Snapshot comparison", compare_snapshots, pair, scan(before), scan(after))
+    except JobRejected as error:
+        st.warning(str(error))
+        st.stop()
+    diff = job_widget(job, key="snapshot_diff")
+    if diff is None:
+        st.stop()
+
+    st.header("Records")
+    counts = dict(diff['summary'].iter_rows())
+    metrics = st.columns(4)
+    for column, status in zip(metrics, ["added", "removed", "modified", "unchanged"]):
+        column.metric(status.capitalize(), f"{counts.get(status, 0):,d}")
+
+    st.header("Changed fields")
+    st.write("Number of modified records in which each field changed:")
+    st.dataframe(diff['field_counts'], use_container_width=True)
+
+    status = st.selectbox("Show records:", ["modified", "added", "removed"], key="snapshot_status")
+    records = diff['records'].filter(pl.col('status') == status)
+    st.write(f"{records.height:,d} {status} records")
+    st.dataframe(records.head(1000), use_container_width=True)
+
+    if status == "modified":
+        selected = st.text_input("Show the field changes of a 001 control number:", key="snapshot_record")
+        if selected:
+            st.dataframe(diff['fields'].filter(pl.col('001') == selected.strip()).collect(), use_container_width=True)
+
+    st.subheader("Results can be download!")
+    export_widget(
+        lambda: {'Records': diff['records'], 'Fields': diff['fields'].collect()},
+        after_fingerprint, f"snapshot_diff-{before_fingerprint}", key="snapshot_diff"
+    )
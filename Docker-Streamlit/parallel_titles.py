@@ -0,0 +1,88 @@
+import polars as pl
+
+from marc_fields import parse_column, split_values
+
+# 245 $a/$b hold the title proper and any parallel titles after '='; '= :' is a title proper
+# ending in '=' followed by other title information, so those are not split
+PARALLEL_DELIMITER = "="
+NO_SPLIT = "= :"
+PLACEHOLDER = "\x00"
+# (source, tag, subfields joined into one title)
+TITLE_SOURCES = [
+    ("245", "245", ["a", "b"]),
+    ("880", "880", ["a"]),  # alternate script form of the title
+    ("246", "246", ["a"]),  # varying and parallel titles
+]
+PART_FIELDS = {"source": pl.String, "position": pl.UInt32, "title": pl.String}
+
+def field_titles(columns: list, tag: str, codes: list):
+    # One entry per occurrence of the field with its subfields joined by a space; None when absent.
+    # Single-subfield sources also split the ';'-joined repeats of the mapped layout.
+    occurrences = {}
+    for name in columns:
+        parsed = parse_column(name)
+        if parsed and parsed[0] == tag and parsed[2] in codes:
+            occurrences.setdefault(parsed[1] or 0, {})[parsed[2]] = name
+    if not occurrences:
+        return None
+    if len(codes) == 1:
+        return pl.concat_list([split_values(subfields[codes[0]]) for _, subfields in sorted(occurrences.items())])
+    return pl.concat_list([
+        pl.concat_str([pl.col(subfields[code]).cast(pl.String) for code in codes if code in subfields], separator=" ", ignore_nulls=True)
+        for _, subfields in sorted(occurrences.items())
+    ])
+
+def split_parallel(titles: pl.Expr) -> pl.Expr:
+    # List of titles -> one flat list of their parallel parts, trimmed, in order. The '=' of titles
+    # containing '= :' is swapped for a placeholder first, so splitting leaves those titles whole.
+    protected = titles.list.eval(
+        pl.when(pl.element().str.contains(NO_SPLIT, literal=True))
+        .then(pl.element().str.replace_all(PARALLEL_DELIMITER, PLACEHOLDER, literal=True))
+        .otherwise(pl.element())
+    )
+    return (
+        protected.list.join(PARALLEL_DELIMITER)
+        .str.split(PARALLEL_DELIMITER)
+        .list.eval(pl.element().str.replace_all(PLACEHOLDER, PARALLEL_DELIMITER, literal=True).str.strip_chars(" /:;,."))
+        .list.eval(pl.element().filter(pl.element() != ""))
+    )
+
+def _with_positions(parts: pl.Expr, source: str) -> pl.Expr:
+    return parts.list.eval(
+        pl.struct(
+            pl.lit(source).alias("source"),
+            (pl.int_range(pl.len(), dtype=pl.UInt32) + 1).alias("position"),
+            pl.element().alias("title"),
+        )
+    )
+
+def title_parts(columns: list) -> pl.Expr:
+    # One list of {source, position, title} per record covering 245, 880$a and 246$a
+    pieces = []
+    for source, tag, codes in TITLE_SOURCES:
+        titles = field_titles(columns, tag, codes)
+        if titles is not None:
+            pieces.append(_with_positions(split_parallel(titles), source))
+    if not pieces:
+        return pl.lit([], dtype=pl.List(pl.Struct(PART_FIELDS))).alias("title_parts")
+    return pl.concat_list(pieces).alias("title_parts")
+
+def source_titles(columns: list, source: str = "245") -> pl.Expr:
+    # The title strings of one source, in position order
+    return title_parts(columns).list.eval(
+        pl.element().filter(pl.element().struct.field("source") == source).struct.field("title")
+    ).alias("parts")
+
+def part_columns(parts: pl.Series, prefix: str = "245$ab") -> pl.DataFrame:
+    # <prefix>_part1..n columns (plus <prefix>, the parts rejoined), the layout the language pipeline expects
+    width = max(parts.list.len().max() or 0, 1)
+    return pl.DataFrame(
+        [parts.list.join(f" {PARALLEL_DELIMITER} ").alias(prefix)]
+        + [parts.list.get(i, null_on_oob=True).alias(f"{prefix}_part{i + 1}") for i in range(width)]
+    )
+
+def title_part_columns(_df, prefix: str = "245$ab", source: str = "245") -> pl.DataFrame:
+    # The parts of one source as columns; a LazyFrame is scanned for the title fields only
+    lf = _df.lazy()
+    parts = lf.select(source_titles(lf.collect_schema().names(), source)).collect().get_column("parts")
+    return part_columns(parts, prefix)
@@ -0,0 +1,99 @@
+import threading
+from pathlib import Path
+
+import polars as pl
+
+from marc_fields import find_column
+from title_index import normalize_text
+
+# Local place name -> MARC country code table; extend it as unresolved places come up
+GAZETTEER_PATH = Path(__file__).parent / "gazetteer.csv"
+PLACE_FIELDS = [('260', 'a'), ('264', 'a')]
+# Sine loco forms ("[S.l.]", "[Place of publication not identified]")
+UNKNOWN_PLACES = ["s l", "sl", "sine loco", "place of publication not identified", "n p"]
+# 008/15-17 codes that do not name one place: no place, various places
+NO_SINGLE_PLACE = ["", "xx", "vp"]
+# Subdivision codes roll up to their country: nyu -> xxu, enk -> xxk, onc -> xxc, xna -> at
+PARENT_BY_SUFFIX = {"u": "xxu", "k": "xxk", "c": "xxc", "a": "at"}
+
+_lock = threading.Lock()
+_gazetteer = None
+# place string -> code, shared by every dataset and session so each string is only resolved once
+_resolved = pl.DataFrame(schema={"place": pl.String, "place_code": pl.String})
+
+def gazetteer() -> pl.DataFrame:
+    global _gazetteer
+    if _gazetteer is None:
+        _gazetteer = (
+            pl.read_csv(GAZETTEER_PATH, schema={"name": pl.String, "code": pl.String})
+            .select(normalize_text(pl.col("name")).alias("component"), "code")
+            .unique("component", keep="first", maintain_order=True)
+        )
+    return _gazetteer
+
+def country(code: pl.Expr) -> pl.Expr:
+    return pl.when(code.str.len_chars() == 3).then(
+        code.str.slice(2, 1).replace_strict(PARENT_BY_SUFFIX, default=code)
+    ).otherwise(code)
+
+def resolve_places(places: pl.Series) -> pl.DataFrame:
+    # Only strings not seen before are looked up. Each is split into comma-separated parts and the
+    # rightmost part found in the gazetteer wins ("Cambridge, Mass." -> mau, "Paris, France" -> fr).
+    global _resolved
+    with _lock:
+        new = pl.DataFrame({"place": places}).drop_nulls().unique().join(_resolved, on="place", how="anti")
+        if new.height:
+            matched = (
+                new.lazy()
+                .with_columns(
+                    pl.col("place").str.replace_all(r"[\[\]?]", "").str.replace_all(r"[;:]", ",")
+                    .str.split(",").alias("component")
+                )
+                .with_columns(pl.int_ranges(pl.col("component").list.len()).alias("position"))
+                .explode(["component", "position"])
+                .with_columns(normalize_text(pl.col("component")).alias("component"))
+                .join(gazetteer().lazy(), on="component")
+                .group_by("place")
+                .agg(pl.col("code").sort_by("position", descending=True).first().alias("place_code"))
+                .collect()
+            )
+            _resolved = pl.concat([_resolved, new.join(matched, on="place", how="left")])
+        return _resolved
+
+def place_check(_df: pl.DataFrame) -> dict:
+    # Compare the 260$a/264$a place with the 008/15-17 country code for every record
+    columns = _df.columns
+    place_columns = [col for col in (find_column(columns, tag, code) for tag, code in PLACE_FIELDS) if col]
+    fixed = find_column(columns, '008')
+    if not place_columns or fixed is None:
+        return {}
+
+    records = _df.select(
+        pl.col(find_column(columns, '001')).cast(pl.String).alias("001"),
+        pl.coalesce([pl.col(col).cast(pl.String) for col in place_columns]).str.strip_chars(" :;,").alias("place"),
+        pl.col(fixed).cast(pl.String).str.slice(15, 3).str.strip_chars(" |").alias("008 place"),
+    )
+    lookup = resolve_places(records.get_column("place"))
+
+    place, place_code, fixed_code = pl.col("place"), pl.col("place_code"), pl.col("008 place")
+    checked = records.join(lookup, on="place", how="left").with_columns(
+        pl.when(place.is_null()).then(pl.lit("no place"))
+        .when(normalize_text(place).is_in(UNKNOWN_PLACES)).then(pl.lit("sine loco"))
+        .when(fixed_code.is_null() | fixed_code.is_in(NO_SINGLE_PLACE)).then(pl.lit("no 008 place"))
+        .when(place_code.is_null()).then(pl.lit("unresolved"))
+        .when(place_code == fixed_code).then(pl.lit("match"))
+        .when(country(place_code) == country(fixed_code)).then(pl.lit("same country"))
+        .otherwise(pl.lit("mismatch"))
+        .alias("status")
+    )
+
+    return {
+        'records': checked,
+        'summary': checked.group_by("status").agg(pl.len().alias("Count")).sort("Count", descending=True),
+        'mismatches': checked.filter(pl.col("status") == "mismatch"),
+        'unresolved': (
+            checked.filter(pl.col("status") == "unresolved")
+            .group_by("place").agg(pl.len().alias("Count"))
+            .sort("Count", descending=True)
+        ),
+    }
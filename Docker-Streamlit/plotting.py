@@ -0,0 +1,39 @@
+import importlib
+import threading
+
+# Plotting backends cost most of a page's import time, and a page run usually draws with one of them
+# or none. Pages ask for a backend where they draw and only that one is imported, once per process.
+BACKENDS = {
+    "plotly": "plotly.express",
+    "matplotlib": "matplotlib.pyplot",
+    "seaborn": "seaborn",
+    "altair": "altair",
+    "lets_plot": "lets_plot",
+}
+
+_lock = threading.Lock()
+_loaded = {}
+
+def backend(name: str):
+    # The backend's module, imported on first use
+    with _lock:
+        if name not in _loaded:
+            if name in ("matplotlib", "seaborn"):
+                # Figures are handed to Streamlit, never shown in a window; the Agg backend needs no GUI toolkit
+                import matplotlib
+                matplotlib.use("Agg")
+            module = importlib.import_module(BACKENDS[name])
+            if name == "lets_plot":
+                module.LetsPlot.setup_html()
+            _loaded[name] = module
+        return _loaded[name]
+
+def express():
+    return backend("plotly")
+
+def pyplot():
+    return backend("matplotlib")
+
+def loaded() -> list:
+    # Backends imported so far in this process
+    return sorted(_loaded)
@@ -0,0 +1,115 @@
+import polars as pl
+
+from dedup import connected_components
+from marc_fields import occurrence_groups, split_values
+from title_index import normalize_text
+
+PUBLISHER_FIELDS = [('260', 'b'), ('264', 'b')]
+# Words that do not tell two publishers apart
+STOPWORDS = ["the", "and", "co", "company", "inc", "incorporated", "ltd", "limited", "corp", "corporation", "llc", "gmbh", "sa"]
+# Sine nomine placeholders are not publisher names
+UNKNOWN_KEYS = ["s n", "sn", "sine nomine", "publisher not identified"]
+
+NGRAM_SIZE = 3
+BLOCK_KEYS_PER_NAME = 2  # each name joins the blocks of its rarest trigrams
+MAX_BLOCK_SIZE = 500
+DEFAULT_THRESHOLD = 88  # rapidfuzz token_sort_ratio, 0-100
+
+def publisher_counts(_df: pl.DataFrame) -> pl.DataFrame:
+    # Distinct publisher strings across every 260$b/264$b occurrence with how often each is used
+    groups = occurrence_groups(_df.columns)
+    sources = [col for key in PUBLISHER_FIELDS for col in groups.get(key, [])]
+    if not sources:
+        return pl.DataFrame(schema={"publisher": pl.String, "records": pl.UInt32})
+    return (
+        _df.lazy()
+        .select(pl.concat_list([split_values(col) for col in sources]).alias("publisher"))
+        .explode("publisher")
+        .with_columns(pl.col("publisher").str.strip_chars(" ,:;/"))
+        .filter(pl.col("publisher").is_not_null() & (pl.col("publisher") != ""))
+        .group_by("publisher")
+        .agg(pl.len().cast(pl.UInt32).alias("records"))
+        .collect()
+    )
+
+def publisher_key(expr: pl.Expr) -> pl.Expr:
+    # Fingerprint key: folded tokens minus stopwords, deduplicated and sorted ("Smith & Co." == "co smith")
+    return (
+        normalize_text(expr)
+        .str.split(" ")
+        .list.eval(pl.element().filter((pl.element() != "") & ~pl.element().is_in(STOPWORDS)))
+        .list.unique()
+        .list.sort()
+        .list.join(" ")
+    )
+
+def _blocks(keys: pl.DataFrame) -> pl.DataFrame:
+    # (kid, block) rows; a block is one of a key's rarest character trigrams, so similar names meet
+    # in at least one block while common trigrams ("ing", "pub") never create giant blocks
+    grams = (
+        keys.lazy()
+        .with_columns(pl.int_ranges(0, (pl.col("key").str.len_chars() - NGRAM_SIZE + 1).clip(lower_bound=1)).alias("offset"))
+        .explode("offset")
+        .select("kid", pl.col("key").str.slice(pl.col("offset"), NGRAM_SIZE).alias("block"))
+        .unique()
+        .with_columns(pl.len().over("block").alias("frequency"))
+    )
+    return (
+        grams
+        .sort(["kid", "frequency", "block"])
+        .group_by("kid", maintain_order=True)
+        .head(BLOCK_KEYS_PER_NAME)
+        .filter(pl.len().over("block").is_between(2, MAX_BLOCK_SIZE))
+        .select("kid", "block")
+        .collect()
+    )
+
+def cluster_publishers(_df: pl.DataFrame, threshold: int = DEFAULT_THRESHOLD) -> pl.DataFrame:
+    from rapidfuzz import fuzz, process
+
+    counts = publisher_counts(_df).with_columns(publisher_key(pl.col("publisher")).alias("key"))
+    counts = counts.filter((pl.col("key") != "") & ~pl.col("key").is_in(UNKNOWN_KEYS))
+
+    # Identical keys are already one cluster; fuzzy matching only runs between distinct keys
+    keys = (
+        counts.group_by("key").agg(pl.col("records").sum())
+        .sort("key")
+        .with_row_index("kid")
+    )
+    blocks = _blocks(keys)
+    pairs = (
+        blocks.join(blocks, on="block", suffix="_right")
+        .filter(pl.col("kid") < pl.col("kid_right"))
+        .select(pl.col("kid").alias("rid_left"), pl.col("kid_right").alias("rid_right"))
+        .unique()
+    )
+    key_text = keys.get_column("key")
+    if pairs.height:
+        # One batched, multi-threaded C++ call over every candidate pair
+        scores = process.cpdist(
+            key_text.gather(pairs.get_column("rid_left")).to_list(),
+            key_text.gather(pairs.get_column("rid_right")).to_list(),
+            scorer=fuzz.token_sort_ratio,
+            workers=-1,
+        )
+        pairs = pairs.with_columns(pl.Series("score", scores)).filter(pl.col("score") >= threshold)
+    members = connected_components(pairs.select("rid_left", "rid_right")) if pairs.height else pl.DataFrame(
+        schema={"rid": pl.UInt32, "cluster": pl.UInt32}
+    )
+
+    key_clusters = (
+        keys.join(members, left_on="kid", right_on="rid", how="left")
+        .select("key", pl.coalesce("cluster", "kid").alias("cluster"))
+    )
+    return (
+        counts.join(key_clusters, on="key")
+        .group_by("cluster")
+        .agg(
+            # The most used spelling is proposed as the canonical form
+            pl.col("publisher").sort_by("records", descending=True).first().alias("canonical"),
+            pl.col("records").sum(),
+            pl.len().alias("variants"),
+            pl.col("publisher").sort_by("records", descending=True).alias("forms"),
+        )
+        .sort(["variants", "records"], descending=True)
+    )
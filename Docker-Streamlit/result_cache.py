@@ -0,0 +1,166 @@
+import functools
+import hashlib
+import inspect
+import os
+import pickle
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import polars as pl
+
+from datasets import CACHE_DIR
+
+# Size limits for each tier, overridable from docker-compose
+MEMORY_LIMIT_BYTES = int(os.environ.get("FHL_RESULT_CACHE_MEMORY_MB", "512")) * 1024 * 1024
+DISK_LIMIT_BYTES = int(os.environ.get("FHL_RESULT_CACHE_DISK_MB", "4096")) * 1024 * 1024
+
+def _size_of(value) -> int:
+    if isinstance(value, pl.DataFrame):
+        return int(value.estimated_size())
+    if hasattr(value, "memory_usage"):  # pandas DataFrame / Series
+        usage = value.memory_usage(deep=True)
+        return int(usage.sum() if hasattr(usage, "sum") else usage)
+    if isinstance(value, (dict, list, tuple)):
+        items = value.values() if isinstance(value, dict) else value
+        return sys.getsizeof(value) + sum(_size_of(item) for item in items)
+    return sys.getsizeof(value)
+
+class ResultCache:
+    # Two tiers: an in-process LRU shared by every Streamlit session and an on-disk LRU shared
+    # by every process that mounts the same cache directory. Both are bounded by total bytes.
+
+    def __init__(self, directory: Path, memory_limit: int, disk_limit: int):
+        self.directory = Path(directory)
+        self.memory_limit = memory_limit
+        self.disk_limit = disk_limit
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(fingerprint: str, analysis: str, params: dict, version: str) -> str:
+        encoded = repr((fingerprint, analysis, sorted(params.items()), version)).encode("utf-8")
+        return f"{analysis}-{hashlib.blake2b(encoded, digest_size=16).hexdigest()}"
+
+    def get(self, key: str, default=None):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key][0]
+
+        path = self._disk_path(key)
+        if path is None:
+            return default
+        try:
+            value = pl.read_ipc(path, memory_map=False) if path.suffix == ".arrow" else pickle.loads(path.read_bytes())
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return default
+        os.utime(path)  # mtime doubles as the disk tier's recency marker
+        self._remember(key, value)
+        return value
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            if key in self._memory:
+                return True
+        return self._disk_path(key) is not None
+
+    def put(self, key: str, value) -> None:
+        self._remember(key, value)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        suffix = ".arrow" if isinstance(value, pl.DataFrame) else ".pkl"
+        fd, tmp_name = tempfile.mkstemp(dir=self.directory, suffix=".part")
+        os.close(fd)
+        try:
+            if isinstance(value, pl.DataFrame):
+                value.write_ipc(tmp_name, compression="zstd")
+            else:
+                Path(tmp_name).write_bytes(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+            os.replace(tmp_name, self.directory / f"{key}{suffix}")
+        finally:
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name)
+        self._evict_disk()
+
+    def clear_memory(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+
+    def _disk_path(self, key: str):
+        for suffix in (".arrow", ".pkl"):
+            path = self.directory / f"{key}{suffix}"
+            if path.exists():
+                return path
+        return None
+
+    def _remember(self, key: str, value) -> None:
+        size = _size_of(value)
+        if size > self.memory_limit:
+            return
+        with self._lock:
+            if key in self._memory:
+                self._memory_bytes -= self._memory.pop(key)[1]
+            self._memory[key] = (value, size)
+            self._memory_bytes += size
+            while self._memory_bytes > self.memory_limit:
+                _, (_, evicted_size) = self._memory.popitem(last=False)
+                self._memory_bytes -= evicted_size
+
+    def _evict_disk(self) -> None:
+        entries = []
+        for path in self.directory.glob("*"):
+            if path.suffix not in (".arrow", ".pkl"):
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:  # removed by another process
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.disk_limit:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+RESULT_CACHE = ResultCache(CACHE_DIR / "results", MEMORY_LIMIT_BYTES, DISK_LIMIT_BYTES)
+
+def _source_of(func) -> bytes:
+    # The whole defining file, so editing a helper next to the analysis invalidates it too
+    path = inspect.getsourcefile(func)
+    if path is not None and os.path.exists(path):
+        return Path(path).read_bytes()
+    return inspect.getsource(func).encode("utf-8")
+
+def cached_analysis(name: str, version: int = 1):
+    # Decorated functions take the dataset fingerprint first; arguments starting with an underscore
+    # (the frames themselves) are left out of the key, so a lookup never hashes the data. The code
+    # version hashes the module that defines the analysis; bump `version` when a change elsewhere
+    # (a helper imported from another module, a Polars upgrade) alters what an analysis returns.
+    def decorator(func):
+        code_version = f"{version}-{hashlib.blake2b(_source_of(func), digest_size=8).hexdigest()}"
+        signature = inspect.signature(func)
+
+        def cache_key(fingerprint: str, *args, **kwargs) -> str:
+            bound = signature.bind(fingerprint, *args, **kwargs)
+            bound.apply_defaults()
+            params = {arg: value for arg, value in bound.arguments.items() if arg != "fingerprint" and not arg.startswith("_")}
+            return ResultCache.make_key(fingerprint, name, params, code_version)
+
+        @functools.wraps(func)
+        def wrapper(fingerprint: str, *args, **kwargs):
+            key = cache_key(fingerprint, *args, **kwargs)
+            result = RESULT_CACHE.get(key)
+            if result is None:
+                result = func(fingerprint, *args, **kwargs)
+                RESULT_CACHE.put(key, result)
+            return result
+
+        # Lets the job runner find the result of a finished job in the cache instead of holding it
+        wrapper.cache_key = cache_key
+        return wrapper
+    return decorator
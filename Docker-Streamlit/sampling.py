@@ -0,0 +1,80 @@
+import os
+
+import polars as pl
+
+from marc_fields import find_column
+
+# Uploads with more records than this open in preview mode: results come from a sample first and
+# the exact figures replace them when the background pass finishes
+PREVIEW_MIN_ROWS = int(os.environ.get("FHL_PREVIEW_MIN_ROWS", "200000"))
+PREVIEW_ROWS = int(os.environ.get("FHL_PREVIEW_ROWS", "50000"))
+# Small record types (maps, kits) still get enough rows for a usable estimate
+MIN_PER_STRATUM = 30
+Z = 1.96  # 95% confidence intervals
+SEED = 20240601
+
+# Columns a sample carries so estimates can be weighted back to the full upload
+STRATUM, STRATUM_SIZE, STRATUM_SAMPLE = "_stratum", "_stratum_size", "_stratum_sample"
+SAMPLE_COLUMNS = [STRATUM, STRATUM_SIZE, STRATUM_SAMPLE]
+
+def stratum(columns: list) -> pl.Expr:
+    # Leader/06 (type of record); one stratum when there is no leader column
+    leader = find_column(columns, "LDR") or find_column(columns, "000")
+    if leader is None:
+        return pl.lit("all").alias(STRATUM)
+    return pl.col(leader).cast(pl.String).str.slice(6, 1).fill_null("").alias(STRATUM)
+
+def stratified_sample(_df: pl.DataFrame, size: int = PREVIEW_ROWS, seed: int = SEED) -> pl.DataFrame:
+    # Proportional allocation over Leader/06 with at least MIN_PER_STRATUM rows per type; rows are
+    # picked by a seeded shuffle within each stratum, so the same upload always gives the same sample
+    total = _df.height
+    allocation = pl.min_horizontal(
+        pl.col(STRATUM_SIZE),
+        pl.max_horizontal(pl.lit(MIN_PER_STRATUM), (pl.col(STRATUM_SIZE) * size / total).round(0).cast(pl.UInt32)),
+    )
+    return (
+        _df.lazy()
+        .with_columns(stratum(_df.columns))
+        .with_columns(pl.len().over(STRATUM).cast(pl.UInt32).alias(STRATUM_SIZE))
+        .with_columns(allocation.cast(pl.UInt32).alias(STRATUM_SAMPLE))
+        .filter(pl.int_range(pl.len()).shuffle(seed).over(STRATUM) < pl.col(STRATUM_SAMPLE))
+        .collect()
+    )
+
+def estimate_shares(sample: pl.DataFrame, by: list, z: float = Z) -> pl.DataFrame:
+    # Stratified estimate of each group's share of the full upload with a normal-approximation interval:
+    #   p = sum_h W_h p_h,  var(p) = sum_h W_h^2 (1 - n_h/N_h) p_h (1 - p_h) / (n_h - 1)
+    # `sample` needs the SAMPLE_COLUMNS added by stratified_sample next to the `by` columns.
+    population = sample.select(STRATUM, STRATUM_SIZE).unique().get_column(STRATUM_SIZE).sum()
+    share = pl.col("c") / pl.col(STRATUM_SAMPLE)
+    weight = pl.col(STRATUM_SIZE) / population
+    finite = 1 - pl.col(STRATUM_SAMPLE) / pl.col(STRATUM_SIZE)
+    variance = (weight ** 2) * finite * share * (1 - share) / (pl.col(STRATUM_SAMPLE) - 1).clip(lower_bound=1)
+    estimates = (
+        sample.lazy()
+        .group_by(by + [STRATUM])
+        .agg(pl.len().alias("c"), pl.col(STRATUM_SIZE).first(), pl.col(STRATUM_SAMPLE).first())
+        .group_by(by)
+        .agg(
+            (weight * share).sum().alias("p"),
+            variance.sum().alias("variance"),
+            pl.col("c").sum().alias("Sampled"),
+        )
+        .with_columns(pl.col("variance").sqrt().alias("se"))
+        .select(
+            *by,
+            (pl.col("p") * population).round(0).cast(pl.UInt64).alias("Count"),
+            (pl.col("p") * 100).round(2).alias("Percentage"),
+            ((pl.col("p") - z * pl.col("se")).clip(lower_bound=0) * 100).round(2).alias("Lower"),
+            ((pl.col("p") + z * pl.col("se")).clip(upper_bound=1) * 100).round(2).alias("Upper"),
+            "Sampled",
+        )
+        .sort("Count", descending=True)
+    )
+    return estimates.collect()
+
+def preview_caption(sample: pl.DataFrame, population: int) -> str:
+    return (
+        f"Preview: estimated from a {sample.height:,d}-record sample of {population:,d}, stratified by Leader/06. "
+        "Lower/Upper are 95% confidence intervals; exact results replace them when ready."
+    )
@@ -0,0 +1,190 @@
+# Record- and field-level diff between two catalog exports, keyed on the 001 control number.
+#
+# Both snapshots are streamed: a first pass keeps only (001, row hash) per record, which is enough to
+# tell added, removed, modified and unchanged records apart. Only the modified records are then staged,
+# hash-partitioned by 001, and compared field by field one partition at a time, so two multi-million
+# record exports can be compared on one machine.
+#
+#     python snapshot_diff.py before.parquet after.parquet --out diff/
+
+import argparse
+import os
+import shutil
+import sys
+from pathlib import Path
+
+import polars as pl
+
+from datasets import dataset_dir
+from marc_fields import find_column
+from result_cache import cached_analysis
+
+ID = "001"
+HASH = "_hash"
+PARTITION = "_partition"
+SEED = 0
+# Changed records are compared this many partitions at a time; more partitions, less memory
+PARTITIONS = int(os.environ.get("FHL_DIFF_PARTITIONS", "16"))
+STATUSES = ["added", "removed", "modified", "unchanged"]
+
+def scan_snapshot(path) -> pl.LazyFrame:
+    # Exports as the pages write them (Parquet, Arrow IPC, CSV) are scanned; Excel has to be read
+    path = Path(path)
+    suffix = path.suffix.lower()
+    if suffix == ".parquet":
+        return pl.scan_parquet(path)
+    if suffix in (".arrow", ".ipc", ".feather"):
+        return pl.scan_ipc(path)
+    if suffix == ".csv":
+        return pl.scan_csv(path, infer_schema=False)
+    if suffix == ".xlsx":
+        return pl.read_excel(path).lazy()
+    raise ValueError(f"Unsupported snapshot format: {path.name}")
+
+def _normalized(lf: pl.LazyFrame, fields: list) -> pl.LazyFrame:
+    # 001 plus every compared field as strings, so a column typed differently in the two exports (or
+    # missing from one of them) is compared by value; records sharing a 001 are compared by their first copy
+    columns = lf.collect_schema().names()
+    id_column = find_column(columns, '001')
+    if id_column is None:
+        raise ValueError("Snapshot has no 001 column")
+    return (
+        lf.select(
+            pl.col(id_column).cast(pl.String).str.strip_chars().alias(ID),
+            *[(pl.col(field).cast(pl.String) if field in columns else pl.lit(None, dtype=pl.String)).alias(field) for field in fields],
+        )
+        .filter(pl.col(ID).is_not_null() & (pl.col(ID) != ""))
+        .unique(subset=ID, keep="first", maintain_order=True)
+    )
+
+def compared_fields(old: pl.LazyFrame, new: pl.LazyFrame) -> list:
+    # Every non-001 column of either snapshot, in a stable order
+    fields = []
+    for lf in (old, new):
+        columns = lf.collect_schema().names()
+        id_column = find_column(columns, '001')
+        fields += [col for col in columns if col != id_column and col not in fields]
+    return fields
+
+def _row_hashes(lf: pl.LazyFrame, fields: list) -> pl.LazyFrame:
+    return lf.select(ID, pl.struct(fields).hash(SEED).alias(HASH) if fields else pl.lit(0, dtype=pl.UInt64).alias(HASH))
+
+def _partition(expr: pl.Expr, partitions: int) -> pl.Expr:
+    return (expr.hash(SEED) % partitions).cast(pl.UInt32).alias(PARTITION)
+
+def classify(old: pl.LazyFrame, new: pl.LazyFrame, fields: list) -> pl.DataFrame:
+    # (001, status) for every control number of either snapshot, from the row hashes alone
+    old_hashes = _row_hashes(old, fields).collect(engine="streaming")
+    new_hashes = _row_hashes(new, fields).collect(engine="streaming")
+    return (
+        old_hashes.lazy()
+        .join(new_hashes.lazy(), on=ID, how="full", coalesce=True, suffix="_new")
+        .select(
+            ID,
+            pl.when(pl.col(HASH).is_null()).then(pl.lit("added"))
+            .when(pl.col(f"{HASH}_new").is_null()).then(pl.lit("removed"))
+            .when(pl.col(HASH) != pl.col(f"{HASH}_new")).then(pl.lit("modified"))
+            .otherwise(pl.lit("unchanged"))
+            .cast(pl.Enum(STATUSES))
+            .alias("status"),
+        )
+        .collect()
+    )
+
+def _stage(lf: pl.LazyFrame, modified: pl.DataFrame, path: Path, partitions: int) -> None:
+    # The modified records of one snapshot, written once as hive partitions keyed on hash(001) with
+    # write_parquet(partition_by=...), as datasets.write_partitions does. Only the modified records are
+    # held in memory here, never the whole snapshot.
+    (
+        lf.join(modified.lazy(), on=ID, how="semi")
+        .with_columns(_partition(pl.col(ID), partitions))
+        .collect(engine="streaming")
+        .write_parquet(path, partition_by=PARTITION, compression="zstd")
+    )
+
+def field_changes(old_part: pl.LazyFrame, new_part: pl.LazyFrame) -> pl.LazyFrame:
+    # Long form: one row per (001, field) whose value differs
+    before = old_part.unpivot(index=ID, variable_name="field", value_name="before")
+    after = new_part.unpivot(index=ID, variable_name="field", value_name="after")
+    return before.join(after, on=[ID, "field"], how="inner").filter(pl.col("before").ne_missing(pl.col("after")))
+
+def diff_snapshots(old: pl.LazyFrame, new: pl.LazyFrame, out_dir: Path, partitions: int = PARTITIONS, report=None) -> dict:
+    # {'summary': records per status, 'records': (001, status) for every changed record,
+    #  'field_counts': changed records per field, 'fields': scan of the field-level diff under out_dir}
+    def progress(fraction, message):
+        if report is not None:
+            report(fraction, message)
+
+    out_dir = Path(out_dir)
+    for stale in ("fields", "before", "after"):
+        shutil.rmtree(out_dir / stale, ignore_errors=True)
+    (out_dir / "fields").mkdir(parents=True)
+
+    fields = compared_fields(old, new)
+    old, new = _normalized(old, fields), _normalized(new, fields)
+
+    progress(0.0, "Hashing records of both snapshots")
+    statuses = classify(old, new, fields)
+    summary = statuses.group_by("status").agg(pl.len().alias("records")).sort("status")
+    records = statuses.filter(pl.col("status") != "unchanged").sort("status", ID)
+    modified = records.filter(pl.col("status") == "modified").select(ID)
+
+    if modified.height:
+        progress(0.3, f"Staging {modified.height:,d} modified records")
+        _stage(old, modified, out_dir / "before", partitions)
+        _stage(new, modified, out_dir / "after", partitions)
+        staged_before = pl.scan_parquet(out_dir / "before", hive_partitioning=True)
+        staged_after = pl.scan_parquet(out_dir / "after", hive_partitioning=True)
+        # Each partition holds about 1/partitions of the modified records of each snapshot
+        for partition in range(partitions):
+            progress(0.4 + 0.6 * partition / partitions, f"Comparing fields, partition {partition + 1} of {partitions}")
+            changes = field_changes(
+                staged_before.filter(pl.col(PARTITION) == partition).drop(PARTITION),
+                staged_after.filter(pl.col(PARTITION) == partition).drop(PARTITION),
+            ).collect()
+            if changes.height:
+                changes.write_parquet(out_dir / "fields" / f"part-{partition:04d}.parquet")
+        shutil.rmtree(out_dir / "before", ignore_errors=True)
+        shutil.rmtree(out_dir / "after", ignore_errors=True)
+
+    schema = {ID: pl.String, "field": pl.String, "before": pl.String, "after": pl.String}
+    if any((out_dir / "fields").glob("*.parquet")):
+        changes = pl.scan_parquet(out_dir / "fields" / "*.parquet")
+    else:
+        changes = pl.LazyFrame(schema=schema)
+    field_counts = (
+        changes.group_by("field").agg(pl.len().alias("records"))
+        .sort("records", descending=True)
+        .collect()
+    )
+    progress(1.0, "Finished")
+    return {'summary': summary, 'records': records, 'field_counts': field_counts, 'fields': changes}
+
+@cached_analysis("snapshot_diff")
+def compare_snapshots(fingerprint: str, _old: pl.LazyFrame, _new: pl.LazyFrame, _job=None) -> dict:
+    # `fingerprint` names the pair ("<before>-<after>"); the field-level diff is kept under its dataset directory
+    return diff_snapshots(
+        _old.lazy(), _new.lazy(), dataset_dir(fingerprint) / "diff",
+        report=_job.report if _job is not None else None,
+    )
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Record- and field-level diff between two catalog exports, keyed on the 001 control number")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--out", default="snapshot_diff", help="Directory for the field-level diff")
+    parser.add_argument("--partitions", type=int, default=PARTITIONS)
+    args = parser.parse_args()
+
+    result = diff_snapshots(
+        scan_snapshot(args.before), scan_snapshot(args.after), Path(args.out), args.partitions,
+        report=lambda fraction, message: print(f"{fraction:4.0%} {message}", file=sys.stderr),
+    )
+    print(result['summary'])
+    print(result['field_counts'])
+    result['records'].write_parquet(Path(args.out) / "records.parquet")
+    print(f"Changed records: {Path(args.out) / 'records.parquet'}; field-level diff: {Path(args.out) / 'fields'}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
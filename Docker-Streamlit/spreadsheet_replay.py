@@ -0,0 +1,172 @@
+import ast
+import hashlib
+
+import pandas as pd
+import polars as pl
+
+from datasets import DatasetHandle
+from result_cache import cached_analysis
+
+# Mito edits a bounded window of a large upload; the code it generates for those edits is replayed
+# here over every row as a background job. Lives outside the page so worker processes can import it.
+
+# Name the spreadsheet gives the edited frame in its generated code (spreadsheet(..., df_names=[DF_NAME]))
+DF_NAME = "df"
+REPLAY_BATCH_ROWS = 100_000
+ROW_ID = "_row"
+# pandas methods whose result for a row depends on other rows, and label-based accessors (Mito's cell
+# edits are df.at[<row>, <column>], its row deletions df.drop(labels=[<row>])) whose labels may fall in
+# another batch; code using any of them is replayed over every row in one batch
+WHOLE_FRAME_METHODS = {
+    "at", "iat", "loc", "drop",
+    "sort_values", "sort_index", "drop_duplicates", "duplicated", "reset_index", "set_index", "reindex",
+    "groupby", "pivot", "pivot_table", "melt", "stack", "unstack", "explode", "merge", "join", "concat",
+    "rank", "shift", "diff", "cumsum", "cumcount", "cummax", "cummin", "ffill", "bfill", "interpolate",
+    "rolling", "expanding", "transform", "value_counts", "nunique", "unique", "sample", "head", "tail",
+    "iloc", "nlargest", "nsmallest", "sum", "mean", "median", "min", "max", "std", "var", "count",
+}
+# Cell edits and row deletions by label only read the columns they name, so code limited to these is
+# replayed over just those columns and the others are joined back on the row number
+LABEL_EDITS = {"at", "loc", "drop"}
+
+def spreadsheet_rows(_df: pl.DataFrame, rows: int, first_row: int = 0, seed: int = None) -> pd.DataFrame:
+    # The rows shown in the spreadsheet - a window from first_row, or a sample when a seed is given -
+    # indexed by their position in the full dataset, so the row labels in the recorded steps name the
+    # same rows when the steps are replayed
+    indexed = _df.with_row_index(ROW_ID)
+    if seed is not None:
+        view = indexed.sample(min(rows, indexed.height), seed=seed).sort(ROW_ID)
+    else:
+        view = indexed.slice(first_row, rows)
+    frame = view.drop(ROW_ID).to_pandas()
+    frame.index = pd.Index(view.get_column(ROW_ID).to_numpy(), dtype="int64")
+    return frame
+
+def code_key(code: str) -> str:
+    return hashlib.blake2b(code.encode("utf-8"), digest_size=8).hexdigest()
+
+def row_local(code: str) -> bool:
+    # True when every step only looks at the row it changes, so batches can be replayed independently
+    attributes = {node.attr for node in ast.walk(ast.parse(code)) if isinstance(node, ast.Attribute)}
+    return not attributes & WHOLE_FRAME_METHODS
+
+def used_columns(code: str, columns: list):
+    # The columns named in code that only edits cells and deletes rows by label, or None when the code
+    # may touch other columns (by position, through df.columns or with a whole-frame method)
+    tree = ast.parse(code)
+    attributes = {node.attr for node in ast.walk(tree) if isinstance(node, ast.Attribute)}
+    if attributes & (WHOLE_FRAME_METHODS - LABEL_EDITS) or "columns" in attributes:
+        return None
+    names = {node.value for node in ast.walk(tree) if isinstance(node, ast.Constant) and isinstance(node.value, str)}
+    return [col for col in columns if col in names]
+
+def _apply(compiled, batch: pd.DataFrame) -> pd.DataFrame:
+    namespace = {DF_NAME: batch}
+    exec(compiled, namespace)
+    return namespace[DF_NAME]
+
+def _aligned(edited: pd.DataFrame, start: int, stop: int) -> bool:
+    # The pandas index still holds the source row numbers unless a step rebuilt it
+    index = edited.index
+    return (
+        pd.api.types.is_integer_dtype(index) and index.is_unique
+        and (index.empty or (index.min() >= start and index.max() < stop))
+    )
+
+def _rejoin(_df: pl.DataFrame, used: list, edited: pd.DataFrame) -> pl.DataFrame:
+    # The other columns of the rows the steps kept, with the edited columns back in place and new ones last
+    edited = pl.from_pandas(edited.reset_index(names=ROW_ID)).with_columns(pl.col(ROW_ID).cast(pl.Int64))
+    rest = (
+        _df.select([col for col in _df.columns if col not in used])
+        .with_row_index(ROW_ID)
+        .with_columns(pl.col(ROW_ID).cast(pl.Int64))
+    )
+    joined = rest.join(edited, on=ROW_ID, how="inner", maintain_order="right")
+    return joined.select(
+        [ROW_ID]
+        + [col for col in _df.columns if col in joined.columns]
+        + [col for col in edited.columns if col not in _df.columns and col != ROW_ID]
+    )
+
+def diff_summary(before: pl.DataFrame, after: pl.DataFrame, aligned: bool) -> dict:
+    # Columns added and removed, rows dropped, and how many cells changed in each column kept
+    columns = [col for col in after.columns if col != ROW_ID]
+    common = [col for col in before.columns if col in columns]
+    summary = {
+        "rows_before": before.height,
+        "rows_after": after.height,
+        "columns_added": [col for col in columns if col not in before.columns],
+        "columns_removed": [col for col in before.columns if col not in columns],
+    }
+    if not aligned or not common:
+        # Rows cannot be matched up (the steps rebuilt the index), so only the shape is compared
+        summary.update(rows_removed=None, rows_changed=None)
+        return {"summary": summary, "changes": pl.DataFrame(schema={"Column": pl.String, "Changed cells": pl.UInt32})}
+
+    changed = {
+        col: pl.col(col).cast(pl.String).ne_missing(pl.col(f"{col}_after").cast(pl.String))
+        for col in common
+    }
+    counts = (
+        before.lazy()
+        .select(common)
+        .with_row_index(ROW_ID)
+        .with_columns(pl.col(ROW_ID).cast(pl.Int64))
+        .join(after.lazy().select(pl.col(ROW_ID).cast(pl.Int64), *common), on=ROW_ID, how="inner", suffix="_after")
+        .select(
+            pl.len().alias("_kept"),
+            pl.any_horizontal(list(changed.values())).sum().alias("_rows_changed"),
+            *[expr.sum().alias(col) for col, expr in changed.items()],
+        )
+        .collect()
+        .row(0, named=True)
+    )
+    summary.update(rows_removed=before.height - counts.pop("_kept"), rows_changed=counts.pop("_rows_changed"))
+    changes = (
+        pl.DataFrame({"Column": list(counts), "Changed cells": list(counts.values())}, schema={"Column": pl.String, "Changed cells": pl.UInt32})
+        .filter(pl.col("Changed cells") > 0)
+        .sort("Changed cells", descending=True)
+    )
+    return {"summary": summary, "changes": changes}
+
+@cached_analysis("spreadsheet_replay")
+def replay_edits(fingerprint: str, _df: pl.DataFrame, code: str, _job=None) -> dict:
+    # Runs the spreadsheet's generated pandas code over the full dataset, REPLAY_BATCH_ROWS rows at a
+    # time when the steps are row-local. The edited dataset is stored next to the upload and returned
+    # as a handle with a diff summary against the original.
+    def report(fraction, message):
+        if _job is not None:
+            _job.report(fraction, message)
+
+    compiled = compile(code, "<spreadsheet steps>", "exec")
+    height = _df.height
+    local = row_local(code)
+    used = None if local else used_columns(code, _df.columns)
+    after = None
+    if used is not None:
+        report(0.0, f"Replaying the steps over {len(used):,d} of {len(_df.columns):,d} columns")
+        narrow = _df.select(used).with_row_index(ROW_ID).to_pandas().set_index(ROW_ID)
+        narrow.index = pd.Index(narrow.index, dtype="int64", name=None)
+        edited = _apply(compiled, narrow)
+        aligned = _aligned(edited, 0, height)
+        if aligned:
+            after = _rejoin(_df, used, edited)
+
+    if after is None:
+        # Row-local code runs batch by batch; any other code gets every column of every row at once
+        batch_rows = REPLAY_BATCH_ROWS if local else max(height, 1)
+        parts, aligned = [], True
+        for start in range(0, max(height, 1), batch_rows):
+            stop = min(start + batch_rows, height)
+            report(0.9 * start / max(height, 1), f"Replaying rows {start + 1:,d} to {stop:,d} of {height:,d}")
+            batch = _df.slice(start, batch_rows).to_pandas()
+            batch.index = pd.RangeIndex(start, start + len(batch))
+            edited = _apply(compiled, batch)
+            aligned = aligned and _aligned(edited, start, stop)
+            parts.append(pl.from_pandas(edited.reset_index(names=ROW_ID)))
+        after = pl.concat(parts, how="diagonal_relaxed")
+
+    report(0.9, "Comparing with the original")
+    diff = diff_summary(_df, after, aligned)
+    handle = DatasetHandle(fingerprint, f"spreadsheet-{code_key(code)}").write(after.drop(ROW_ID))
+    return {"handle": handle, **diff}
@@ -0,0 +1,14 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# The app's modules are imported flat, as the pages do
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    import datasets
+
+    monkeypatch.setattr(datasets, "CACHE_DIR", tmp_path)
+    return tmp_path
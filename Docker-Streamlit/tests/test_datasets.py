@@ -0,0 +1,65 @@
+import polars as pl
+
+from datasets import column_catalog, partition_values, persist_dataset, scan_partitioned, scoped
+
+def prepare_fixture(raw: pl.DataFrame) -> pl.DataFrame:
+    return raw.rename({col: col.strip() for col in raw.columns})
+
+def fixture_records() -> pl.DataFrame:
+    return pl.DataFrame({
+        "LDR.1": ["00000nam a2200000   4500", "00000ncm a2200000   4500", "00000nam a2200000   4500"],
+        "001.1.": ["1", "2", "3"],
+        " 245.1.a ": ["A title", "Another title", None],
+        "500.1.a": [None, None, None],
+    }, schema={"LDR.1": pl.String, "001.1.": pl.String, " 245.1.a ": pl.String, "500.1.a": pl.String})
+
+def test_persist_dataset_end_to_end(cache_dir):
+    reads = []
+
+    def read():
+        reads.append(1)
+        return fixture_records()
+
+    df = persist_dataset("fixture", prepare_fixture, read)
+    assert df.height == 3
+    assert df.get_column("001.1.").to_list() == ["1", "2", "3"]
+    # The all-null column is pruned through the statistics catalog
+    assert "500.1.a" not in df.columns
+    assert "245.1.a" in df.columns
+
+    catalog = column_catalog(df)
+    assert catalog.get_column("column").to_list() == df.columns
+    assert catalog.filter(pl.col("column") == "245.1.a").get_column("null_count").item() == 1
+
+    # A second call opens the persisted files instead of reading again
+    again = persist_dataset("fixture", prepare_fixture, read)
+    assert again.equals(df)
+    assert len(reads) == 1
+    assert any(path.suffix == ".parquet" for path in (cache_dir / "datasets" / "fixture").iterdir())
+
+def test_persist_dataset_parses_005(cache_dir):
+    def read():
+        return fixture_records().with_columns(
+            pl.Series("005.1.", ["20240315101010.0", "not a date", None]),
+            pl.lit(None).alias("empty"),
+        )
+
+    df = persist_dataset("fixture-005", prepare_fixture, read)
+    assert df.get_column("001.1.").to_list() == ["1", "2", "3"]
+    assert "empty" not in df.columns
+    # The parsed 005 and the partition keys live only in the partitioned copies
+    assert not {"modified_at", "modified_invalid", "modified_month", "record_type", "language"} & set(df.columns)
+    changes = scan_partitioned(df, ["modified_month"]).sort("001.1.").collect()
+    assert changes.schema["modified_at"] == pl.Datetime("ms")
+    assert changes.get_column("modified_at").dt.strftime("%Y-%m-%d %H:%M:%S").to_list() == ["2024-03-15 10:10:10", None, None]
+    assert changes.get_column("modified_invalid").to_list() == [False, True, False]
+    assert changes.get_column("modified_month").to_list() == ["2024-03", "unknown", "unknown"]
+
+def test_scoped_reads_the_matching_partitions(cache_dir):
+    df = persist_dataset("fixture-scope", prepare_fixture, fixture_records)
+    assert partition_values(df, "record_type") == ["a", "c"]
+    scoped_fingerprint, subset, lf = scoped("fixture-scope", df, record_type=["c"])
+    assert scoped_fingerprint != "fixture-scope"
+    assert subset.columns == df.columns
+    assert subset.get_column("001.1.").to_list() == ["2"]
+    assert lf.collect().equals(subset)
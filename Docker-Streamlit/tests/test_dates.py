@@ -0,0 +1,16 @@
+import polars as pl
+
+from dates import cross_validate, cross_validation_summary
+
+def test_repeated_001s_are_matched_by_position():
+    df = pl.DataFrame({
+        "001.1.": ["1", "1", None, None],
+        "008.1.": ["000000s1900    ", "000000s1950    ", "000000s1900    ", "000000s1950    "],
+        "260.1.c": ["1900", "1900", "1950", "1950"],
+    })
+    checked = cross_validate(df.lazy()).collect()
+    assert checked.height == 4
+    assert checked.sort("row").get_column("status").to_list() == ["consistent", "inconsistent", "inconsistent", "consistent"]
+
+    summary = cross_validation_summary(df.lazy())
+    assert summary.get_column("Count").sum() == 4
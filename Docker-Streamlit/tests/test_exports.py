@@ -0,0 +1,17 @@
+import polars as pl
+
+import exports
+from exports import export_path, write_xlsx
+
+def test_list_columns_are_joined_in_excel(tmp_path):
+    clusters = pl.DataFrame({"cluster": [1, 2], "001": [["10", "11"], ["12"]]})
+    path = tmp_path / "clusters.xlsx"
+    write_xlsx({"Clusters": clusters}, path)
+    written = pl.read_excel(path, sheet_name="Clusters")
+    assert written.get_column("001").to_list() == ["10; 11", "12"]
+
+def test_export_files_are_keyed_by_the_module_version(cache_dir, monkeypatch):
+    monkeypatch.setattr(exports, "CACHE_DIR", cache_dir)
+    before = export_path("fixture", "clusters", "xlsx", threshold=0.8)
+    monkeypatch.setattr(exports, "EXPORT_VERSION", "changed")
+    assert export_path("fixture", "clusters", "xlsx", threshold=0.8) != before
@@ -0,0 +1,23 @@
+import polars as pl
+
+from language_check import language_check
+
+def fixed_field(language: str) -> str:
+    return "0" * 35 + language + "0d"
+
+def test_040_without_a_single_008_language():
+    df = pl.DataFrame({
+        "001-Control Number": ["1", "2", "3", "4", "5"],
+        "008-Fixed-Length Data Elements-General Information": [
+            fixed_field("eng"), fixed_field("eng"), fixed_field("mul"), fixed_field("und"), None,
+        ],
+        "040$b": ["eng", "fre", "eng", "eng", "eng"],
+    })
+    records = language_check(df)["records"].sort("001")
+    assert records.get_column("040 vs 008").to_list() == [
+        "catalogued in text language",
+        "catalogued in other language",
+        "no 008 language",
+        "no 008 language",
+        "no 008 language",
+    ]
@@ -0,0 +1,27 @@
+from pathlib import Path
+
+from marc_records import check_round_trip, decode_iso2709, iter_iso2709, long_to_records, records_to_long, to_long, to_wide, write_marc
+
+FIXTURE = Path(__file__).parent / "fixtures" / "records.mrc"
+
+def test_round_trip_through_wide_is_byte_identical(tmp_path):
+    original = FIXTURE.read_bytes()
+    wide = to_wide(records_to_long([decode_iso2709(raw) for raw in iter_iso2709(FIXTURE)]))
+    out = write_marc(wide, tmp_path / "records.mrc")
+    assert Path(out).read_bytes() == original
+
+def test_wide_values_keep_their_punctuation():
+    wide = to_wide(records_to_long([decode_iso2709(raw) for raw in iter_iso2709(FIXTURE)]))
+    assert wide.get_column("245.1.c").to_list() == ["by A ; illustrated by B.", "Schubert."]
+    assert wide.get_column("300.1.a").to_list() == ["123 p. ;", None]
+    assert wide.get_column("245.1.a").to_list() == ["Titre = ", "Lieder ;"]
+    assert wide.get_column("500.1.a").to_list() == ["x;y", None]
+
+    leader, fields = next(long_to_records(to_long(wide)))
+    subfields = {(tag, code): value for tag, indicators, data in fields if indicators is not None for code, value in data}
+    assert subfields[("500", "a")] == "  Leading and trailing spaces  "
+    assert [value for tag, _, data in fields if tag == "650" for code, value in data if code == "x"] == ["History", "Sources."]
+
+def test_check_round_trip_via_wide():
+    assert check_round_trip(FIXTURE, via_wide=True) == {"records": 2, "mismatched": []}
+    assert check_round_trip(FIXTURE) == {"records": 2, "mismatched": []}
@@ -0,0 +1,32 @@
+import polars as pl
+
+import result_cache
+from result_cache import ResultCache, cached_analysis
+
+def test_cache_key_names_where_the_result_is_stored(tmp_path, monkeypatch):
+    monkeypatch.setattr(result_cache, "RESULT_CACHE", ResultCache(tmp_path, 1024 * 1024, 1024 * 1024))
+
+    @cached_analysis("fixture_counts")
+    def counts(fingerprint: str, _df: pl.DataFrame, column: str, _job=None) -> pl.DataFrame:
+        return _df.group_by(column).len().sort(column)
+
+    df = pl.DataFrame({"tag": ["245", "245", "500"]})
+    key = counts.cache_key("fixture", df, "tag")
+    assert key not in result_cache.RESULT_CACHE
+
+    result = counts("fixture", df, "tag")
+    assert key in result_cache.RESULT_CACHE
+    result_cache.RESULT_CACHE.clear_memory()
+    # Still on disk once the memory tier lets it go
+    assert result_cache.RESULT_CACHE.get(key).equals(result)
+
+def test_bumping_the_version_changes_the_key():
+    def counts(fingerprint: str, _df: pl.DataFrame, column: str) -> pl.DataFrame:
+        return _df.group_by(column).len()
+
+    df = pl.DataFrame({"tag": ["245"]})
+    first = cached_analysis("fixture_counts")(counts).cache_key("fixture", df, "tag")
+    again = cached_analysis("fixture_counts")(counts).cache_key("fixture", df, "tag")
+    bumped = cached_analysis("fixture_counts", version=2)(counts).cache_key("fixture", df, "tag")
+    assert first == again
+    assert first != bumped
@@ -0,0 +1,14 @@
+import polars as pl
+
+from snapshot_diff import diff_snapshots
+
+def test_field_changes_of_modified_records(tmp_path):
+    old = pl.LazyFrame({"001": ["1", "2", "3", "4"], "245$a": ["a", "b", "c", "d"], "260$c": ["1", "2", "3", "4"]})
+    new = pl.LazyFrame({"001": ["1", "2", "3", "5"], "245$a": ["a", "B", "c", "e"], "260$c": ["1", "2", "x", "4"]})
+
+    result = diff_snapshots(old, new, tmp_path, partitions=4)
+    summary = dict(zip(result["summary"].get_column("status").cast(pl.String), result["summary"].get_column("records")))
+    assert summary == {"added": 1, "removed": 1, "modified": 2, "unchanged": 1}
+    assert result["fields"].sort("001").collect().rows() == [("2", "245$a", "b", "B"), ("3", "260$c", "3", "x")]
+    # The staged partitions are cleaned up once compared
+    assert not (tmp_path / "before").exists()
@@ -0,0 +1,54 @@
+import polars as pl
+
+import spreadsheet_replay
+from spreadsheet_replay import DF_NAME, replay_edits, spreadsheet_rows
+
+def fixture_frame(height: int) -> pl.DataFrame:
+    return pl.DataFrame({
+        "001": [str(n) for n in range(height)],
+        "245$a": [f"Title {n}" for n in range(height)],
+    })
+
+def test_window_rows_keep_their_position_in_the_file():
+    window = spreadsheet_rows(fixture_frame(50), 10, first_row=20)
+    assert list(window.index) == list(range(20, 30))
+    sample = spreadsheet_rows(fixture_frame(50), 10, seed=1)
+    assert all(sample.loc[label, "001"] == str(label) for label in sample.index)
+
+def test_replay_of_an_edit_made_on_an_offset_window(cache_dir, monkeypatch):
+    monkeypatch.setattr(spreadsheet_replay, "REPLAY_BATCH_ROWS", 10)
+    df = fixture_frame(40)
+    window = spreadsheet_rows(df, 10, first_row=20)
+
+    # As Mito records a cell edit and a row deletion made in that window
+    code = f"{DF_NAME}.at[23, '245$a'] = 'Edited'\n{DF_NAME}.drop(labels=[25], inplace=True)\n"
+    namespace = {DF_NAME: window.copy()}
+    exec(code, namespace)
+    assert namespace[DF_NAME].loc[23, "001"] == "23"
+
+    result = replay_edits.__wrapped__("replay-fixture", df, code)
+    edited = result["handle"].open()
+    assert edited.height == 39
+    assert edited.filter(pl.col("245$a") == "Edited").get_column("001").to_list() == ["23"]
+    assert "25" not in edited.get_column("001").to_list()
+    assert result["summary"]["rows_removed"] == 1
+    assert result["summary"]["rows_changed"] == 1
+
+def test_label_edits_replay_over_the_columns_they_name(cache_dir):
+    df = fixture_frame(20).with_columns(pl.col("001").alias("500$a"))
+    code = (
+        f"{DF_NAME}.at[3, '245$a'] = 'Edited'\n"
+        f"{DF_NAME}.loc[4, '650$a'] = 'Added'\n"
+        f"{DF_NAME}.drop(labels=[5], inplace=True)\n"
+    )
+    assert spreadsheet_replay.used_columns(code, df.columns) == ["245$a"]
+    assert spreadsheet_replay.used_columns(f"{DF_NAME}.iat[3, 1] = 'x'\n", df.columns) is None
+
+    # Same result as running the code over the whole frame in pandas
+    expected = df.to_pandas()
+    exec(code, {DF_NAME: expected})
+    result = replay_edits.__wrapped__("replay-narrow", df, code)
+    edited = result["handle"].open()
+    assert edited.columns == ["001", "245$a", "500$a", "650$a"]
+    assert edited.to_pandas().reset_index(drop=True).equals(expected.reset_index(drop=True))
+    assert result["summary"]["columns_added"] == ["650$a"]
@@ -0,0 +1,29 @@
+from datetime import date
+
+import polars as pl
+
+from dates import changed_since, with_transaction_time
+from validation import validate
+
+ORPHAN_RULE = {
+    "id": "773-parent", "field": "773$w", "condition": "exists_in", "target": "001",
+    "severity": "warning", "message": "Parent record not in this dataset",
+}
+
+def records() -> pl.LazyFrame:
+    # Record 1 is an unchanged parent; record 2, its child, and record 3, an orphan, changed recently
+    return with_transaction_time(pl.LazyFrame({
+        "001.1.": ["1", "2", "3"],
+        "005.1.": ["20200101000000.0", "20240601000000.0", "20240602000000.0"],
+        "773.1.w": [None, "1", "99"],
+    }))
+
+def test_exists_in_looks_targets_up_in_every_record():
+    lf = records()
+    report = validate(lf, [ORPHAN_RULE], rows=changed_since(lf, date(2024, 1, 1)))
+    assert report["violations"].get_column("001").to_list() == ["3"]
+    assert report["summary"].get_column("violations").to_list() == [1]
+
+def test_full_run_matches_limited_run():
+    report = validate(records(), [ORPHAN_RULE])
+    assert report["violations"].get_column("001").to_list() == ["3"]
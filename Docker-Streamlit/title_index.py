@@ -0,0 +1,90 @@
+import re
+import unicodedata
+
+import polars as pl
+
+from datasets import dataset_dir
+from marc_fields import find_column, occurrence_groups
+
+# Title, remainder of title, statement of responsibility, the linked 880 alternate script title and
+# 246 varying/parallel titles
+INDEXED_FIELDS = [('245', 'a'), ('245', 'b'), ('245', 'c'), ('880', 'a'), ('246', 'a')]
+INDEX_FILE = "title_index-246.parquet"  # renamed when INDEXED_FIELDS changes, so old indexes are rebuilt
+# Sorts after every other code point, so [token, token + MAX_CHAR) covers every token with that prefix
+MAX_CHAR = "\U0010ffff"
+
+# Loaded indexes stay in memory for the life of the server process; searches never touch the data
+_indexes = {}
+
+def normalize_text(expr: pl.Expr) -> pl.Expr:
+    # NFKD, drop combining marks (diacritic folding), lowercase, everything but letters/digits -> space
+    return (
+        expr.str.normalize("NFKD")
+        .str.replace_all(r"\p{M}+", "")
+        .str.to_lowercase()
+        .str.replace_all(r"[^\p{L}\p{N}]+", " ")
+        .str.strip_chars()
+    )
+
+def normalize_query(text: str) -> list:
+    # Same folding as normalize_text, done in Python for a single query string
+    decomposed = unicodedata.normalize("NFKD", text)
+    folded = "".join(ch for ch in decomposed if not unicodedata.category(ch).startswith("M")).lower()
+    return [token for token in re.split(r"[\W_]+", folded) if token]
+
+def build_index(_df: pl.DataFrame | pl.LazyFrame, id_column: str) -> pl.DataFrame:
+    # One row per distinct token with the sorted control numbers of every record containing it
+    lf = _df.lazy()
+    groups = occurrence_groups(lf.collect_schema().names())
+    sources = [col for key in INDEXED_FIELDS for col in groups.get(key, [])]
+    if not sources:
+        return pl.DataFrame(schema={"token": pl.String, "001": pl.List(pl.String)})
+
+    text = pl.concat_str([pl.col(col).cast(pl.String) for col in sources], separator=" ", ignore_nulls=True)
+    return (
+        lf
+        .select(
+            pl.col(id_column).cast(pl.String).alias("001"),
+            normalize_text(text).str.split(" ").alias("token")
+        )
+        .explode("token")
+        .filter(pl.col("token").is_not_null() & (pl.col("token") != "") & pl.col("001").is_not_null())
+        .unique()
+        .group_by("token")
+        .agg(pl.col("001").sort())
+        .sort("token")
+        .collect()
+    )
+
+def load_index(fingerprint: str, _df: pl.DataFrame | pl.LazyFrame) -> pl.DataFrame:
+    # Built once per dataset and persisted next to its other cached files
+    if fingerprint in _indexes:
+        return _indexes[fingerprint]
+    path = dataset_dir(fingerprint) / INDEX_FILE
+    if path.exists():
+        index = pl.read_parquet(path)
+    else:
+        id_column = find_column(_df.lazy().collect_schema().names(), '001')
+        index = build_index(_df, id_column)
+        index.write_parquet(path)
+    _indexes[fingerprint] = index
+    return index
+
+def _postings(index: pl.DataFrame, token: str, prefix: bool) -> set:
+    # Binary search on the sorted token column instead of scanning it
+    tokens = index.get_column("token")
+    start = tokens.search_sorted(token, side="left")
+    end = tokens.search_sorted(token + MAX_CHAR if prefix else token, side="left" if prefix else "right")
+    if start >= end:
+        return set()
+    return set(index.get_column("001").slice(start, end - start).explode().to_list())
+
+def search(index: pl.DataFrame, query: str, limit: int = 1000) -> list:
+    # Records containing every query token; the last token also matches as a prefix (search-as-you-type)
+    tokens = normalize_query(query)
+    if not tokens:
+        return []
+    postings = [_postings(index, token, prefix=(i == len(tokens) - 1)) for i, token in enumerate(tokens)]
+    postings.sort(key=len)
+    matches = postings[0].intersection(*postings[1:])
+    return sorted(matches)[:limit]
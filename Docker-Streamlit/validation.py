@@ -0,0 +1,163 @@
+import hashlib
+import tomllib
+from pathlib import Path
+
+import polars as pl
+
+from marc_fields import fold_expr, find_column, occurrence_groups
+
+RULES_PATH = Path(__file__).parent / "rules.toml"
+SEVERITIES = ["error", "warning", "info"]
+# Violations are packed into UInt64 words, 64 rules per word
+WORD_BITS = 64
+
+def load_rules(path: Path = RULES_PATH) -> list:
+    text = Path(path).read_text(encoding="utf-8")
+    if Path(path).suffix in (".yaml", ".yml"):
+        import yaml
+        rules = yaml.safe_load(text).get("rule", [])
+    else:
+        rules = tomllib.loads(text).get("rule", [])
+    for rule in rules:
+        if rule.get("severity", "warning") not in SEVERITIES:
+            raise ValueError(f"Rule {rule.get('id')}: severity must be one of {SEVERITIES}")
+    return rules
+
+def rules_version(path: Path = RULES_PATH) -> str:
+    # Part of the cache key, so editing the rules file invalidates earlier results
+    return hashlib.blake2b(Path(path).read_bytes(), digest_size=8).hexdigest()
+
+def field_expr(columns: list, spec: str):
+    # '245$a', '001', 'LDR/06', '008/35-37' -> string expression, or None when the column is missing
+    name, _, positions = spec.partition("/")
+    tag, _, code = name.partition("$")
+    column = find_column(columns, tag, code)
+    if column is None and tag == "LDR":
+        column = find_column(columns, "000")
+    if column is None:
+        return None
+    expr = pl.col(column).cast(pl.String)
+    if positions:
+        start, _, end = positions.partition("-")
+        expr = expr.str.slice(int(start), int(end or start) - int(start) + 1)
+    return expr
+
+def present(expr: pl.Expr) -> pl.Expr:
+    return expr.is_not_null() & (expr.str.strip_chars() != "")
+
+def compile_rule(rule: dict, columns: list, targets: dict = None):
+    # Boolean "violated" expression for one rule, or None when its fields are not in this dataset.
+    # `targets` holds the exists_in target values when only some records are checked (see validate)
+    condition = rule["condition"]
+
+    if condition == "aligned":
+        # Every occurrence in either layout; a missing subfield counts as one value, as in counts_aligned
+        groups = occurrence_groups(columns)
+        sources = [groups.get(tuple(spec.split("$"))) for spec in rule["fields"]]
+        if not all(sources):
+            return None
+        lengths = [fold_expr(cols, spec).list.len().clip(lower_bound=1) for cols, spec in zip(sources, rule["fields"])]
+        violated = pl.max_horizontal(lengths) != pl.min_horizontal(lengths)
+    else:
+        value = field_expr(columns, rule["field"])
+        if value is None:
+            return None if condition != "required" else pl.lit(True)
+        if condition == "required":
+            violated = ~present(value)
+        elif condition == "absent":
+            violated = present(value)
+        elif condition == "matches":
+            violated = present(value) & ~value.str.contains(rule["pattern"])
+        elif condition == "not_matches":
+            violated = present(value) & value.str.contains(rule["pattern"])
+        elif condition == "in":
+            violated = present(value) & ~value.is_in(rule["values"])
+        elif condition == "not_in":
+            violated = present(value) & value.is_in(rule["values"])
+        elif condition == "length":
+            violated = present(value) & (value.str.len_chars() != rule["length"])
+        elif condition == "exists_in":
+            # e.g. 773$w must name a 001 in the same dataset
+            if targets is not None:
+                if rule["target"] not in targets:
+                    return None
+                target_set = pl.lit(targets[rule["target"]]).implode()
+            else:
+                target = field_expr(columns, rule["target"])
+                if target is None:
+                    return None
+                target_set = target.str.strip_chars().implode()
+            violated = present(value) & ~value.str.strip_chars().is_in(target_set)
+        else:
+            raise ValueError(f"Rule {rule['id']}: unknown condition '{condition}'")
+
+    if "when" in rule:
+        guard = field_expr(columns, rule["when"]["field"])
+        if guard is None:
+            return None
+        violated = violated & guard.is_in(rule["when"]["in"])
+    return violated.fill_null(False)
+
+def target_values(lf: pl.LazyFrame, rules: list) -> dict:
+    # {target spec: Series of its stripped values} over every record, one column read per target
+    columns = lf.collect_schema().names()
+    specs = sorted({rule["target"] for rule in rules if rule["condition"] == "exists_in"})
+    exprs = {spec: field_expr(columns, spec) for spec in specs}
+    present_specs = [spec for spec, expr in exprs.items() if expr is not None]
+    frames = pl.collect_all([
+        lf.select(exprs[spec].str.strip_chars().drop_nulls().unique().alias("value")) for spec in present_specs
+    ])
+    return {spec: frame.get_column("value") for spec, frame in zip(present_specs, frames)}
+
+def validate(lf: pl.LazyFrame, rules: list, rows: pl.LazyFrame = None) -> dict:
+    # All rules are evaluated side by side in one select, so 200 rules still mean one scan of the data.
+    # `rows` limits the check to some of lf's records (e.g. the ones changed since the last run);
+    # cross-record rules (exists_in) still look their targets up among all of lf's records.
+    targets = None
+    if rows is not None:
+        targets = target_values(lf, rules)
+        lf = rows
+    columns = lf.collect_schema().names()
+    compiled = [(rule, compile_rule(rule, columns, targets)) for rule in rules]
+    active = [(rule, expr) for rule, expr in compiled if expr is not None]
+    skipped = [rule["id"] for rule, expr in compiled if expr is None]
+
+    id_column = find_column(columns, '001')
+    record_id = pl.col(id_column).cast(pl.String) if id_column else pl.int_range(pl.len()).cast(pl.String)
+    checked = lf.select(
+        record_id.alias("001"),
+        *[expr.alias(f"rule_{i}") for i, (_, expr) in enumerate(active)],
+    )
+
+    words = []
+    for word in range(0, len(active), WORD_BITS):
+        bits = [
+            pl.col(f"rule_{i}").cast(pl.UInt64) * pl.lit(1 << (i - word), dtype=pl.UInt64)
+            for i in range(word, min(word + WORD_BITS, len(active)))
+        ]
+        words.append(pl.sum_horizontal(bits).alias(f"violations_{word // WORD_BITS}"))
+
+    masks = checked.select("001", *words)
+    if words:
+        masks = masks.filter(pl.any_horizontal([pl.col(word.meta.output_name()) != 0 for word in words]))
+    counts = checked.select([pl.col(f"rule_{i}").sum() for i in range(len(active))])
+
+    # Both plans share the `checked` subplan, which Polars evaluates once
+    masks, counts = pl.collect_all([masks, counts])
+    counts_row = counts.row(0) if len(active) else ()
+    summary = pl.DataFrame(
+        {
+            "bit": list(range(len(active))),
+            "rule": [rule["id"] for rule, _ in active],
+            "severity": [rule.get("severity", "warning") for rule, _ in active],
+            "message": [rule.get("message", "") for rule, _ in active],
+            "violations": list(counts_row),
+        },
+        schema={"bit": pl.UInt16, "rule": pl.String, "severity": pl.String, "message": pl.String, "violations": pl.UInt32},
+    ).sort("violations", descending=True)
+    return {'violations': masks, 'summary': summary, 'skipped': skipped}
+
+def rules_violated(masks: pl.DataFrame, bit: int) -> pl.DataFrame:
+    # Records that break the rule stored at `bit`
+    word, offset = divmod(bit, WORD_BITS)
+    return masks.filter((pl.col(f"violations_{word}") & pl.lit(1 << offset, dtype=pl.UInt64)) != 0).select("001")